@@ -0,0 +1,236 @@
+"""
+Servidor HTTP local que imita la Bot API de Telegram, para correr bot_core.py sin red.
+
+Implementa lo que usa el bot: getMe, getUpdates (long polling), sendMessage,
+editMessageText, answerCallbackQuery, setWebhook y deleteWebhook. Cualquier otro
+metodo responde ok con result True.
+
+Los usuarios simulados inyectan updates con send_text / press_button y reciben lo
+que el bot envia a su chat con un callback (on_bot_message).
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+# Set up logging
+import logging
+logger = logging.getLogger(__name__)
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot",
+            "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+# Parametros que PTB manda como texto plano (el resto va codificado en JSON)
+TEXT_PARAMS = {"text", "callback_query_id", "url", "secret_token"}
+
+
+class _Server(ThreadingHTTPServer):
+    # Con la cola de listen por defecto (5) muchos chats a la vez ven conexiones rechazadas
+    # y reintentos de SYN: la prueba mediria este servidor y no al bot
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def _decode_params(handler):
+    length = int(handler.headers.get("Content-Length") or 0)
+    body = handler.rfile.read(length).decode("utf-8") if length else ""
+
+    if handler.headers.get("Content-Type", "").startswith("application/json"):
+        return json.loads(body or "{}")
+
+    params = {}
+    for key, values in parse_qs(body, keep_blank_values=True).items():
+        value = values[-1]
+        if key not in TEXT_PARAMS:
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        params[key] = value
+    return params
+
+
+class FakeTelegramAPI:
+    """
+    Estado de la API falsa: cola de updates para getUpdates y mensajes por chat.
+    Thread-safe: el servidor atiende cada request en su propio thread.
+
+    """
+
+    def __init__(self, host = "127.0.0.1", port = 0, token = "123456:BENCH"):
+        self.token = token
+        self._lock = threading.Condition()
+        self._updates = []
+        self._next_update_id = 1
+        self._next_message_id = 1
+        self._messages = {}  # (chat_id, message_id) -> mensaje
+        self.on_bot_message = None  # callback(evento, mensaje) para los usuarios simulados
+        self.calls = {}
+
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                api._handle(self)
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = _Server((host, port), Handler)
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/bot"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="fake-telegram", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        # Despierta a los getUpdates pendientes y apaga el servidor
+        with self._lock:
+            self._lock.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+    ################ HTTP ################
+
+    def _handle(self, handler):
+        prefix = f"/bot{self.token}/"
+        if not handler.path.startswith(prefix):
+            self._reply(handler, 404, {"ok": False, "error_code": 404, "description": "Not Found"})
+            return
+
+        method = handler.path[len(prefix):].split("?")[0]
+        params = _decode_params(handler)
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+        action = getattr(self, "_api_" + method, None)
+        result = action(params) if action is not None else True
+        self._reply(handler, 200, {"ok": True, "result": result})
+
+    @staticmethod
+    def _reply(handler, status, payload):
+        data = json.dumps(payload).encode("utf-8")
+        try:
+            handler.send_response(status)
+            handler.send_header("Content-Type", "application/json")
+            handler.send_header("Content-Length", str(len(data)))
+            handler.end_headers()
+            handler.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # El bot cerro la conexion (p.ej. un getUpdates pendiente al apagarse)
+            pass
+
+    ################ Metodos de la Bot API ################
+
+    def _api_getMe(self, params):
+        return BOT_USER
+
+    def _api_getUpdates(self, params):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            # Telegram descarta los updates anteriores al offset confirmado
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+            while not self._updates:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._lock.wait(remaining)
+            return self._updates[:limit]
+
+    def _api_sendMessage(self, params):
+        chat_id = int(params["chat_id"])
+        with self._lock:
+            message = {
+                "message_id": self._next_message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+            if "reply_markup" in params:
+                message["reply_markup"] = params["reply_markup"]
+            self._next_message_id += 1
+            self._messages[(chat_id, message["message_id"])] = message
+
+        self._notify("sendMessage", message)
+        return message
+
+    def _api_editMessageText(self, params):
+        key = (int(params["chat_id"]), int(params["message_id"]))
+        with self._lock:
+            message = dict(self._messages.get(key) or {"message_id": key[1], "date": int(time.time()),
+                                                        "chat": {"id": key[0], "type": "private"},
+                                                        "from": BOT_USER})
+            message["text"] = params.get("text", "")
+            message.pop("reply_markup", None)
+            if "reply_markup" in params:
+                message["reply_markup"] = params["reply_markup"]
+            self._messages[key] = message
+
+        self._notify("editMessageText", message)
+        return message
+
+    def _api_answerCallbackQuery(self, params):
+        return True
+
+    def _api_setWebhook(self, params):
+        return True
+
+    def _api_deleteWebhook(self, params):
+        return True
+
+    def _notify(self, event, message):
+        if self.on_bot_message is not None:
+            self.on_bot_message(event, message)
+
+    ################ Usuarios simulados ################
+
+    def _push(self, update):
+        with self._lock:
+            update["update_id"] = self._next_update_id
+            self._next_update_id += 1
+            self._updates.append(update)
+            self._lock.notify_all()
+
+    @staticmethod
+    def _user(chat_id):
+        return {"id": chat_id, "is_bot": False, "first_name": f"Usuario {chat_id}", "username": f"user{chat_id}"}
+
+    def send_text(self, chat_id, text):
+        with self._lock:
+            message_id = self._next_message_id
+            self._next_message_id += 1
+
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": self._user(chat_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            command = text.split()[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        self._push({"message": message})
+
+    def press_button(self, chat_id, message, data):
+        # message: el mensaje del bot que tiene el teclado
+        self._push({"callback_query": {
+            "id": f"{chat_id}-{message['message_id']}-{data}",
+            "from": self._user(chat_id),
+            "chat_instance": str(chat_id),
+            "message": message,
+            "data": data,
+        }})
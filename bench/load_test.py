@@ -0,0 +1,362 @@
+"""
+Prueba de carga de bot_core.py contra una Bot API falsa local (sin red ni Telegram).
+
+Simula N chats que llegan como un proceso de Poisson (--rate chats/s) y recorren
+conversaciones guionadas:
+    comercial : /start -> boton "Asistencia comercial" -> PROV -> DEPTO -> LOCAL
+    tecnica   : /start -> boton "Asistencia tecnica" -> preguntas (QNA) -> /cancel
+
+Por cada estado mide la latencia desde que el usuario envia el update hasta que
+llega la respuesta del bot que cierra ese paso, y reporta throughput y p50/p95/p99.
+Los pasos vencidos (--timeout) se informan aparte: las conversaciones con alguno no
+cuentan para la duracion ni el throughput, que si no medirian la espera del timeout.
+
+Uso (desde la raiz del repo):
+    python bench/load_test.py --chats 200 --rate 20 --rag-latency 1.5
+    python bench/load_test.py --chats 200 --rate 20 --json bench_actual.json --comparar bench_base.json
+
+Con --rag-latency el RAG se reemplaza por una espera fija (mide el bot, no los
+modelos); sin esa opcion se usa el RAG real y se necesitan los modelos descargados.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import types
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from fake_telegram_api import FakeTelegramAPI
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT / "src"))
+sys.path.append(str(ROOT / "config"))
+
+# Set up logging
+import logging
+logger = logging.getLogger("load_test")
+
+PERCENTILES = (50, 95, 99)
+
+QUESTIONS = [
+    # Resueltas por la jerarquia de productos (respuesta directa)
+    "Cómo combato la isoca bolillera",
+    "Tengo sanguinaria en mi cultivo de avena, qué uso?",
+    "Qué uso contra la Mosca Blanca?",
+    # Abiertas (RAG completo)
+    "Que dosis de herbicida uso en presiembra?",
+    "Se puede mezclar con glifosato?",
+]
+
+# Mensajes intermedios del bot que no cierran el paso QNA
+QNA_ACKS = ("Procesando su consulta", "El asistente tecnico se esta iniciando")
+QNA_REJECTED = "Estamos recibiendo muchas consultas"
+
+
+############################### SETUP ###############################
+
+def _import_bot(token):
+    # bot_core importa config/cfg.py; si no existe usamos uno minimo para la prueba
+    try:
+        import cfg  # noqa: F401
+    except ImportError:
+        cfg = types.ModuleType("cfg")
+        cfg.TOKEN_BOT = token
+        sys.modules["cfg"] = cfg
+
+    import bot_core
+    return bot_core
+
+
+def _simulated_rag(latency):
+    def rag(query):
+        time.sleep(latency)
+        return f"Respuesta simulada a: {query}"
+    return rag
+
+
+def _locations(n, seed):
+    # Ubicaciones reales del CSV de representantes, asi la busqueda encuentra resultados
+    df = pd.read_csv(ROOT / "datasets" / "processed" / "merged_RTV.csv")
+    df = df[['Provincia', 'Departamento / Partido', 'localidad']].dropna().drop_duplicates()
+    return list(df.sample(n=n, replace=True, random_state=seed).itertuples(index=False, name=None))
+
+
+############################### METRICAS ###############################
+
+class Recorder:
+
+    def __init__(self):
+        self.latencies = {}
+        self.outcomes = {}
+        self.conversations = 0
+        self.timed_out = 0
+        self.steps = 0
+        self.last_end = 0.0
+
+    def end_conversation(self, elapsed, steps, timed_out):
+        # elapsed: segundos desde el inicio de la prueba hasta el fin de la conversacion
+        if timed_out:
+            self.timed_out += 1
+        else:
+            self.conversations += 1
+            self.steps += steps
+            self.last_end = max(self.last_end, elapsed)
+
+    def add(self, state, seconds, outcome = "ok"):
+        counts = self.outcomes.setdefault(state, {})
+        counts[outcome] = counts.get(outcome, 0) + 1
+        if outcome == "ok":
+            self.latencies.setdefault(state, []).append(seconds)
+
+    def report(self):
+        duration = self.last_end
+        states = {}
+        for state, counts in self.outcomes.items():
+            values = np.asarray(self.latencies.get(state, []), dtype=float) * 1000
+            row = {"n": sum(counts.values()), "errores": {k: v for k, v in counts.items() if k != "ok"}}
+            if len(values):
+                row.update({f"p{p}_ms": float(np.percentile(values, p)) for p in PERCENTILES})
+                row["max_ms"] = float(values.max())
+            states[state] = row
+
+        timeouts = sum(counts.get("timeout", 0) for counts in self.outcomes.values())
+        return {
+            "duracion_s": duration,
+            "conversaciones": self.conversations,
+            "conversaciones_vencidas": self.timed_out,
+            "pasos_vencidos": timeouts,
+            "conversaciones_por_s": self.conversations / duration if duration else 0.0,
+            "pasos_por_s": self.steps / duration if duration else 0.0,
+            "estados": states,
+        }
+
+
+def print_report(report):
+    print(f"\nDuracion {report['duracion_s']:.1f}s - {report['conversaciones']} conversaciones "
+          f"({report['conversaciones_por_s']:.2f}/s, {report['pasos_por_s']:.2f} pasos/s)\n")
+    if report["pasos_vencidos"]:
+        print(f"ATENCION: {report['pasos_vencidos']} pasos vencidos en {report['conversaciones_vencidas']} "
+              f"conversaciones (fuera de la duracion y el throughput)\n")
+    print(f"{'estado':<8}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}  errores")
+    for state, row in report["estados"].items():
+        values = "".join(f"{row.get(key, float('nan')):>10.1f}" for key in ("p50_ms", "p95_ms", "p99_ms", "max_ms"))
+        print(f"{state:<8}{row['n']:>6}{values}  {row['errores'] or ''}")
+
+
+def compare(report, baseline, tolerance):
+    # Regresion: pasos vencidos que la base no tenia, o el p95 de algun estado empeora
+    # mas que la tolerancia relativa
+    regressions = []
+    if report["pasos_vencidos"] > baseline.get("pasos_vencidos", 0):
+        regressions.append(f"pasos vencidos: {report['pasos_vencidos']} (base {baseline.get('pasos_vencidos', 0)})")
+    for state, row in report["estados"].items():
+        base = baseline["estados"].get(state, {}).get("p95_ms")
+        if base and row.get("p95_ms", float("inf")) > base * (1 + tolerance):
+            regressions.append(f"{state}: p95 {row.get('p95_ms', float('nan')):.1f} ms (base {base:.1f} ms)")
+    return regressions
+
+
+############################### USUARIOS SIMULADOS ###############################
+
+class SimulatedChat:
+
+    def __init__(self, chat_id, api, recorder, step_timeout, think):
+        self.chat_id = chat_id
+        self.api = api
+        self.recorder = recorder
+        self.step_timeout = step_timeout
+        self.think = think
+        self.timed_out = False
+        self.steps = 0
+        self.inbox = asyncio.Queue()
+
+    async def step(self, state, action, done):
+        """
+        Ejecuta action (envia el update) y espera el mensaje del bot para el que
+        done(evento, mensaje) devuelve un resultado ("ok", "fin", "rechazada", ...).
+
+        """
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        action()
+
+        try:
+            while True:
+                remaining = self.step_timeout - (loop.time() - start)
+                event, message = await asyncio.wait_for(self.inbox.get(), max(remaining, 0))
+                outcome = done(event, message)
+                if outcome is not None:
+                    break
+        except asyncio.TimeoutError:
+            self.timed_out = True
+            self.recorder.add(state, loop.time() - start, "timeout")
+            return "timeout", None
+
+        self.steps += 1
+        self.recorder.add(state, loop.time() - start, "ok" if outcome in ("ok", "fin") else outcome)
+        if self.think:
+            await asyncio.sleep(self.think)
+        return outcome, message
+
+    async def start(self, option):
+        outcome, keyboard = await self.step(
+            "START", lambda: self.api.send_text(self.chat_id, "/start"),
+            lambda event, msg: "ok" if event == "sendMessage" and "reply_markup" in msg else None)
+        if outcome != "ok":
+            return False
+
+        outcome, _ = await self.step(
+            "QT", lambda: self.api.press_button(self.chat_id, keyboard, option),
+            lambda event, msg: "ok" if event == "editMessageText" else None)
+        return outcome == "ok"
+
+    async def commercial(self, location):
+        provincia, departamento, localidad = location
+        if not await self.start("1"):
+            return
+
+        def prompt(prefix):
+            def done(event, msg):
+                if event != "sendMessage":
+                    return None
+                if "/start" in msg["text"]:
+                    return "fin"
+                return "ok" if msg["text"].startswith(prefix) else None
+            return done
+
+        for state, text, prefix in (("PROV", provincia, "Perfecto, por favor"),
+                                    ("DEPTO", departamento, "Y finalmente"),
+                                    ("LOCAL", localidad, None)):
+            outcome, _ = await self.step(state, lambda text=text: self.api.send_text(self.chat_id, text),
+                                         prompt(prefix or "/start"))
+            if outcome != "ok":
+                return
+
+    async def technical(self, questions):
+        if not await self.start("2"):
+            return
+
+        def answered(event, msg):
+            if event != "sendMessage" or msg["text"].startswith(QNA_ACKS):
+                return None
+            return "rechazada" if msg["text"].startswith(QNA_REJECTED) else "ok"
+
+        for question in questions:
+            await self.step("QNA", lambda question=question: self.api.send_text(self.chat_id, question), answered)
+
+        await self.step("CANCEL", lambda: self.api.send_text(self.chat_id, "/cancel"),
+                        lambda event, msg: "ok" if msg["text"].startswith("Adios") else None)
+
+
+############################### MAIN ###############################
+
+async def run(args):
+    bot_core = _import_bot("123456:BENCH")
+    import data_validation as dv
+    import rag_worker
+
+    api = FakeTelegramAPI(token="123456:BENCH").start()
+
+    if args.rag_latency is not None:
+        bot_core.rag_pool = rag_worker.RagPool(_simulated_rag(args.rag_latency),
+                                               workers=getattr(bot_core.rag_pool, "workers", 4),
+                                               max_pending=bot_core.rag_pool.max_pending)
+        bot_core.rag_streaming = False
+
+    # Los indices de ubicaciones se cargan antes de medir (estado estable del bot)
+    dv.get_index("RTV")
+    dv.get_index("DTM")
+
+    loop = asyncio.get_running_loop()
+    recorder = Recorder()
+    chats = {}
+
+    def on_bot_message(event, message):
+        chat = chats.get(message["chat"]["id"])
+        if chat is not None:
+            loop.call_soon_threadsafe(chat.inbox.put_nowait, (event, message))
+
+    api.on_bot_message = on_bot_message
+
+    rng = random.Random(args.seed)
+    locations = _locations(args.chats, args.seed)
+
+    application = bot_core.build_application(api.token, base_url=api.base_url)
+    async with application:
+        if args.rag_latency is None:
+            await bot_core.post_init(application)
+        else:
+            bot_core.rg.load_gazetteer()
+        await application.start()
+        await application.updater.start_polling(timeout=1)
+
+        start = time.perf_counter()
+
+        async def conversation(i):
+            chat = chats[1000 + i] = SimulatedChat(1000 + i, api, recorder, args.timeout, args.think)
+            if rng.random() < args.mix:
+                await chat.technical(rng.sample(QUESTIONS, k=min(args.preguntas, len(QUESTIONS))))
+            else:
+                await chat.commercial(locations[i])
+            recorder.end_conversation(time.perf_counter() - start, chat.steps, chat.timed_out)
+
+        tasks = []
+        for i in range(args.chats):
+            tasks.append(asyncio.create_task(conversation(i)))
+            await asyncio.sleep(rng.expovariate(args.rate))
+        await asyncio.gather(*tasks)
+
+        await application.updater.stop()
+        await application.stop()
+        await bot_core.post_shutdown(application)
+
+    api.stop()
+    return recorder.report()
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Prueba de carga del bot contra una Bot API falsa")
+    parser.add_argument("--chats", type=int, default=50, help="cantidad de conversaciones simuladas")
+    parser.add_argument("--rate", type=float, default=5.0, help="llegadas de chats por segundo (Poisson)")
+    parser.add_argument("--mix", type=float, default=0.5, help="fraccion de conversaciones tecnicas")
+    parser.add_argument("--preguntas", type=int, default=2, help="preguntas por conversacion tecnica")
+    parser.add_argument("--think", type=float, default=0.5, help="segundos entre pasos de un mismo chat")
+    parser.add_argument("--timeout", type=float, default=60.0, help="espera maxima por paso (s)")
+    parser.add_argument("--rag-latency", type=float, default=None,
+                        help="reemplaza el RAG por una espera fija de estos segundos")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="guarda el reporte en este archivo")
+    parser.add_argument("--comparar", help="reporte base (JSON) contra el que detectar regresiones de p95")
+    parser.add_argument("--tolerancia", type=float, default=0.2, help="empeoramiento relativo tolerado del p95")
+    args = parser.parse_args(argv)
+
+    # El bot se corre desde src (rutas relativas de rag.py)
+    os.chdir(ROOT / "src")
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                        force=True)
+
+    report = asyncio.run(run(args))
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.comparar:
+        with open(args.comparar, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerancia)
+        for line in regressions:
+            print("REGRESION " + line)
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""
+Prueba local del modo webhook, sin Telegram: levanta el bot con el servidor webhook
+de PTB (mismos parametros que bot_core.run) apuntando a la Bot API falsa, le hace
+POST de updates en JSON y verifica que responda.
+
+Uso (desde la raiz del repo):
+    python bench/webhook_smoke.py
+
+Tambien sirve a mano contra un bot corriendo con BOT_MODE = "webhook":
+    curl -X POST http://127.0.0.1:8443/telegram -H 'Content-Type: application/json' \\
+         -H 'X-Telegram-Bot-Api-Secret-Token: <WEBHOOK_SECRET>' \\
+         -d '{"update_id": 1, "message": {"message_id": 1, "date": 0, "text": "/start",
+              "chat": {"id": 1000, "type": "private"}, "from": {"id": 1000, "is_bot": false, "first_name": "A"},
+              "entities": [{"type": "bot_command", "offset": 0, "length": 6}]}}'
+"""
+import asyncio
+import json
+import os
+import socket
+import sys
+import urllib.error
+import urllib.request
+
+from fake_telegram_api import FakeTelegramAPI
+from load_test import ROOT, _import_bot
+
+# Set up logging
+import logging
+logger = logging.getLogger("webhook_smoke")
+
+TOKEN = "123456:BENCH"
+SECRET = "secreto-local"
+CHAT_ID = 1000
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _start_update(update_id):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": "/start",
+            "chat": {"id": CHAT_ID, "type": "private"},
+            "from": {"id": CHAT_ID, "is_bot": False, "first_name": "Usuario", "username": "usuario"},
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+        },
+    }
+
+
+def _post(url, payload, secret):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode("utf-8"), method="POST",
+                                     headers={"Content-Type": "application/json",
+                                              "X-Telegram-Bot-Api-Secret-Token": secret})
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+async def run():
+    bot_core = _import_bot(TOKEN)
+    api = FakeTelegramAPI(token=TOKEN).start()
+
+    loop = asyncio.get_running_loop()
+    received = asyncio.Queue()
+    api.on_bot_message = lambda event, message: loop.call_soon_threadsafe(received.put_nowait, message)
+
+    port = _free_port()
+    # Sin proxy: la URL publica es la direccion local del bot
+    bot_core.cfg.WEBHOOK_URL = f"http://127.0.0.1:{port}/telegram"
+    options = dict(bot_core.webhook_settings(), listen="127.0.0.1", port=port,
+                   url_path="telegram", secret_token=SECRET)
+    url = options["webhook_url"]
+
+    application = bot_core.build_application(TOKEN, base_url=api.base_url)
+    async with application:
+        await application.start()
+        await application.updater.start_webhook(**options)
+
+        # Secreto incorrecto: el servidor lo rechaza sin procesar el update
+        status = await asyncio.to_thread(_post, url, _start_update(1), "otro")
+        assert status == 403, f"se esperaba 403 con secreto invalido, se obtuvo {status}"
+
+        status = await asyncio.to_thread(_post, url, _start_update(2), SECRET)
+        assert status == 200, f"POST al webhook devolvio {status}"
+
+        replies = [await asyncio.wait_for(received.get(), 10) for _ in range(2)]
+        assert "reply_markup" in replies[-1], "el /start deberia responder con el teclado de opciones"
+
+        await application.updater.stop()
+        await application.stop()
+
+    api.stop()
+    assert api.calls.get("setWebhook") == 1, "no se registro el webhook"
+    print(f"OK: webhook en {url} respondio el /start ({len(replies)} mensajes)")
+
+
+if __name__ == "__main__":
+    os.chdir(ROOT / "src")
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                        force=True)
+    asyncio.run(run())
+    sys.exit(0)
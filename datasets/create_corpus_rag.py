@@ -1,9 +1,7 @@
 import pandas as pd
-import spacy
-from nltk.corpus import stopwords
-from nltk.stem import SnowballStemmer
 
-import pickle
+import sys
+from pathlib import Path
 from transformers import AutoTokenizer, AutoModel, pipeline
 from sentence_transformers import SentenceTransformer
 from sklearn.feature_extraction.text import TfidfVectorizer
@@ -12,10 +10,18 @@ from sklearn.feature_extraction.text import TfidfVectorizer
 import torch
 from transformers import pipeline
 
+import argparse
 import logging
 import os
 import json
 
+# Modulos del bot (formato de embeddings)
+sys.path.append(str(Path(__file__).resolve().parent.parent / "src"))
+import embedding_store
+from bm25 import BM25Index
+import bm25
+from text_preprocessing import Preprocessor
+
 ###################################### Set up ######################################
 
 # Configure logging
@@ -23,12 +29,18 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 
 # Path to dataset
 PATH_TO_TRAIN = os.path.abspath('..') + "/CA_chatbot/datasets/textorag/grafo_hierarquia.json"
+PATH_TO_EMBEDDINGS = "./datasets/textorag"
+
+parser = argparse.ArgumentParser(description="Crea el corpus del RAG y sus embeddings")
+parser.add_argument("--chunk-size", type=int, default=256, help="documentos vectorizados por bloque")
+parser.add_argument("--workers", type=int, default=1, help="procesos del encoder (CPU)")
+parser.add_argument("--full", action="store_true", help="re-vectoriza todo el corpus")
+args = parser.parse_args()
 
 # Initialize SpaCy and Hugging Face Models
 logging.info("Loading SpaCy and Hugging Face models for entity recognition and embeddings.")
-nlp = spacy.load("es_core_news_sm")  # Spanish model for entity recognition
-stop_words = set(stopwords.words('spanish'))
-stemmer = SnowballStemmer('spanish')
+# Mismo preprocesamiento que se aplica a las queries en rag.py (lemas, sin stopwords ni puntuacion)
+preprocessor = Preprocessor("es_core_news_sm")
 
 tokenizer = AutoTokenizer.from_pretrained("sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
 model = AutoModel.from_pretrained("sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
@@ -78,43 +90,44 @@ df['texto'] = df.apply(
 )
 
 
-# Creamos corpus y lo guardamos en un .txt
+# Creamos corpus (se guarda en el .txt junto con los embeddings)
 documents = [f'"{texto}."' for texto in df['texto']]
 
 
-# Ensure the directory exists
-os.makedirs("./datasets/textorag", exist_ok=True)
+### Step 3: Definimos modelo vectorizador
+logging.info("Vectorizando corpus")
 
-with open("./datasets/textorag/corpus.txt", "w", encoding="utf-8") as f:
-    f.writelines([texto + "\n" for texto in documents])
+ENCODER_NAME = "distiluse-base-multilingual-cased-v1"
+vectorizer = SentenceTransformer(ENCODER_NAME, device = device)
 
+# Se vectoriza el texto preprocesado (igual que la query); el corpus.txt guarda el original
+logging.info("Lematizando corpus y removiendo stop words")
+documents_pp = preprocessor.process_batch(documents)
 
-### Step 3: Definimos modelo vectorizador
-logging.info("Vectorizando corpus")
+# Con --workers > 1 cada bloque se reparte entre varios procesos del encoder
+pool = vectorizer.start_multi_process_pool(["cpu"] * args.workers) if args.workers > 1 else None
 
-vectorizer = SentenceTransformer("distiluse-base-multilingual-cased-v1", device = device)
-doc_vectors = vectorizer.encode(documents)
+def encode(texts):
+    if pool is not None:
+        return vectorizer.encode_multi_process(texts, pool)
+    return vectorizer.encode(texts)
 
 
 
-### Step 4: Guardamos corpus vectorizado y vectorizer.
+### Step 4: Build incremental de corpus, offsets y vectores (manifest + .npy, ver embedding_store).
+# Solo se vectorizan los documentos nuevos o modificados (con --full, todos); el manifest se
+# reemplaza al final de forma atomica, asi un bot corriendo nunca ve un indice a medio escribir.
 
-logging.info("Saving vectorized corpus & Vectorizer.")
-with open("./datasets/textorag/vectorizer_and_vectors.pkl", "wb") as f:
-    pickle.dump((vectorizer, doc_vectors), f)
-    
+logging.info("Saving corpus & vectorized corpus.")
+try:
+    manifest = embedding_store.build(PATH_TO_EMBEDDINGS, ENCODER_NAME, documents, encode,
+                                     texts=documents_pp, chunk_size=args.chunk_size,
+                                     incremental=not args.full)
+finally:
+    if pool is not None:
+        vectorizer.stop_multi_process_pool(pool)
 
 
-########################################### TO implement #########################################
-# Tokenize + stop words + Stemming.
-logging.info("Removing stop words and stemming corpus")
-def preprocess(text):
-    # Tokenizar la consulta
-    doc = nlp(text)
-    # Stemming y eliminación de stopwords
-    stemmed_tokens = [
-        stemmer-.stem(token.text.lower())
-        for token in doc
-        if token.text.lower() not in stop_words and not token.is_punct
-    ]
-    return " ".join(stemmed_tokens)
+### Step 5: Indice BM25 sobre el mismo texto lematizado (busqueda hibrida en rag.py)
+logging.info("Creando indice BM25")
+BM25Index.from_texts(documents_pp).save(os.path.join(PATH_TO_EMBEDDINGS, bm25.INDEX_NAME), manifest["corpus"])
@@ -1,88 +1,172 @@
-import networkx as nx
-import pandas as pd
+import argparse
 import json
 
-# Cargar los datos desde el archivo CSV
-data = pd.read_csv("datasets/textorag/productos.csv", delimiter=",")
-
-# Crear el grafo dirigido para representar la jerarquía
-G = nx.DiGraph()
-
-# Agregar nodos y relaciones jerárquicas basadas en las columnas
-for _, row in data.iterrows():
-    # Crear nodo de cultivo si no existe
-    G.add_node(row['nme_crop'], tipo="cultivo")
-    
-    # Crear nodo de producto si no existe
-    if row['nme_product'] not in G:
-        G.add_node(row['nme_product'], tipo="producto")
-    G.add_edge(row['nme_crop'], row['nme_product'], relacion="tiene_producto")
-    
-    '''
-    # Crear nodos de plaga y aplicación
-    if row['nme_target_scientific'] not in G:
-        G.add_node(row['nme_target_scientific'], tipo="plaga")
-    G.add_edge(row['nme_product'], row['nme_target_scientific'], relacion="controla")
-    '''
-    # Crear nodos de plaga y aplicación
-    if row['nme_target'] not in G:
-        G.add_node(row['nme_target'], tipo="plaga")
-    G.add_edge(row['nme_product'], row['nme_target'], relacion="controla")
-    
-    
-    # Crear nodo para momento de aplicación si no es NaN
-    if pd.notna(row['dsc_applic_period']):
-        G.add_node(row['dsc_applic_period'], tipo="aplicacion")
-        G.add_edge(row['nme_target'], row['dsc_applic_period'], relacion="momento_aplicacion")
-
-# Convertir el grafo a formato JSON jerárquico
-grafo_json = {}
-
-# Iterar sobre los nodos y construir la estructura JSON
-for node in G.nodes:
-    tipo = G.nodes[node]['tipo']
-    
-    if tipo == "cultivo":
-        # Crear la estructura para cada cultivo
-        if node not in grafo_json:
-            grafo_json[node] = {"Productos": {}}
-    
-    elif tipo == "producto":
-        # Agregar cada producto al cultivo correspondiente
-        for parent in G.predecessors(node):
-            if parent not in grafo_json:
-                grafo_json[parent] = {"Productos": {}}
-            if node not in grafo_json[parent]["Productos"]:
-                grafo_json[parent]["Productos"][node] = {"Controla a": {}}
-
-    elif tipo == "plaga":
-        # Agregar cada plaga al producto correspondiente
-        for parent in G.predecessors(node):
-            for grandparent in G.predecessors(parent):
-                # Asegurarse de que las claves existen
-                if grandparent not in grafo_json:
-                    grafo_json[grandparent] = {"Productos": {}}
-                if parent not in grafo_json[grandparent]["Productos"]:
-                    grafo_json[grandparent]["Productos"][parent] = {"Controla a": {}}
-                if node not in grafo_json[grandparent]["Productos"][parent]["Controla a"]:
-                    grafo_json[grandparent]["Productos"][parent]["Controla a"][node] = {"Momento de aplicacion": []}
-    
-    elif tipo == "aplicacion":
-        # Agregar el momento de aplicación a la plaga correspondiente
-        for parent in G.predecessors(node):
-            for grandparent in G.predecessors(parent):
-                for ancestor in G.predecessors(grandparent):
-                    # Asegurarse de que las claves existen antes de agregar momentos de aplicación
-                    if ancestor not in grafo_json:
-                        grafo_json[ancestor] = {"Productos": {}}
-                    if grandparent not in grafo_json[ancestor]["Productos"]:
-                        grafo_json[ancestor]["Productos"][grandparent] = {"Controla a": {}}
-                    if parent not in grafo_json[ancestor]["Productos"][grandparent]["Controla a"]:
-                        grafo_json[ancestor]["Productos"][grandparent]["Controla a"][parent] = {"Momento de aplicacion": []}
-                    grafo_json[ancestor]["Productos"][grandparent]["Controla a"][parent]["Momento de aplicacion"].append(node)
-
-# Guardar la estructura jerárquica en un archivo JSON
-with open("datasets/textorag/grafo_hierarquia.json", "w", encoding="utf-8") as file:
-    json.dump(grafo_json, file, indent=4, ensure_ascii=False)
-
-print("Estructura jerárquica guardada en grafo_hierarquia.json")
+import numpy as np
+import pandas as pd
+
+# Genera grafo_hierarquia.json (cultivo -> producto -> plaga -> momentos de aplicacion)
+# a partir de productos.csv.
+#
+# La version original armaba un networkx.DiGraph fila por fila y despues recorria los
+# predecesores de cada nodo. Aca se reproduce exactamente el mismo resultado (incluido
+# el orden de las claves y de los momentos) con operaciones agrupadas sobre DataFrames:
+#   - los nodos son unicos por nombre, aunque un mismo nombre aparezca como cultivo y
+#     como plaga; su tipo es el del ultimo add_node que lo piso (cultivo o aplicacion)
+#     o, si nunca lo pisaron, el de su primera aparicion (producto o plaga)
+#   - las aristas son unicas por (origen, destino) y los predecesores de un nodo se
+#     recorren en el orden en que se agrego cada arista
+# El CSV se puede leer por bloques (--chunksize): el estado acumulado solo depende de
+# la cantidad de nodos y aristas distintos, no de la cantidad de filas.
+
+PATH_TO_CSV = "datasets/textorag/productos.csv"
+PATH_TO_JSON = "datasets/textorag/grafo_hierarquia.json"
+
+COLUMNS = ['nme_crop', 'nme_product', 'nme_target', 'dsc_applic_period']
+
+# Orden en que la version con networkx agregaba nodos y aristas dentro de cada fila
+NODE_ROLES = ["cultivo", "producto", "plaga", "aplicacion"]
+EDGE_SLOTS = [('nme_crop', 'nme_product'), ('nme_product', 'nme_target'), ('nme_target', 'dsc_applic_period')]
+
+# add_node(cultivo) y add_node(momento) se llamaban siempre y pisaban el tipo del nodo;
+# productos y plagas solo se agregaban si no existian
+OVERWRITING_ROLES = {"cultivo", "aplicacion"}
+
+
+def _chunk_nodes(chunk, offset):
+    # Una aparicion por (fila, rol), numeradas en el orden fila por fila original
+    rows = np.arange(offset, offset + len(chunk))
+    parts = []
+    for slot, (column, role) in enumerate(zip(COLUMNS, NODE_ROLES)):
+        part = pd.DataFrame({"node": chunk[column].to_numpy(), "pos": rows * 4 + slot, "role": role})
+        parts.append(part[part["node"].notna()])
+    appearances = pd.concat(parts, ignore_index=True)
+
+    first = appearances.sort_values("pos").drop_duplicates("node")
+    first = first.rename(columns={"pos": "first_pos", "role": "first_role"})
+
+    overwriting = appearances[appearances["role"].isin(OVERWRITING_ROLES)]
+    last = overwriting.sort_values("pos").drop_duplicates("node", keep="last")
+    last = last.rename(columns={"pos": "last_pos", "role": "last_role"})
+
+    return first.merge(last, on="node", how="left")
+
+
+def _chunk_edges(chunk, offset):
+    rows = np.arange(offset, offset + len(chunk))
+    parts = []
+    for slot, (src, dst) in enumerate(EDGE_SLOTS):
+        part = pd.DataFrame({"src": chunk[src].to_numpy(), "dst": chunk[dst].to_numpy(), "pos": rows * 3 + slot})
+        parts.append(part[part["dst"].notna()])
+    edges = pd.concat(parts, ignore_index=True)
+    return edges.sort_values("pos").drop_duplicates(["src", "dst"])
+
+
+def _merge_nodes(state, new):
+    # Primera aparicion: la de menor posicion; ultima pisada: la de mayor posicion
+    nodes = pd.concat([state, new], ignore_index=True)
+    first = nodes.sort_values("first_pos").drop_duplicates("node")[["node", "first_pos", "first_role"]]
+    last = nodes.dropna(subset=["last_pos"]).sort_values("last_pos").drop_duplicates("node", keep="last")
+    return first.merge(last[["node", "last_pos", "last_role"]], on="node", how="left")
+
+
+def read_hierarchy(path = PATH_TO_CSV, chunksize = None):
+    """
+    Lee el CSV (completo o por bloques) y devuelve (nodos, aristas):
+      nodos   : node, order (orden de insercion), tipo
+      aristas : src, dst, rank (orden de insercion)
+    """
+    chunks = pd.read_csv(path, delimiter=",", usecols=COLUMNS, chunksize=chunksize)
+    if chunksize is None:
+        chunks = [chunks]
+
+    nodes, edges, offset = None, None, 0
+    for chunk in chunks:
+        chunk_nodes = _chunk_nodes(chunk, offset)
+        chunk_edges = _chunk_edges(chunk, offset)
+        offset += len(chunk)
+
+        nodes = chunk_nodes if nodes is None else _merge_nodes(nodes, chunk_nodes)
+        # Los bloques llegan en orden: las aristas ya vistas conservan su posicion
+        edges = chunk_edges if edges is None else pd.concat([edges, chunk_edges]).drop_duplicates(["src", "dst"])
+
+    nodes = nodes.sort_values("first_pos", ignore_index=True)
+    nodes["order"] = np.arange(len(nodes))
+    nodes["tipo"] = nodes["last_role"].fillna(nodes["first_role"])
+
+    edges = edges.sort_values("pos", ignore_index=True)
+    edges["rank"] = np.arange(len(edges))
+
+    return nodes[["node", "order", "tipo"]], edges[["src", "dst", "rank"]]
+
+
+def _ancestors(nodes, edges, depth):
+    # Expande cada nodo a todos sus caminos de predecesores de largo `depth`
+    # (equivalente a los for anidados sobre G.predecessors)
+    paths = nodes.rename(columns={"node": "n0"})
+    for level in range(1, depth + 1):
+        pred = edges.rename(columns={"src": f"n{level}", "dst": f"n{level - 1}", "rank": f"k{level}"})
+        paths = paths.merge(pred, on=f"n{level - 1}")
+    return paths
+
+
+def build_hierarchy(nodes, edges):
+    """
+    Arma el JSON jerarquico. Cada nodo genera, segun su tipo, una operacion por cada
+    camino de predecesores; las operaciones se aplican en el orden de la version
+    original (nodo, y luego predecesores en orden de insercion).
+    """
+    by_type = {tipo: group[["node", "order"]] for tipo, group in nodes.groupby("tipo")}
+    empty = nodes[["node", "order"]].iloc[:0]
+
+    ops = [
+        # cultivo: la raiz
+        by_type.get("cultivo", empty).rename(columns={"node": "cultivo"}),
+        # producto: (cultivo, producto)
+        _ancestors(by_type.get("producto", empty), edges, 1)
+            .rename(columns={"n1": "cultivo", "n0": "producto"}),
+        # plaga: (cultivo, producto, plaga)
+        _ancestors(by_type.get("plaga", empty), edges, 2)
+            .rename(columns={"n2": "cultivo", "n1": "producto", "n0": "plaga"}),
+        # aplicacion: (cultivo, producto, plaga) + momento
+        _ancestors(by_type.get("aplicacion", empty), edges, 3)
+            .rename(columns={"n3": "cultivo", "n2": "producto", "n1": "plaga", "n0": "momento"}),
+    ]
+    ops = pd.concat(ops, ignore_index=True)
+
+    keys = ["order", "k1", "k2", "k3"]
+    for key in keys:
+        if key not in ops:
+            ops[key] = -1
+    ops = ops.fillna({key: -1 for key in keys}).sort_values(keys, kind="stable")
+    ops = ops.reindex(columns=["cultivo", "producto", "plaga", "momento"])
+
+    grafo_json = {}
+    for cultivo, producto, plaga, momento in ops.itertuples(index=False, name=None):
+        productos = grafo_json.setdefault(cultivo, {"Productos": {}})["Productos"]
+        if pd.isna(producto):
+            continue
+        plagas = productos.setdefault(producto, {"Controla a": {}})["Controla a"]
+        if pd.isna(plaga):
+            continue
+        momentos = plagas.setdefault(plaga, {"Momento de aplicacion": []})["Momento de aplicacion"]
+        if not pd.isna(momento):
+            momentos.append(momento)
+
+    return grafo_json
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Genera grafo_hierarquia.json desde productos.csv")
+    parser.add_argument("--csv", default=PATH_TO_CSV)
+    parser.add_argument("--salida", default=PATH_TO_JSON)
+    parser.add_argument("--chunksize", type=int, default=None, help="filas por bloque al leer el CSV")
+    args = parser.parse_args()
+
+    nodes, edges = read_hierarchy(args.csv, args.chunksize)
+    grafo_json = build_hierarchy(nodes, edges)
+
+    # Guardar la estructura jerárquica en un archivo JSON
+    with open(args.salida, "w", encoding="utf-8") as file:
+        json.dump(grafo_json, file, indent=4, ensure_ascii=False)
+
+    print("Estructura jerárquica guardada en grafo_hierarquia.json")
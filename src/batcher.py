@@ -0,0 +1,79 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# Set up logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """
+    Agrupa llamadas concurrentes en lotes.
+
+    Cada llamada se encola y un thread dedicado junta los pedidos pendientes
+    durante hasta max_wait_ms milisegundos o hasta max_batch pedidos, ejecuta
+    batch_fn(items) una sola vez y devuelve a cada llamador su resultado.
+    batch_fn recibe una lista y debe devolver una lista del mismo largo y orden.
+
+    """
+
+    def __init__(self, batch_fn, max_batch = 8, max_wait_ms = 10, name = "batcher"):
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        """Encola item y devuelve un concurrent.futures.Future con su resultado."""
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item, timeout = None):
+        return self.submit(item).result(timeout)
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        # Descartamos los pedidos cancelados mientras esperaban
+        return [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if not batch:
+                continue
+
+            items = [item for item, _ in batch]
+            try:
+                results = self.batch_fn(items)
+            except Exception as e:
+                logger.error("Fallo un lote de %d pedidos: %s", len(items), e)
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.items += len(items)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
@@ -0,0 +1,142 @@
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from retrieval import top_k
+
+# Set up logging
+import logging
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "bm25_index.npz"
+
+
+def tokenize(text_pp):
+    # El texto ya viene lematizado y sin stopwords (Preprocessor): solo separamos terminos
+    return text_pp.lower().split()
+
+
+class BM25Index:
+    """
+    Indice invertido BM25 sobre el corpus lematizado.
+
+    Las listas de postings se guardan en formato CSR (un array de documentos y uno de
+    frecuencias por termino, concatenados), asi puntuar una query solo recorre los
+    documentos que contienen alguno de sus terminos.
+
+    score(q, d) = sum_t idf(t) * tf(t, d) * (k1 + 1) / (tf(t, d) + k1 * (1 - b + b * |d| / avgdl))
+
+    """
+
+    def __init__(self, vocab, postings_offsets, postings_docs, postings_tf, doc_lengths, k1 = 1.5, b = 0.75):
+        self.vocab = vocab
+        self.offsets = postings_offsets
+        self.docs = postings_docs
+        self.tf = postings_tf
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+
+        n_docs = len(doc_lengths)
+        df = np.diff(postings_offsets)
+        self.idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+        # Normalizacion por largo de documento, precalculada por documento
+        avgdl = doc_lengths.mean() if n_docs else 1.0
+        self._norm = (k1 * (1 - b + b * doc_lengths / max(avgdl, 1e-9))).astype(np.float32)
+
+    @classmethod
+    def from_texts(cls, texts_pp, k1 = 1.5, b = 0.75):
+        # texts_pp: documentos ya preprocesados (mismo Preprocessor que las queries)
+        vocab = {}
+        term_ids, doc_ids = [], []
+        doc_lengths = np.zeros(len(texts_pp), dtype=np.float32)
+
+        for doc_id, text in enumerate(texts_pp):
+            tokens = tokenize(text)
+            doc_lengths[doc_id] = len(tokens)
+            for token in tokens:
+                term_ids.append(vocab.setdefault(token, len(vocab)))
+                doc_ids.append(doc_id)
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+
+        # Pares (termino, documento) unicos con su frecuencia, ordenados por termino
+        n_docs = max(len(texts_pp), 1)
+        pairs, tf = np.unique(term_ids * n_docs + doc_ids, return_counts=True)
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(pairs // n_docs, minlength=len(vocab)))))
+
+        return cls(vocab, offsets, (pairs % n_docs).astype(np.int32), tf.astype(np.float32),
+                   doc_lengths, k1=k1, b=b)
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def _terms(self, query_pp):
+        # Terminos de la query presentes en el corpus (sin repetir)
+        return sorted({self.vocab[t] for t in tokenize(query_pp) if t in self.vocab})
+
+    def reference_score(self, query_pp):
+        # Cota del score de la query: cada termino aporta a lo sumo idf(t) * (k1 + 1)
+        # (tf muy alto). Dividir por ella deja los scores en [0, 1), en escala con el coseno.
+        return float(self.idf[self._terms(query_pp)].sum() * (self.k1 + 1))
+
+    def scores(self, query_pp):
+        """Devuelve (documentos candidatos, scores) de los documentos con algun termino de la query."""
+        terms = self._terms(query_pp)
+        if not terms:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.float32)
+
+        docs = np.concatenate([self.docs[self.offsets[t]:self.offsets[t + 1]] for t in terms])
+        tf = np.concatenate([self.tf[self.offsets[t]:self.offsets[t + 1]] for t in terms])
+        idf = np.concatenate([np.full(self.offsets[t + 1] - self.offsets[t], self.idf[t]) for t in terms])
+
+        partial = idf * tf * (self.k1 + 1) / (tf + self._norm[docs])
+        candidates, inverse = np.unique(docs, return_inverse=True)
+        return candidates, np.bincount(inverse, weights=partial).astype(np.float32)
+
+    def search(self, query_pp, k = 10, normalize = True):
+        """
+        Top-k (scores, indices) de la query preprocesada. Con normalize los scores se
+        dividen por reference_score() y quedan en [0, 1), asi se pueden fusionar con el
+        coseno. Un documento de largo promedio con cada termino una vez da 1 / (k1 + 1).
+
+        """
+        candidates, scores = self.scores(query_pp)
+        if len(candidates) == 0:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+
+        if normalize:
+            scores = scores / self.reference_score(query_pp)
+
+        best, idx = top_k(scores[None, :], k)
+        return best[0], candidates[idx[0]]
+
+    ################ Persistencia ################
+
+    def save(self, path, corpus_id):
+        # corpus_id ata el indice a una version del corpus (ver embedding_store)
+        path = Path(path)
+        tmp = path.with_name(path.name + ".tmp.npz")
+        np.savez(tmp, offsets=self.offsets, docs=self.docs, tf=self.tf, doc_lengths=self.doc_lengths,
+                 meta=np.array(json.dumps({"corpus": corpus_id, "k1": self.k1, "b": self.b,
+                                           "vocab": self.vocab}, ensure_ascii=False)))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path, corpus_id):
+        # Devuelve None si no existe o corresponde a otra version del corpus
+        path = Path(path)
+        if not path.is_file():
+            return None
+
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta["corpus"] != corpus_id:
+                logger.info("Indice BM25 desactualizado (%s), se reconstruye", meta["corpus"])
+                return None
+            return cls(meta["vocab"], data["offsets"], data["docs"], data["tf"], data["doc_lengths"],
+                       k1=meta["k1"], b=meta["b"])
@@ -6,10 +6,18 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (filters, MessageHandler, Application,
                           CommandHandler, CallbackQueryHandler, ContextTypes,
-                          ConversationHandler)
+                          ConversationHandler, PersistenceInput)
 import data_validation as dv
 import rag as rg
-import time
+from sessions import SessionStore
+from persistence import StateStore, SQLitePersistence
+from rag_worker import RagPool, PoolSaturado, threads_per_worker
+from rag_client import RagClient
+from update_processor import PerChatUpdateProcessor
+import metrics
+import asyncio
+import functools
+import secrets
 from datetime import datetime, timedelta
 
 # Set up logging
@@ -39,25 +47,55 @@ except ImportError as e:
 
 ########################### GLOBAL VARIALBES ###########################
 
-# Storing timestamp of the last /start command
-last_start_time = None
-
-# User data
-query_type = None #RTV or DTM
-provincia = None
-departamento = None
-localidad = None
-search_flag = 0 # Nos permite buscar solo por provincia cuando no encuentra departamento y localidad
+# Estado persistente (SQLite): sesiones y posicion en la conversacion sobreviven a un reinicio
+state_store = None
+if getattr(cfg, 'PERSISTENCE_PATH', None):
+    state_store = StateStore(cfg.PERSISTENCE_PATH, write_interval=getattr(cfg, 'PERSISTENCE_WRITE_INTERVAL', 1.0))
+
+# User data: una sesion por chat (query_type, provincia, departamento, localidad)
+sessions = SessionStore(ttl=getattr(cfg, 'SESSION_TTL', 1800), store=state_store)
+
+# Pool donde corre el RAG, fuera del event loop. Con el executor 'fork' los modelos se cargan
+# una vez en el forkserver (rag_forkserver.py) y los workers los comparten (ver run). Los workers
+# importan este modulo (multiprocessing lo hace con el script principal), asi que lo que se crea
+# a nivel de modulo no arranca threads ni procesos.
+# Con RAG_SERVICE_URL los modelos viven en otro proceso (rag_service.py) y el bot solo es cliente.
+rag_workers = getattr(cfg, 'RAG_WORKERS', 4)
+if getattr(cfg, 'RAG_SERVICE_URL', None):
+    rag_pool = RagClient(cfg.RAG_SERVICE_URL,
+                         max_pending=getattr(cfg, 'RAG_QUEUE_SIZE', 8),
+                         timeout=getattr(cfg, 'RAG_SERVICE_TIMEOUT', 30.0),
+                         retries=getattr(cfg, 'RAG_SERVICE_RETRIES', 3))
+else:
+    rag_pool = RagPool(rg.rag,
+                       workers=rag_workers,
+                       max_pending=getattr(cfg, 'RAG_QUEUE_SIZE', 8),
+                       executor=getattr(cfg, 'RAG_EXECUTOR', 'thread'),
+                       initializer=rg.init_worker,
+                       initargs=(getattr(cfg, 'RAG_TORCH_THREADS', None) or threads_per_worker(rag_workers),
+                                 getattr(cfg, 'RAG_WARMUP', True)),
+                       preload_module="rag_forkserver")
+
+# Respuestas del RAG de a partes (editando el mensaje), solo con el executor 'thread'
+rag_streaming = getattr(cfg, 'RAG_STREAMING', False) and rag_pool.executor == "thread"
+stream_edit_interval = getattr(cfg, 'RAG_STREAM_EDIT_INTERVAL', 1.0) # segundos entre ediciones (limite de Telegram)
 
 QT, QNA, PROV, DEPTO, LOCAL, BUSQUEDA = range(6)
 
+# Metricas: duracion de cada handler por estado de la conversacion, cola del RAG y sesiones
+HANDLER_SECONDS = metrics.histogram("bot_handler_segundos", "Duracion de los handlers por estado", ["estado"])
+HANDLER_ERRORS = metrics.counter("bot_handler_errores", "Excepciones en los handlers por estado", ["estado"])
+metrics.gauge("rag_pool_pendientes", "Consultas RAG en curso o en cola", func=lambda: rag_pool.pending)
+metrics.gauge("bot_sesiones_activas", "Sesiones de chat en memoria", func=lambda: len(sessions))
+
 ########################### BOT FUNCTIONS ###########################
 
 # Start command handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     
-    global last_start_time
-    last_start_time = datetime.now()
+    session = sessions.get(update.effective_chat.id)
+    session.reset()
+    session.last_start_time = datetime.now()
     
     await context.bot.send_message(chat_id=update.effective_chat.id, 
                                    text="Bienvenido, por favor indique el motivo de asistencia:")
@@ -75,7 +113,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 # Echo handler  - Indica al usuario como iniciar el bot.
 async def echo_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
-    global last_start_time
+    last_start_time = sessions.get(update.effective_chat.id).last_start_time
     
     if last_start_time is None or datetime.now() - last_start_time > timedelta(minutes=5):
         await context.bot.send_message(chat_id=update.effective_chat.id,
@@ -87,22 +125,22 @@ async def echo_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # Button callback handler - Primer filtro. 
 async def query_type_button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
     
-    global query_type
+    session = sessions.get(update.effective_chat.id)
     
     query = update.callback_query
     await query.answer()
 
     if query.data == '1':
         response_text = "Para contactarlo con un tecnico de ventas, necesitaremos que nos indique en que provincia se halla:"
-        query_type = "RTV"
+        session.query_type = "RTV"
     else: #query.data == '2'
         response_text = "Quisiera realizarle alguna pregunta tecnica a nuestro bot? De lo contrario tipea /next."
-        query_type = "DTM"
+        session.query_type = "DTM"
     
     await query.edit_message_text(text=response_text)
     logger.info("User %s selected option %s", query.from_user.username, query.data)
     
-    if query_type == "DTM":
+    if session.query_type == "DTM":
         logger.info("Transitioning to QNA state")
         return QNA
     
@@ -118,13 +156,76 @@ async def qna_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Por favor indique su pregunta.")
         return QNA
     
+    # Preguntas que resuelve la jerarquia de productos: respuesta inmediata, sin pasar por el RAG
+    answer = rg.structured_answer(user_query)
+    if answer is not None:
+        await update.message.reply_text(answer)
+        return QNA
+    
     logging.info("Iniciando RAG ..")
     
-    # Pasamos la query al rag:
-    response = rg.rag(user_query)
-    await update.message.reply_text(response)
+    # Pasamos la query al rag (en el pool, no bloquea al resto de los chats):
+    try:
+        if rag_streaming:
+            response = rag_pool.stream(rg.rag_stream, user_query)
+        else:
+            response = rag_pool.submit(user_query)
+    except PoolSaturado:
+        await update.message.reply_text("Estamos recibiendo muchas consultas, por favor intente nuevamente en unos minutos.")
+        return QNA
+    
+    if rg.is_ready() or rag_pool.executor != "thread":
+        await update.message.reply_text("Procesando su consulta, en unos segundos le respondo..")
+    else:
+        await update.message.reply_text("El asistente tecnico se esta iniciando, su consulta sera respondida en cuanto este listo..")
+    
+    if rag_streaming:
+        context.application.create_task(stream_rag_answer(update, response), update=update)
+    else:
+        context.application.create_task(send_rag_answer(update, response), update=update)
     return QNA
 
+# Envia la respuesta del RAG cuando esta lista
+async def send_rag_answer(update: Update, response):
+    try:
+        answer = await response
+    except PoolSaturado:
+        # Con el servicio RAG la cola llena se conoce recien en la respuesta (503)
+        answer = "Estamos recibiendo muchas consultas, por favor intente nuevamente en unos minutos."
+    except Exception as e:
+        logger.error("Fallo el RAG: %s", e)
+        answer = "No hemos podido procesar su consulta, comuniquese con un experto."
+    
+    await update.message.reply_text(answer)
+
+# Envia la respuesta del RAG a medida que se genera: un primer mensaje y luego ediciones espaciadas
+async def stream_rag_answer(update: Update, chunks):
+    loop = asyncio.get_running_loop()
+    message = None
+    shown = ""
+    answer = ""
+    last_edit = 0.0
+    
+    try:
+        async for answer in chunks:
+            if message is None:
+                message = await update.message.reply_text(answer)
+                shown = answer
+                last_edit = loop.time()
+            elif answer != shown and loop.time() - last_edit >= stream_edit_interval:
+                await message.edit_text(answer)
+                shown = answer
+                last_edit = loop.time()
+    except Exception as e:
+        logger.error("Fallo el RAG: %s", e)
+        answer = shown or "No hemos podido procesar su consulta, comuniquese con un experto."
+    
+    # Texto final
+    if message is None:
+        await update.message.reply_text(answer)
+    elif answer != shown:
+        await message.edit_text(answer)
+
 # Transition handler
 async def next(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
@@ -132,25 +233,89 @@ async def next(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Perfecto, indique su provincia:")
     return PROV
 
+# Ubicaciones: el texto se autocompleta contra los datos (dv.suggest). Si el texto ya es
+# una ubicacion completa se acepta directo; si no, las sugerencias (aun una sola) se
+# ofrecen como botones con callback_data "loc:<nonce>:<indice en session.opciones>".
+# El nonce cambia con cada teclado, asi los botones de un mensaje anterior se rechazan.
+# Sin sugerencias, queda la busqueda aproximada (dv.val).
+LOCATION_PATTERN = r"^loc:"
+
+async def read_location(update: Update, session, colname):
+    """
+    Devuelve (listo, valor, texto): listo es False si se mostraron sugerencias y hay
+    que esperar la eleccion del usuario (el handler se queda en el mismo estado).
+    
+    """
+    query = update.callback_query
+    if query is not None:
+        await query.answer()
+        value = None
+        _, nonce, index = (query.data.split(":") + [None, None])[:3]
+        if session.opciones is not None and nonce == session.opciones_id:
+            try:
+                value = session.opciones[int(index)]
+            except (TypeError, ValueError, IndexError):
+                pass
+        if value is None:
+            # botones de un mensaje anterior: las opciones vigentes siguen en pie
+            await query.edit_message_text("Esa opcion ya no esta disponible, por favor escribala nuevamente.")
+            return False, None, None
+        session.opciones = session.opciones_id = None
+        await query.edit_message_text(f"Seleccionado: {value}")
+        return True, value, value
+    
+    input = update.message.text
+    options = dv.suggest(input, colname, session.query_type, session.provincia)
+    session.opciones = session.opciones_id = None
+    
+    if len(options) == 1 and dv.is_exact(input, options[0]):
+        return True, options[0], input
+    
+    if options:
+        session.opciones = options
+        session.opciones_id = secrets.token_hex(4)
+        keyboard = [[InlineKeyboardButton(option, callback_data=f"loc:{session.opciones_id}:{i}")]
+                    for i, option in enumerate(options)]
+        await update.message.reply_text("Elija una de estas opciones, o escriba el nombre completo:",
+                                        reply_markup=InlineKeyboardMarkup(keyboard))
+        return False, None, input
+    
+    # check input with Abel's function.
+    return True, dv.val(input, colname, session.query_type, session.provincia), input
+
+# La sesion pudo vencer (SESSION_TTL) o perderse en un reinicio: sin tipo de consulta
+# no sabemos en que datos buscar, asi que cerramos la conversacion y pedimos /start
+async def session_expired(update: Update, session) -> bool:
+    if session.query_type is not None:
+        return False
+    
+    if update.callback_query is not None:
+        await update.callback_query.answer()
+    await update.effective_message.reply_text("Su consulta expiro por inactividad. "
+                                              "Clickee /start para comenzar nuevamente.")
+    return True
+
 # Provincia handler
 async def province_ask(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
     
     logger.info("PROV state started")
     
-    global provincia, query_type, search_flag
+    session = sessions.get(update.effective_chat.id)
+    if await session_expired(update, session):
+        return ConversationHandler.END
     
-    input = update.message.text
+    ready, value, input = await read_location(update, session, 'Provincia')
+    if not ready:
+        return PROV
+    session.provincia = value
     
-    # check input with Abel's function.
-    provincia = dv.val(input, 'Provincia', query_type)
+    logger.info(f"Provincia de {update.effective_user.username}: {session.provincia} ") 
     
-    logger.info(f"Provincia de {update.message.from_user.username}: {provincia} ") 
-    
-    if provincia == 'CIUDAD AUTONOMA DE BUENOS AIRES':
-        await update.message.reply_text("Buscando..")
+    if session.provincia == 'CIUDAD AUTONOMA DE BUENOS AIRES':
+        await update.effective_message.reply_text("Buscando..")
         return await buscar_rep(update, context)
     
-    await update.message.reply_text(
+    await update.effective_message.reply_text(
         f"Perfecto, por favor digame en que departamento de {input}"
         " se encuentra."
     )
@@ -160,21 +325,24 @@ async def province_ask(update: Update, context: ContextTypes.DEFAULT_TYPE) -> st
 # Departamento handler
 async def depto_ask(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
     
-    global departamento,provincia, query_type
+    session = sessions.get(update.effective_chat.id)
+    if await session_expired(update, session):
+        return ConversationHandler.END
     
-    input = update.message.text
-    # check input with Abel's function.
-    departamento = dv.val(input, 'Departamento / Partido', query_type, provincia)
+    ready, value, input = await read_location(update, session, 'Departamento / Partido')
+    if not ready:
+        return DEPTO
+    session.departamento = value
     
-    logger.info(f"Departamento de {update.message.from_user.username}: {departamento} ") 
+    logger.info(f"Departamento de {update.effective_user.username}: {session.departamento} ") 
     
-    if departamento == 'CIUDAD AUTONOMA DE BUENOS AIRES':
-        departamento = None # limpiamos la variable
-        provincia = 'CIUDAD AUTONOMA DE BUENOS AIRES' # reasignamos provincia y buscamos.
-        await update.message.reply_text("Buscando..")
+    if session.departamento == 'CIUDAD AUTONOMA DE BUENOS AIRES':
+        session.departamento = None # limpiamos la variable
+        session.provincia = 'CIUDAD AUTONOMA DE BUENOS AIRES' # reasignamos provincia y buscamos.
+        await update.effective_message.reply_text("Buscando..")
         return await buscar_rep(update, context)
     
-    await update.message.reply_text(
+    await update.effective_message.reply_text(
         f"Y finalmente, necesitaria saber en que localidad de {input}"
         " se encuentra."
     )
@@ -184,85 +352,47 @@ async def depto_ask(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
 # Departamento handler
 async def local_ask(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
     
-    global localidad, query_type
+    session = sessions.get(update.effective_chat.id)
+    if await session_expired(update, session):
+        return ConversationHandler.END
     
-    input = update.message.text
-    # check input with Abel's function.
-    localidad = dv.val(input, 'localidad', query_type, provincia)
+    ready, value, input = await read_location(update, session, 'localidad')
+    if not ready:
+        return LOCAL
+    session.localidad = value
     
-    logger.info(f"Departamento de {update.message.from_user.username}: {localidad} ") 
+    logger.info(f"Departamento de {update.effective_user.username}: {session.localidad} ") 
     
-    await update.message.reply_text(
+    await update.effective_message.reply_text(
         f"Muchas gracias, dejeme buscarle el mejor representante..."
     )
-    time.sleep(0.5)
+    await asyncio.sleep(0.5)
     
     return await buscar_rep(update, context)
 
     
 
 async def buscar_rep(update: Update, context: ContextTypes.DEFAULT_TYPE): 
-    global provincia, departamento, localidad, query_type, search_flag
+    session = sessions.get(update.effective_chat.id)
     
+    # Tarjeta de contactos pre-armada para la ubicacion (ver dv.LocationIndex)
+    card = dv.contact_card(session.query_type, session.provincia, session.departamento, session.localidad)
     
-    # Perform the search - si search_flag = 1 es porque no encontro resultados usando depto y localidad
-    if search_flag == 0:
-            results = dv.search(query_type, provincia, departamento, localidad)
-    else:   results = dv.search(query_type, provincia)
-    
-    # Chequeamos que haya resultados
-    if results is not None and results.shape[0] > 0:
-        
-        results = results[~results['Nombre'].duplicated(keep="first")]
-        
-        # Iniciamos el mensaje de respuesta
-        final_message = "Pruebe comunicarse con: \n\n"
-        result_count = len(results)
-        
-        # Fijamos un maximo de salidas
-        max_results = 4
-        display_count = min(result_count, max_results)
-        
-        # Iteramos sobre los resultados y acumulamos texto:
-        for idx, row in results.head(display_count).iterrows():
-            
-            # Guardamos los datos, o 'No disponible' si no estan vacios
-            nombre = row.get('Nombre', 'No disponible')
-            email = row.get('e-Mail', 'No disponible')
-            celular = row.get('Celular', 'No disponible')
-            
-            # Creamos msj
-            message = (
-                f"Nombre: {nombre}\n"
-                f"Email: {email}\n"
-                f"Celular: {celular}\n"
-                "-----------------------------\n\n"
-                
-            )
-                
-            # Unimos mensaje final
-            final_message += message
-        
-        saludo = "Para volver consultar clickee /start o para salir /cancel"
-        final_message += saludo
-        
-        # Enviamos mensaje
-        await update.message.reply_text(final_message)
+    # Si no hay nadie en el departamento / localidad, buscamos solo por provincia
+    if card is None and (session.departamento is not None or session.localidad is not None):
+        card = dv.contact_card(session.query_type, session.provincia)
+        if card is not None:
+            card = "No encontramos representantes en su zona, estos son los de su provincia.\n\n" + card
     
+    if card is not None:
+        await update.effective_message.reply_text(card)
     else: 
-        # Chequeamos el flag:
-        if search_flag == 0:
-            search_flag = 1
-        else: # Si no se encontraron resultados buscando solo con provincia, le avisamos que no hay representantes en su zona.
-            await update.message.reply_text("Lo siento, no tenemos nadie en el área que coincida con su búsqueda. \n"
-                                        "Clickee /start para realizar otra consulta o /cancel para salir")
+        # Si no se encontraron resultados buscando solo con provincia, le avisamos que no hay representantes en su zona.
+        await update.effective_message.reply_text("Lo siento, no tenemos nadie en el área que coincida con su búsqueda. \n"
+                                                  "Clickee /start para realizar otra consulta o /cancel para salir")
     
     # Vaciamos las variables
-    provincia = None
-    departamento = None
-    localidad = None
-    query_type = None
-    search_flag = 0
+    session.reset()
     
     # fin
     return ConversationHandler.END
@@ -279,57 +409,174 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 
     # Vaciamos las variables
-    provincia = None
-    departamento = None
-    localidad = None
-    query_type = None
-    search_flag = 0
+    sessions.discard(update.effective_chat.id)
     
     return ConversationHandler.END
 
 
+# Arranque: el RAG se carga en segundo plano, el flujo comercial responde de inmediato
+async def post_init(application: Application) -> None:
+    # Endpoint de metricas (Prometheus) y, opcionalmente, cada medicion como log JSON
+    if getattr(cfg, 'METRICS_PORT', None):
+        metrics.start_http_server(cfg.METRICS_PORT, getattr(cfg, 'METRICS_ADDR', '127.0.0.1'))
+    metrics.enable_json_logs(getattr(cfg, 'METRICS_JSON_LOGS', False))
+    
+    # Sesiones vencidas que quedaron en disco de ejecuciones anteriores
+    if state_store is not None:
+        state_store.purge(SessionStore.TIPO, sessions.ttl)
+    
+    rg.load_gazetteer()
+    if rag_pool.executor == "thread":
+        rg.load_in_background(run_warmup=getattr(cfg, 'RAG_WARMUP', True))
+
+
+# Cierre ordenado: esperamos las consultas RAG en curso
+async def post_shutdown(application: Application) -> None:
+    if rag_pool.executor == "service":
+        await rag_pool.aclose()
+    else:
+        rag_pool.shutdown(wait=True)
+    
+    # Ultima escritura del estado (la Application ya grabo las conversaciones al detenerse)
+    if state_store is not None:
+        state_store.close()
+
+
 # Error handler
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     logger.error(msg="Exception while handling an update:", exc_info=context.error)
 
 
 
+# Envuelve un handler para medir su duracion (y contar errores) bajo el nombre del estado.
+# Al terminar deja la sesion del chat pendiente de grabar (si hay persistencia)
+def medir(estado, handler):
+    
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        try:
+            with metrics.timer(HANDLER_SECONDS, estado=estado):
+                return await handler(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(estado=estado)
+            raise
+        finally:
+            sessions.save(update.effective_chat.id)
+    
+    return wrapper
+
+
 ########################### BOT EXEC ###########################
 
+def build_application(token, base_url = None):
+    """
+    Arma la Application con todos los handlers. base_url permite apuntar a otro
+    servidor de la Bot API (p.ej. el servidor falso de bench/load_test.py).
+    
+    """
+    # Cada chat tiene su sesion: updates de chats distintos en paralelo, los de un mismo
+    # chat en orden (el ConversationHandler tiene que ver el estado del anterior)
+    builder = (Application.builder()
+               .token(token)
+               .concurrent_updates(PerChatUpdateProcessor(getattr(cfg, 'CONCURRENT_UPDATES', 64)))
+               .post_init(post_init)
+               .post_shutdown(post_shutdown))
+    if base_url is not None:
+        builder = builder.base_url(base_url)
+    if state_store is not None:
+        # Solo los estados de la conversacion: los datos de cada chat viven en SessionStore.
+        # PTB los pasa a la persistencia cada update_interval; con el mismo intervalo que el
+        # StateStore llegan a disco junto con la sesion (el StateStore ya agrupa las escrituras)
+        builder = builder.persistence(SQLitePersistence(
+            state_store, max_age=sessions.ttl, update_interval=state_store.write_interval,
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=False, callback_data=False)))
+    application = builder.build()
+
+    # Conversation handler build
+    conv_handler = ConversationHandler(
+        entry_points = [CommandHandler("start", medir("START", start))],
+        states = {
+                QT: [CallbackQueryHandler(medir("QT", query_type_button), pattern=r"^[12]$")],
+                QNA:[
+                    MessageHandler(filters.TEXT & (~filters.COMMAND), medir("QNA", qna_handler)),
+                    CommandHandler("next", medir("NEXT", next))],
+                PROV: [MessageHandler(filters.TEXT & (~filters.COMMAND), medir("PROV", province_ask)),
+                       CallbackQueryHandler(medir("PROV", province_ask), pattern=LOCATION_PATTERN)],
+                DEPTO: [MessageHandler(filters.TEXT & (~filters.COMMAND), medir("DEPTO", depto_ask)),
+                        CallbackQueryHandler(medir("DEPTO", depto_ask), pattern=LOCATION_PATTERN)],
+                LOCAL: [MessageHandler(filters.TEXT & (~filters.COMMAND), medir("LOCAL", local_ask)),
+                        CallbackQueryHandler(medir("LOCAL", local_ask), pattern=LOCATION_PATTERN)]
+                
+        },
+        
+        fallbacks = [CommandHandler("cancel", medir("CANCEL", cancel))],
+        
+        # Misma vida que la sesion del chat; /start reinicia desde cualquier estado
+        conversation_timeout = sessions.ttl,
+        allow_reentry = True,
+        
+        name = "conversacion",
+        persistent = state_store is not None
+    )
+    
+    # Register command and callback handlers
+    #application.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), echo_start))
+    application.add_handler(conv_handler)
+
+    # Error handling
+    application.add_error_handler(error_handler)
+    
+    return application
+
+
+# Parametros del modo webhook (config/cfg.py). El TLS lo termina el reverse proxy: el bot
+# escucha HTTP plano en WEBHOOK_LISTEN:WEBHOOK_PORT y Telegram llama a WEBHOOK_URL.
+def webhook_settings():
+    url_path = getattr(cfg, 'WEBHOOK_PATH', 'telegram').strip('/')
+    webhook_url = getattr(cfg, 'WEBHOOK_URL', None)
+    if not webhook_url:
+        # Sin ella PTB registraria la direccion local del bot, que Telegram no puede alcanzar
+        raise ValueError("BOT_MODE 'webhook' requiere WEBHOOK_URL (URL publica del reverse proxy) en config/cfg.py")
+    
+    return dict(listen=getattr(cfg, 'WEBHOOK_LISTEN', '127.0.0.1'),
+                port=getattr(cfg, 'WEBHOOK_PORT', 8443),
+                url_path=url_path,
+                webhook_url=webhook_url,
+                secret_token=getattr(cfg, 'WEBHOOK_SECRET', None),
+                max_connections=getattr(cfg, 'WEBHOOK_MAX_CONNECTIONS', 40))
+
+
+def run(application):
+    """
+    Arranca el bot en el modo de cfg.BOT_MODE: 'polling' (por defecto) o 'webhook'.
+    En ambos casos, al recibir SIGINT/SIGTERM se deja de aceptar updates, se terminan
+    los pendientes y las respuestas RAG en curso, y recien despues se cierra el pool.
+    
+    """
+    mode = getattr(cfg, 'BOT_MODE', 'polling')
+    
+    # Executors 'fork' y 'process': los workers del RAG se crean aca, desde el forkserver
+    if rag_pool.executor in ("fork", "process"):
+        rag_pool.start()
+    
+    if mode == "webhook":
+        options = webhook_settings()
+        logger.info("Modo webhook: escuchando en %s:%s/%s", options["listen"], options["port"], options["url_path"])
+        application.run_webhook(**options)
+    elif mode == "polling":
+        application.run_polling()
+    else:
+        raise ValueError(f"BOT_MODE desconocido: {mode} (opciones: polling, webhook)")
+
+
 if __name__ == '__main__':
     
     try:
         # Initialize Application
-        application = Application.builder().token(cfg.TOKEN_BOT).build()
-
-        # Conversation handler build
-        conv_handler = ConversationHandler(
-            entry_points = [CommandHandler("start", start)],
-            states = {
-                    QT: [CallbackQueryHandler(query_type_button)],
-                    QNA:[
-                        MessageHandler(filters.TEXT & (~filters.COMMAND), qna_handler),
-                        CommandHandler("next", next)],
-                    PROV: [MessageHandler(filters.TEXT & (~filters.COMMAND), province_ask)],
-                    DEPTO: [MessageHandler(filters.TEXT & (~filters.COMMAND), depto_ask)],
-                    LOCAL: [MessageHandler(filters.TEXT & (~filters.COMMAND), local_ask)]
-                    
-            },
-            
-            fallbacks = [CommandHandler("cancel", cancel)]
-            
-        )
-        
-        # Register command and callback handlers
-        #application.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), echo_start))
-        application.add_handler(conv_handler)
-    
-        # Error handling
-        application.add_error_handler(error_handler)
-        
+        application = build_application(cfg.TOKEN_BOT, getattr(cfg, 'TELEGRAM_BASE_URL', None))
 
-        # Start the Bot using run_polling
-        application.run_polling()
+        # Start the Bot (polling o webhook segun cfg.BOT_MODE)
+        run(application)
 
     except Exception as e:
         logger.critical("An exception occurred: %s", e)
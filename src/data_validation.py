@@ -1,7 +1,10 @@
 import pandas as pd
 import provinciamascercana as pmc
+import metrics
 
+import os
 import sys
+import threading
 from pathlib import Path
 
 # Set up logging
@@ -19,6 +22,10 @@ config_path = directory.parent.parent
 #sys.path.append(str(config_path / "datasets" / "processed/") )
 path = config_path / "datasets" / "processed"
 
+# Duracion de carga del CSV, validacion de input y busqueda de representantes
+DV_SECONDS = metrics.histogram("dv_etapa_segundos", "Duracion de las etapas de data_validation",
+                               ["etapa", "query_type"])
+
 qtype = { "RTV": "merged_RTV.csv",
          "DTM": "merged_DTM.csv"
     }
@@ -28,56 +35,234 @@ abbreviations_dict = {'BS AS': 'BUENOS AIRES',
                       'CABA' : 'CIUDAD AUTONOMA DE BUENOS AIRES',
                       'STA FE' : 'SANTA FE'}
 
+# Columnas de ubicacion que indexamos
+location_cols = ['Provincia', 'Departamento / Partido', 'localidad']
+
+# Combinaciones de ubicacion para las que se pre-arma la tarjeta de contactos
+# (la de solo provincia es el fallback cuando no hay nadie en el departamento/localidad)
+card_keys = [['Provincia'],
+             ['Provincia', 'Departamento / Partido'],
+             ['Provincia', 'localidad'],
+             location_cols]
+
+# Tarjeta de contactos que responde buscar_rep
+MAX_CONTACTS = 4
+CARD_HEADER = "Pruebe comunicarse con: \n\n"
+CARD_FOOTER = "Para volver consultar clickee /start o para salir /cancel"
+
+# Botones de sugerencias que ofrece el bot al completar una ubicacion
+MAX_SUGGESTIONS = 6
+
+
+def _render_cards(df, keys):
+    """
+    Arma el mensaje de contactos de cada combinacion de valores de keys: representantes
+    sin repetir (por Nombre, en el orden del CSV), hasta MAX_CONTACTS.
+    Devuelve {tupla de valores: mensaje}.
+    
+    """
+    rows = df.dropna(subset=keys)
+    rows = rows[~rows.duplicated(keys + ['Nombre'], keep='first')]
+    rows = rows[rows.groupby(keys, sort=False).cumcount() < MAX_CONTACTS]
+    
+    # Guardamos los datos, o 'No disponible' si estan vacios
+    def field(col):
+        if col not in rows:
+            return 'No disponible'
+        return rows[col].fillna('No disponible').astype(str)
+    
+    blocks = ("Nombre: " + field('Nombre') + "\n"
+              "Email: " + field('e-Mail') + "\n"
+              "Celular: " + field('Celular') + "\n"
+              "-----------------------------\n\n")
+    
+    joined = blocks.groupby([rows[k] for k in keys], sort=False).agg("".join)
+    return {
+        values if isinstance(values, tuple) else (values,): CARD_HEADER + text + CARD_FOOTER
+        for values, text in joined.items()
+    }
+
+
+# Indice de ubicaciones
+
+class LocationIndex:
+    """
+    Indice en memoria de un dataset de representantes (RTV o DTM).
+    
+    Lee el CSV una sola vez, guarda las columnas de ubicacion normalizadas y
+    particiona las filas por provincia y por (provincia, departamento), de modo
+    que cada busqueda solo recorre la particion que le corresponde.
+    
+    """
+    
+    def __init__(self, csv_path):
+        self.csv_path = str(csv_path)
+        self.mtime = os.path.getmtime(self.csv_path)
+        
+        df = pd.read_csv(self.csv_path)
+        # Algunos encabezados del CSV traen espacios de mas (p.ej. 'e-Mail ')
+        df.columns = df.columns.str.strip()
+        self.df = df
+        
+        # Columnas de ubicacion pre-normalizadas (mismo indice que df)
+        self.normalized = {
+            col: df[col].map(lambda v: pmc.normalizar_texto(v) if isinstance(v, str) else None)
+            for col in location_cols
+        }
+        
+        # Particiones: provincia -> filas, (provincia, departamento) -> filas
+        self.by_prov = {prov: part for prov, part in df.groupby('Provincia', sort=False)}
+        self.by_prov_depto = {
+            key: part for key, part in df.groupby(['Provincia', 'Departamento / Partido'], sort=False)
+        }
+        
+        # Indices difusos y de prefijos por (columna, provincia), se construyen al primer uso
+        self._matchers = {}
+        self._prefixes = {}
+        
+        # Tarjetas de contacto pre-armadas: (provincia, departamento, localidad) -> mensaje
+        self.cards = {}
+        for keys in card_keys:
+            for values, card in _render_cards(df, keys).items():
+                key = dict(zip(keys, values))
+                self.cards[tuple(key.get(col) for col in location_cols)] = card
+        
+        logger.info("Indice cargado: %s (%d filas, %d provincias)",
+                    self.csv_path, len(df), len(self.by_prov))
+    
+    def column(self, colname, provincia = None):
+        # Valores de la columna, restringidos a la provincia si se indica
+        if provincia is None:
+            return self.df[colname]
+        
+        part = self.by_prov.get(provincia)
+        if part is None:
+            return self.df[colname].iloc[0:0]
+        return part[colname]
+    
+    def matcher(self, colname, provincia = None):
+        # Indice difuso sobre el vocabulario (deduplicado y normalizado) de la columna
+        key = (colname, provincia)
+        matcher = self._matchers.get(key)
+        if matcher is None:
+            values = self.column(colname, provincia)
+            normalized = self.normalized[colname].loc[values.index]
+            matcher = pmc.IndiceDifuso(values, normalized)
+            self._matchers[key] = matcher
+        return matcher
+    
+    def prefixes(self, colname, provincia = None):
+        # Trie de autocompletado sobre la columna (mismo vocabulario que matcher)
+        key = (colname, provincia)
+        prefixes = self._prefixes.get(key)
+        if prefixes is None:
+            values = self.column(colname, provincia)
+            normalized = self.normalized[colname].loc[values.index]
+            prefixes = pmc.IndicePrefijos(values, normalized, max_sugerencias=MAX_SUGGESTIONS)
+            self._prefixes[key] = prefixes
+        return prefixes
+    
+    def search(self, provincia, departamento = None, localidad = None):
+        # Elegimos la particion mas chica disponible
+        if departamento is not None:
+            part = self.by_prov_depto.get((provincia, departamento))
+        else:
+            part = self.by_prov.get(provincia)
+        
+        if part is None:
+            return None
+        
+        if localidad is not None:
+            part = part[part['localidad'] == localidad]
+        
+        return part
+    
+    def card(self, provincia, departamento = None, localidad = None):
+        return self.cards.get((provincia, departamento, localidad))
+
+
+# Un indice por tipo de consulta, recargado si cambia el mtime del CSV
+_indices = {}
+_indices_lock = threading.Lock()
+
+def get_index(query_type):
+    
+    csv_path = path / qtype[query_type]
+    mtime = os.path.getmtime(csv_path)
+    
+    index = _indices.get(query_type)
+    if index is None or index.mtime != mtime:
+        with _indices_lock:
+            index = _indices.get(query_type)
+            if index is None or index.mtime != mtime:
+                if index is not None:
+                    logger.info("Cambio detectado en %s, recargando indice", csv_path)
+                with metrics.timer(DV_SECONDS, etapa="carga_csv", query_type=query_type):
+                    index = LocationIndex(csv_path)
+                _indices[query_type] = index
+    
+    return index
 
 
 # Funciones
 
-# Validacion de input:
-def val(location, colname, query_type, provincia = None):
+# Limpieza del input: normalizamos y expandimos abreviaciones
+def _clean(location):
     
-    # Limpiamos el input
     input = pmc.normalizar_texto(location)
     
     # Chequeo si el input es una abreviacion
     if input in abbreviations_dict.keys():
         input = abbreviations_dict[input]
-    else: pass
     
-    # Busco match en mis datos
-    df = pd.read_csv( str(path / qtype[query_type]))
+    return input
+
+# Validacion de input:
+def val(location, colname, query_type, provincia = None):
     
-    if provincia is not None:
-          match = pmc.encontrar_provincia_mas_cercana(input, df.loc[df['Provincia']==provincia][colname] )
-    else: match = pmc.encontrar_provincia_mas_cercana(input, df[colname])
+    # Limpiamos el input
+    input = _clean(location)
     
+    # Busco match en mis datos
+    index = get_index(query_type)
+    with metrics.timer(DV_SECONDS, etapa="validacion", query_type=query_type):
+        match = pmc.encontrar_provincia_mas_cercana(input, index.matcher(colname, provincia))
     
     return match
         
+# Autocompletado: valores de la columna que completan el input (el valor exacto solo, si coincide)
+def suggest(location, colname, query_type, provincia = None, n = MAX_SUGGESTIONS):
+    
+    index = get_index(query_type)
+    with metrics.timer(DV_SECONDS, etapa="sugerencias", query_type=query_type):
+        return index.prefixes(colname, provincia).sugerir(_clean(location), n)
+        
+# True si el texto ya es la ubicacion completa (no un prefijo de ella)
+def is_exact(location, option):
+    
+    return " ".join(_clean(location).split()) == " ".join(pmc.normalizar_texto(option).split())
+
 # Busqueda de resultados
 def search(query_type, provincia, departamento = None, localidad = None ):
     
-    # Abro el dataset correspondiente:
-    df = pd.read_csv( str(path / qtype[query_type]))
+    # Indice del dataset correspondiente:
+    index = get_index(query_type)
     
     logging.info(f"Query type: {query_type}")
-    logging.info(f"Archivo explorado: {str(path / qtype[query_type])}")
-    
-    # Creo mascara
-    filter_mask = (df['Provincia'] == provincia)
-    
-    if departamento is not None:
-        filter_mask &= df['Departamento / Partido'] == departamento
+    logging.info(f"Archivo explorado: {index.csv_path}")
     
-    if localidad is not None:
-        filter_mask &= df['localidad'] == localidad               
-    
-    res = df[filter_mask]
+    with metrics.timer(DV_SECONDS, etapa="busqueda", query_type=query_type):
+        res = index.search(provincia, departamento, localidad)
     
     # chequeo que haya al menos 1 resultado
-    if res.shape[0] >= 1:
+    if res is not None and res.shape[0] >= 1:
         return res
     else: return
-    
 
+
+# Tarjeta de contactos pre-armada para la ubicacion, o None si no hay representantes
+def contact_card(query_type, provincia, departamento = None, localidad = None):
     
-        
\ No newline at end of file
+    index = get_index(query_type)
+    with metrics.timer(DV_SECONDS, etapa="tarjeta", query_type=query_type):
+        return index.card(provincia, departamento, localidad)
@@ -0,0 +1,282 @@
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+from retrieval import l2_normalize
+
+# Set up logging
+import logging
+logger = logging.getLogger(__name__)
+
+# Formato en disco de los embeddings del corpus:
+#   embeddings_manifest.json : version, modelo encoder, dimensiones y nombres de archivo
+#   doc_vectors.<build>.npy  : matriz (n_docs, dim) float32 normalizada, se abre con mmap
+#   corpus_offsets.<build>.npy : offsets en bytes de cada documento dentro del corpus (n_docs + 1)
+#   corpus_hashes.<build>.npy  : hash del contenido vectorizado de cada documento (opcional)
+#   corpus.<build>.txt       : un documento por linea (utf-8)
+#
+# Cada build escribe archivos nuevos y recien al final reemplaza el manifest (rename
+# atomico), asi un bot que esta leyendo nunca ve un indice a medio escribir.
+# Ademas se deja una copia de conveniencia en corpus.txt.
+FORMAT_VERSION = 1
+MANIFEST_NAME = "embeddings_manifest.json"
+CORPUS_COPY_NAME = "corpus.txt"
+
+
+def content_hash(encoder_name, text):
+    # Un documento se re-vectoriza si cambia su texto o el encoder
+    return hashlib.sha1(f"{encoder_name}\0{text}".encode("utf-8")).digest()
+
+
+def _new_build_id():
+    return time.strftime("%Y%m%d%H%M%S") + "-" + os.urandom(3).hex()
+
+
+def _fsync(path):
+    with open(path, "rb+") as f:
+        os.fsync(f.fileno())
+
+
+def _write_atomic(path, data):
+    tmp = Path(str(path) + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _write_corpus(directory, build_id, documents):
+    # Corpus + offsets de cada linea
+    corpus_name = f"corpus.{build_id}.txt"
+    offsets_name = f"corpus_offsets.{build_id}.npy"
+
+    offsets = [0]
+    lines = []
+    for doc in documents:
+        line = (doc.replace("\n", " ") + "\n").encode("utf-8")
+        lines.append(line)
+        offsets.append(offsets[-1] + len(line))
+    data = b"".join(lines)
+
+    with open(directory / corpus_name, "wb") as f:
+        f.write(data)
+    np.save(directory / offsets_name, np.asarray(offsets, dtype=np.int64))
+
+    _fsync(directory / corpus_name)
+    _fsync(directory / offsets_name)
+    _write_atomic(directory / CORPUS_COPY_NAME, data)
+
+    return corpus_name, offsets_name
+
+
+def _publish(directory, manifest):
+    # Reemplaza el manifest y borra los archivos de builds viejos, salvo el inmediato
+    # anterior (un lector puede haber leido ese manifest y estar por abrir sus archivos).
+    previous = _read_manifest(directory) if exists(directory) else {}
+
+    _write_atomic(directory / MANIFEST_NAME,
+                  json.dumps(manifest, indent=2, ensure_ascii=False).encode("utf-8"))
+
+    keep = {manifest.get(key) for key in ("vectors", "offsets", "hashes", "corpus")}
+    keep |= {previous.get(key) for key in ("vectors", "offsets", "hashes", "corpus")}
+    for pattern in ("doc_vectors.*.npy", "corpus_offsets.*.npy", "corpus_hashes.*.npy", "corpus.*.txt"):
+        for path in directory.glob(pattern):
+            if path.name not in keep:
+                path.unlink()
+
+
+def _read_manifest(directory):
+    with open(Path(directory) / MANIFEST_NAME, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save(directory, encoder_name, doc_vectors, documents):
+    """
+    Guarda corpus + embeddings ya calculados en el formato versionado (sin hashes:
+    el proximo build() re-vectoriza todo).
+
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    vectors = l2_normalize(doc_vectors)
+    if len(vectors) != len(documents):
+        raise ValueError(f"{len(vectors)} vectores para {len(documents)} documentos")
+
+    build_id = _new_build_id()
+    vectors_name = f"doc_vectors.{build_id}.npy"
+    np.save(directory / vectors_name, vectors)
+    _fsync(directory / vectors_name)
+
+    corpus_name, offsets_name = _write_corpus(directory, build_id, documents)
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "encoder": encoder_name,
+        "n_docs": int(vectors.shape[0]),
+        "dim": int(vectors.shape[1]),
+        "dtype": "float32",
+        "normalized": True,
+        "vectors": vectors_name,
+        "offsets": offsets_name,
+        "corpus": corpus_name,
+    }
+    _publish(directory, manifest)
+
+    logger.info("Embeddings guardados en %s (%d x %d)", directory, manifest["n_docs"], manifest["dim"])
+    return manifest
+
+
+def build(directory, encoder_name, documents, encode, texts = None, chunk_size = 256, incremental = True):
+    """
+    Build incremental: solo vectoriza los documentos nuevos o modificados respecto
+    del build anterior (por hash de contenido) y reutiliza el resto.
+
+    documents : textos que se guardan en el corpus
+    texts     : textos que se vectorizan (por defecto documents), p.ej. preprocesados
+    encode    : funcion lista[str] -> array (n, dim); se llama por bloques de chunk_size,
+                asi la memoria queda acotada (la matriz final se escribe via memmap)
+    incremental : con False no se reutiliza nada del build anterior (re-vectoriza todo,
+                  igual por bloques y guardando los hashes)
+
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    texts = documents if texts is None else texts
+    if len(texts) != len(documents):
+        raise ValueError(f"{len(texts)} textos para {len(documents)} documentos")
+
+    hashes = np.array([content_hash(encoder_name, text) for text in texts], dtype="S20")
+
+    # Vectores reutilizables del build anterior (mismo encoder)
+    previous = None
+    previous_rows = {}
+    if incremental and exists(directory):
+        try:
+            previous = EmbeddingStore(directory)
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("No se pudo leer el build anterior (%s), se vectoriza todo", e)
+        if previous is not None and previous.hashes is not None and previous.encoder_name == encoder_name:
+            previous_rows = {h: i for i, h in enumerate(previous.hashes)}
+
+    reuse = np.array([previous_rows.get(h, -1) for h in hashes], dtype=np.int64)
+    pending = np.flatnonzero(reuse < 0)
+
+    dim = previous.manifest["dim"] if previous_rows else None
+    build_id = _new_build_id()
+    vectors_name = f"doc_vectors.{build_id}.npy"
+    vectors = None
+
+    def _output(dim):
+        return np.lib.format.open_memmap(directory / vectors_name, mode="w+", dtype=np.float32,
+                                         shape=(len(documents), dim))
+
+    if dim is not None:
+        vectors = _output(dim)
+        reused = np.flatnonzero(reuse >= 0)
+        for start in range(0, len(reused), chunk_size):
+            rows = reused[start:start + chunk_size]
+            vectors[rows] = previous.vectors[reuse[rows]]
+
+    # Vectorizamos por bloques solo lo nuevo
+    for start in range(0, len(pending), chunk_size):
+        rows = pending[start:start + chunk_size]
+        encoded = l2_normalize(encode([texts[i] for i in rows]))
+        if vectors is None:
+            vectors = _output(encoded.shape[1])
+        vectors[rows] = encoded
+        logger.info("Vectorizados %d/%d documentos nuevos", min(start + chunk_size, len(pending)), len(pending))
+
+    if vectors is None:
+        raise ValueError("Corpus vacio: no hay documentos para vectorizar")
+
+    vectors.flush()
+    dim = vectors.shape[1]
+    del vectors
+    _fsync(directory / vectors_name)
+
+    hashes_name = f"corpus_hashes.{build_id}.npy"
+    np.save(directory / hashes_name, hashes)
+    _fsync(directory / hashes_name)
+
+    corpus_name, offsets_name = _write_corpus(directory, build_id, documents)
+
+    if previous is not None:
+        previous.close()
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "encoder": encoder_name,
+        "n_docs": len(documents),
+        "dim": int(dim),
+        "dtype": "float32",
+        "normalized": True,
+        "vectors": vectors_name,
+        "offsets": offsets_name,
+        "hashes": hashes_name,
+        "corpus": corpus_name,
+    }
+    _publish(directory, manifest)
+
+    logger.info("Build %s: %d documentos, %d reutilizados, %d vectorizados",
+                build_id, len(documents), len(documents) - len(pending), len(pending))
+    return manifest
+
+
+def exists(directory):
+    return (Path(directory) / MANIFEST_NAME).is_file()
+
+
+class EmbeddingStore:
+    """
+    Embeddings y corpus abiertos desde disco. Los vectores se mapean con mmap, asi
+    varios procesos del bot comparten las mismas paginas via el page cache.
+    Los documentos se leen bajo demanda usando los offsets.
+
+    """
+
+    def __init__(self, directory, mmap = True):
+        self.directory = Path(directory)
+
+        self.manifest = _read_manifest(self.directory)
+
+        version = self.manifest.get("format_version")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Version de embeddings no soportada: {version} (esperada {FORMAT_VERSION})")
+
+        self.vectors = np.load(self.directory / self.manifest["vectors"], mmap_mode="r" if mmap else None)
+        self.offsets = np.load(self.directory / self.manifest["offsets"])
+        self.hashes = np.load(self.directory / self.manifest["hashes"]) if "hashes" in self.manifest else None
+
+        n_docs = self.manifest["n_docs"]
+        if self.vectors.shape != (n_docs, self.manifest["dim"]) or len(self.offsets) != n_docs + 1:
+            raise ValueError(f"Embeddings inconsistentes con el manifest en {self.directory}")
+
+        self._corpus = open(self.directory / self.manifest["corpus"], "rb")
+
+    @property
+    def encoder_name(self):
+        return self.manifest["encoder"]
+
+    def __len__(self):
+        return self.manifest["n_docs"]
+
+    def __getitem__(self, idx):
+        # os.pread no mueve el cursor del archivo: es seguro entre threads
+        start, end = int(self.offsets[idx]), int(self.offsets[idx + 1])
+        return os.pread(self._corpus.fileno(), end - start, start).decode("utf-8").strip()
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def close(self):
+        self._corpus.close()
+
+
+def load(directory, mmap = True):
+    return EmbeddingStore(directory, mmap=mmap)
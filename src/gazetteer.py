@@ -0,0 +1,246 @@
+import csv
+import json
+import re
+
+import provinciamascercana as pmc
+
+# Set up logging
+import logging
+logger = logging.getLogger(__name__)
+
+# Nombres de largo menor no se buscan (demasiados falsos positivos)
+MIN_NAME_LENGTH = 3
+MIN_FUZZY_LENGTH = 5
+MAX_PRODUCTS_LISTED = 5
+
+# La respuesta directa solo vale para "que uso contra X": un verbo de control o recomendacion
+# y ningun otro tema (toxicidad, dosis, mezclas, momento...). Sobre el texto normalizado.
+CONTROL_INTENT = re.compile(
+    r"\b(COMBAT\w*|CONTROL\w*|USAR|USO|UTILIZ\w*|RECOMI?END\w*|"
+    r"QUE (PRODUCTOS?|APLICO|APLICAR|PONGO|PONER))\b")
+OTHER_TOPICS = re.compile(
+    r"\b(TOXIC\w*|FITOTOX\w*|ABEJAS?|PELIGR\w*|DOSIS|DOSIFIC\w*|CANTIDAD|CUANT[OA]S?|"
+    r"MEZCL\w*|COMPATIB\w*|PRECIOS?|COST\w*|CUANDO|MOMENTO|CARENCIA|RESIDUAL\w*|LLUVIA|"
+    r"RESISTENCIA|PORQUE|POR QUE|COMO SE APLICA|COMO LO APLICO)\b")
+
+
+def normalize(text):
+    # Mismo criterio que la validacion de ubicaciones: sin tildes ni simbolos, mayusculas
+    return " ".join(re.findall(r"[A-Z0-9]+", pmc.normalizar_texto(text)))
+
+
+def read_moments(path):
+    """
+    Momento de aplicacion de cada (cultivo, producto, plaga) de productos.csv, por claves
+    normalizadas. dsc_applic_period no viene entre comillas y suele tener comas (incluso
+    decimales, "0,8 L/ha"), asi que el campo se rearma uniendo todo lo que sigue a
+    dsc_unit_mesure. Si hay varias filas para la misma terna, vale la primera.
+
+    """
+    moments = {}
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        start = header.index("dsc_applic_period")
+        product_col, pest_col, crop_col = (header.index(c) for c in ("nme_product", "nme_target", "nme_crop"))
+
+        for row in reader:
+            tail = row[start:]
+            while tail and not tail[-1].strip():
+                tail.pop()
+            # Un numero suelto despues de una oracion terminada es num_grace_period
+            if len(tail) > 1 and re.fullmatch(r"\s*\d+(\.\d+)?\s*", tail[-1]) and tail[-2].rstrip().endswith("."):
+                tail.pop()
+
+            moment = ",".join(tail).strip()
+            if not moment or moment.lower() == "n/a":
+                continue
+            key = (normalize(row[crop_col]), normalize(row[product_col]), normalize(row[pest_col]))
+            moments.setdefault(key, moment)
+
+    return moments
+
+
+def _fuzzy_threshold(key):
+    return 1 if len(key) < 9 else 2
+
+
+def _enumerate(items):
+    items = list(items)
+    if len(items) == 1:
+        return items[0]
+    return ", ".join(items[:-1]) + " y " + items[-1]
+
+
+class Gazetteer:
+    """
+    Detecta cultivos, productos y plagas de grafo_hierarquia.json en una consulta y,
+    si la pregunta queda resuelta por la jerarquia ("que producto controla la plaga X
+    en el cultivo Y"), arma la respuesta desde un template sin pasar por el RAG.
+
+    Los nombres normalizados se guardan en un trie por palabras: la consulta se recorre
+    una vez tomando en cada posicion la coincidencia mas larga. Lo que queda sin
+    reconocer se busca de forma aproximada (Levenshtein, pmc.IndiceDifuso).
+
+    """
+
+    def __init__(self, hierarchy, moments = None):
+        self.names = {}   # clave normalizada -> nombre original
+        self.kinds = {}   # clave normalizada -> set de tipos (un nombre puede ser cultivo y plaga)
+        self.by_pest = {} # clave de plaga -> [(clave cultivo, clave producto)]
+        # (cultivo, producto, plaga) -> momento de aplicacion (ver read_moments). En el JSON los
+        # momentos cuelgan de la plaga, sin distinguir producto ni cultivo, por eso no se usan
+        self.moments = moments or {}
+        self._trie = {}
+        self._max_tokens = 1
+
+        for crop, crop_info in hierarchy.items():
+            crop_key = self._add(crop, "cultivo")
+            for product, product_info in crop_info["Productos"].items():
+                product_key = self._add(product, "producto")
+                for pest in product_info["Controla a"]:
+                    pest_key = self._add(pest, "plaga")
+                    if crop_key and product_key and pest_key:
+                        self.by_pest.setdefault(pest_key, []).append((crop_key, product_key))
+
+        self._fuzzy = pmc.IndiceDifuso(list(self.names), list(self.names))
+
+    @classmethod
+    def from_json(cls, path, products_csv = None):
+        with open(path, "r", encoding="utf-8") as f:
+            hierarchy = json.load(f)
+        return cls(hierarchy, read_moments(products_csv) if products_csv else None)
+
+    def _add(self, name, kind):
+        key = normalize(name)
+        if len(key) < MIN_NAME_LENGTH:
+            return None
+
+        self.names.setdefault(key, name.strip())
+        self.kinds.setdefault(key, set()).add(kind)
+
+        node = self._trie
+        tokens = key.split()
+        for token in tokens:
+            node = node.setdefault(token, {})
+        node[None] = key
+        self._max_tokens = max(self._max_tokens, len(tokens))
+        return key
+
+    def __len__(self):
+        return len(self.names)
+
+    ################ Deteccion ################
+
+    def _exact(self, tokens, start):
+        # Coincidencia mas larga del trie que empieza en tokens[start]
+        node, found = self._trie, None
+        for end in range(start, len(tokens)):
+            node = node.get(tokens[end])
+            if node is None:
+                break
+            if None in node:
+                found = (node[None], end + 1)
+        return found
+
+    def _approximate(self, tokens, start):
+        # Ventanas de mas largas a mas cortas; solo terminos suficientemente largos
+        for end in range(min(len(tokens), start + self._max_tokens), start, -1):
+            window = " ".join(tokens[start:end])
+            if len(window) < MIN_FUZZY_LENGTH:
+                continue
+            key = self._fuzzy.buscar(window, _fuzzy_threshold(window))
+            if key is not None:
+                return key, end
+        return None
+
+    def detect(self, query):
+        """Devuelve la lista de claves de nombres reconocidos en la consulta, en orden."""
+        tokens = normalize(query).split()
+        found = []
+
+        start = 0
+        while start < len(tokens):
+            match = self._exact(tokens, start) or self._approximate(tokens, start)
+            if match is None:
+                start += 1
+                continue
+            found.append(match[0])
+            start = match[1]
+
+        return found
+
+    ################ Respuesta ################
+
+    @staticmethod
+    def asks_for_control(query):
+        """True si la consulta pide que producto usar y no pregunta por otro tema."""
+        text = normalize(query)
+        return bool(CONTROL_INTENT.search(text)) and not OTHER_TOPICS.search(text)
+
+    def _resolve(self, keys):
+        # Reparte las claves en cultivo / producto / plaga. Un nombre con mas de un tipo
+        # (p.ej. cultivo y plaga a la vez) se toma como plaga solo si la consulta no
+        # nombra otra plaga; si no, como cultivo o producto.
+        unambiguous_pest = any(self.kinds[k] == {"plaga"} for k in keys)
+        crops, products, pests = {}, {}, {}
+
+        for key in keys:
+            kinds = self.kinds[key]
+            if kinds == {"plaga"} or ("plaga" in kinds and not unambiguous_pest):
+                pests[key] = True
+            elif "cultivo" in kinds:
+                crops[key] = True
+            elif "producto" in kinds:
+                products[key] = True
+
+        return list(crops), list(products), list(pests)
+
+    def answer(self, query):
+        """
+        Respuesta armada desde la jerarquia, o None si la consulta no queda resuelta
+        (no pide que usar, sin plaga, mas de una plaga/cultivo/producto, o combinacion
+        inexistente).
+
+        """
+        if not self.asks_for_control(query):
+            return None
+
+        crops, products, pests = self._resolve(self.detect(query))
+        if len(pests) != 1 or len(crops) > 1 or len(products) > 1:
+            return None
+
+        pest = pests[0]
+        rows = [row for row in self.by_pest.get(pest, []) if not crops or row[0] == crops[0]]
+        if products:
+            rows = [row for row in rows if row[1] == products[0]]
+        if not rows:
+            return None
+
+        pest_name = self.names[pest]
+        crop_text = f" en {self.names[crops[0]]}" if crops else ""
+
+        if products:
+            crop_names = _enumerate(dict.fromkeys(self.names[crop] for crop, _ in rows))
+            answer = f"{self.names[products[0]]} controla {pest_name} en {crop_names}."
+        else:
+            # Productos en orden de aparicion, con los cultivos si no se indico uno
+            by_product = {}
+            for crop, product in rows:
+                by_product.setdefault(product, []).append(self.names[crop])
+            listed = list(by_product.items())[:MAX_PRODUCTS_LISTED]
+            if crops:
+                options = [self.names[product] for product, _ in listed]
+            else:
+                options = [f"{self.names[product]} ({', '.join(dict.fromkeys(crop_list))})"
+                           for product, crop_list in listed]
+            answer = f"Para controlar {pest_name}{crop_text} recomendamos {_enumerate(options)}."
+
+        # Momento de aplicacion del primer producto listado, en su cultivo y para esta plaga
+        crop, product = rows[0]
+        moment = self.moments.get((crop, product, pest))
+        if moment:
+            # Si la respuesta abarca varios productos o cultivos, aclaramos a cual corresponde
+            label = f" ({self.names[product]} en {self.names[crop]})" if len(set(rows)) > 1 else ""
+            answer += f" Momento de aplicacion{label}: {moment}"
+        return answer
@@ -0,0 +1,129 @@
+import re
+import time
+
+# Set up logging
+import logging
+logger = logging.getLogger(__name__)
+
+# torch se importa dentro de las funciones: este modulo se importa antes de cargar los modelos.
+
+# Fin de oracion: . ! ? seguido de un espacio (evita cortar en "2.5 l/ha")
+_SENTENCE_END = re.compile(r'[.!?](?=\s)')
+
+# Una respuesta parcial (cortada por deadline) se usa solo si tiene al menos estas palabras
+MIN_PARTIAL_WORDS = 4
+
+
+def extract_answer(text):
+    """
+    Extrae la respuesta del texto generado (sin el prompt).
+    La respuesta termina en la comilla que cierra o en el primer fin de oracion,
+    lo que ocurra primero. Devuelve (respuesta, completa).
+
+    """
+    text = text.lstrip()
+    if text.startswith('"'):
+        text = text[1:]
+
+    end = len(text)
+    complete = False
+
+    quote = text.find('"')
+    if quote != -1:
+        end, complete = quote, True
+
+    sentence = _SENTENCE_END.search(text, 0, end)
+    if sentence is not None:
+        end, complete = sentence.end(), True
+
+    return text[:end].strip(), complete
+
+
+def finalize_answer(text, document):
+    """
+    Respuesta final a partir del texto generado. Si la generacion se corto antes de
+    completar una oracion (deadline), devuelve la parte generada si es suficiente o,
+    si no, el documento recuperado.
+
+    """
+    answer, complete = extract_answer(text)
+
+    # Tambien vale una oracion que termina justo al final del texto generado
+    if answer and (complete or answer[-1] in ".!?"):
+        return answer
+    if len(answer.split()) >= MIN_PARTIAL_WORDS:
+        return answer + "..."
+
+    return document.strip().strip('"').strip()
+
+
+class DeadlineCriteria:
+    """Criterio de corte por tiempo: cada fila del lote tiene su propio deadline (time.monotonic)."""
+
+    def __init__(self, deadlines):
+        self.deadlines = list(deadlines)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+        now = time.monotonic()
+        return torch.tensor([now >= deadline for deadline in self.deadlines],
+                            dtype=torch.bool, device=input_ids.device)
+
+
+class AnswerBoundaryCriteria:
+    """
+    Criterio de corte por contenido: una fila termina cuando su texto generado
+    ya tiene una respuesta completa (comilla de cierre o primera oracion).
+
+    """
+
+    def __init__(self, tokenizer, prompt_length):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+        texts = self.tokenizer.batch_decode(input_ids[:, self.prompt_length:], skip_special_tokens=True)
+        return torch.tensor([extract_answer(text)[1] for text in texts],
+                            dtype=torch.bool, device=input_ids.device)
+
+
+class EventCriteria:
+    """Criterio de corte externo (threading.Event), p.ej. cuando el consumidor del stream abandona."""
+
+    def __init__(self, event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        import torch
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+
+def _prepare(model, tokenizer, prompts, max_prompt_tokens):
+    # Padding a la izquierda: todas las filas terminan en la misma posicion
+    inputs = tokenizer(prompts, return_tensors="pt", padding=True, truncation=True, max_length=max_prompt_tokens)
+    return inputs.to(model.device)
+
+
+def generate(model, tokenizer, prompts, deadlines, max_prompt_tokens = 512, extra_criteria = (), streamer = None,
+             **gen_kwargs):
+    """
+    Genera la continuacion de cada prompt (sin el prompt) con corte por respuesta
+    completa y por deadline.
+
+    """
+    from transformers import StoppingCriteriaList
+
+    inputs = _prepare(model, tokenizer, prompts, max_prompt_tokens)
+    prompt_length = inputs["input_ids"].shape[1]
+
+    criteria = StoppingCriteriaList([AnswerBoundaryCriteria(tokenizer, prompt_length),
+                                     DeadlineCriteria(deadlines), *extra_criteria])
+
+    outputs = model.generate(**inputs,
+                             stopping_criteria=criteria,
+                             streamer=streamer,
+                             pad_token_id=tokenizer.pad_token_id,
+                             **gen_kwargs)
+
+    return tokenizer.batch_decode(outputs[:, prompt_length:], skip_special_tokens=True)
@@ -0,0 +1,256 @@
+"""
+Backends de inferencia en CPU para el generador (GPT-2) y el encoder de oraciones.
+
+    torch : PyTorch fp32 (comportamiento original)
+    int8  : PyTorch con cuantizacion dinamica int8 de las capas lineales
+    onnx  : grafos exportados a ONNX Runtime (ver comando export)
+
+Uso:
+    python inference_backend.py export  --salida ../models/onnx
+    python inference_backend.py paridad --backend int8
+    python inference_backend.py paridad --backend onnx --onnx-dir ../models/onnx
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+# Set up logging
+import logging
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("torch", "int8", "onnx")
+
+# Subdirectorios y metadata del export ONNX
+GENERATOR_DIR = "generador"
+ENCODER_DIR = "encoder"
+EXPORT_INFO = "export_info.json"
+
+
+def _require_optimum():
+    try:
+        import optimum.onnxruntime  # noqa: F401
+    except ImportError as e:
+        raise ImportError("El backend 'onnx' requiere optimum[onnxruntime]: "
+                          "pip install 'optimum[onnxruntime]'") from e
+
+
+def _check_backend(backend):
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend desconocido: {backend} (opciones: {', '.join(BACKENDS)})")
+
+
+############################### CUANTIZACION INT8 ###############################
+
+def _conv1d_to_linear(model):
+    # GPT-2 usa Conv1D (y = x @ W + b) en lugar de nn.Linear; quantize_dynamic solo
+    # reconoce nn.Linear, asi que convertimos las capas antes de cuantizar.
+    import torch.nn as nn
+    from transformers.pytorch_utils import Conv1D
+
+    for module in list(model.modules()):
+        for child_name, child in list(module.named_children()):
+            if isinstance(child, Conv1D):
+                n_in, n_out = child.weight.shape
+                linear = nn.Linear(n_in, n_out)
+                linear.weight.data = child.weight.data.t().contiguous()
+                linear.bias.data = child.bias.data
+                setattr(module, child_name, linear)
+    return model
+
+
+def quantize_int8(model):
+    import torch
+    import torch.nn as nn
+
+    model = _conv1d_to_linear(model.cpu().eval())
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+############################### CARGA ###############################
+
+def _export_info(onnx_dir):
+    path = Path(onnx_dir) / EXPORT_INFO
+    if not path.is_file():
+        raise FileNotFoundError(f"No se encontro {path}: correr 'python inference_backend.py export' primero")
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_generator(model_name, backend = "torch", onnx_dir = None, device = "cpu"):
+    """Devuelve (modelo causal, tokenizer) listos para model.generate()."""
+    _check_backend(backend)
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+    if backend == "onnx":
+        _require_optimum()
+        from optimum.onnxruntime import ORTModelForCausalLM
+
+        info = _export_info(onnx_dir)
+        if info["generador"] != model_name:
+            raise ValueError(f"El export ONNX es de {info['generador']}, no de {model_name}")
+        model = ORTModelForCausalLM.from_pretrained(Path(onnx_dir) / GENERATOR_DIR,
+                                                    file_name=info["generador_archivo"])
+        return model, tokenizer
+
+    from transformers import AutoModelForCausalLM
+    model = AutoModelForCausalLM.from_pretrained(model_name).eval()
+
+    if backend == "int8":
+        model = quantize_int8(model)
+    else:
+        model = model.to(device)
+
+    return model, tokenizer
+
+
+def load_encoder(model_name, backend = "torch", onnx_dir = None, device = "cpu"):
+    """Devuelve un SentenceTransformer con el backend pedido."""
+    _check_backend(backend)
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "onnx":
+        _require_optimum()
+        info = _export_info(onnx_dir)
+        if info["encoder"] != model_name:
+            raise ValueError(f"El export ONNX es de {info['encoder']}, no de {model_name}")
+        return SentenceTransformer(str(Path(onnx_dir) / ENCODER_DIR), backend="onnx", device="cpu",
+                                   model_kwargs={"file_name": info["encoder_archivo"]})
+
+    if backend == "int8":
+        return quantize_int8(SentenceTransformer(model_name, device="cpu"))
+
+    return SentenceTransformer(model_name, device=device)
+
+
+############################### EXPORT ###############################
+
+def export(generator_name, encoder_name, output_dir, quantize = True):
+    """Exporta generador y encoder a ONNX (opcionalmente cuantizados int8 dinamico)."""
+    _require_optimum()
+    from optimum.onnxruntime import ORTModelForCausalLM, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+    from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+
+    output_dir = Path(output_dir)
+    generator_dir = output_dir / GENERATOR_DIR
+    encoder_dir = output_dir / ENCODER_DIR
+
+    logger.info("Exportando generador %s a %s", generator_name, generator_dir)
+    generator = ORTModelForCausalLM.from_pretrained(generator_name, export=True)
+    generator.save_pretrained(generator_dir)
+    generator_file = "model.onnx"
+
+    logger.info("Exportando encoder %s a %s", encoder_name, encoder_dir)
+    encoder = SentenceTransformer(encoder_name, backend="onnx", device="cpu")
+    encoder.save_pretrained(str(encoder_dir))
+    encoder_file = "onnx/model.onnx"
+
+    if quantize:
+        logger.info("Cuantizando (int8 dinamico)")
+        config = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+
+        ORTQuantizer.from_pretrained(generator_dir, file_name=generator_file).quantize(
+            save_dir=generator_dir, quantization_config=config)
+        generator_file = "model_quantized.onnx"
+
+        export_dynamic_quantized_onnx_model(encoder, "avx2", str(encoder_dir))
+        encoder_file = "onnx/model_qint8_avx2.onnx"
+
+    info = {
+        "generador": generator_name,
+        "generador_archivo": generator_file,
+        "encoder": encoder_name,
+        "encoder_archivo": encoder_file,
+        "cuantizado": quantize,
+    }
+    with open(output_dir / EXPORT_INFO, "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=2)
+
+    logger.info("Export completo: %s", info)
+    return info
+
+
+############################### PARIDAD ###############################
+
+PARITY_SENTENCES = [
+    "Como combato la mosca blanca en la soja",
+    "El producto combate a la plaga isoca bolillera y se usa en el cultivo maiz.",
+    "Necesito saber como erradicar el nabo",
+]
+
+
+def parity_check(generator_name, encoder_name, backend, onnx_dir = None,
+                 min_cosine = 0.99, min_top1 = 0.9, sentences = PARITY_SENTENCES):
+    """
+    Compara el backend contra PyTorch fp32:
+      - encoder: similitud coseno minima entre embeddings
+      - generador: coincidencia del token mas probable en cada posicion de las frases
+    Devuelve un dict con las metricas y 'ok'.
+
+    """
+    import numpy as np
+    import torch
+
+    ref_encoder = load_encoder(encoder_name, "torch")
+    encoder = load_encoder(encoder_name, backend, onnx_dir)
+    ref_emb = ref_encoder.encode(sentences, normalize_embeddings=True)
+    emb = encoder.encode(sentences, normalize_embeddings=True)
+    cosine = float(np.min(np.sum(ref_emb * emb, axis=1)))
+
+    ref_generator, tokenizer = load_generator(generator_name, "torch")
+    generator, _ = load_generator(generator_name, backend, onnx_dir)
+
+    agree, total, max_diff = 0, 0, 0.0
+    for sentence in sentences:
+        inputs = tokenizer(sentence, return_tensors="pt")
+        with torch.no_grad():
+            ref_logits = ref_generator(**inputs).logits[0]
+            logits = torch.as_tensor(generator(**inputs).logits[0])
+        agree += int((ref_logits.argmax(-1) == logits.argmax(-1)).sum())
+        total += ref_logits.shape[0]
+        max_diff = max(max_diff, float((ref_logits - logits).abs().max()))
+
+    report = {
+        "backend": backend,
+        "encoder_coseno_min": cosine,
+        "generador_top1": agree / total,
+        "generador_max_abs_diff": max_diff,
+    }
+    report["ok"] = cosine >= min_cosine and report["generador_top1"] >= min_top1
+    return report
+
+
+############################### CLI ###############################
+
+def main(argv = None):
+    sys.path.append(str(Path(__file__).resolve().parent))
+    import rag
+
+    parser = argparse.ArgumentParser(description="Backends de inferencia del RAG")
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    p_export = sub.add_parser("export", help="Exporta generador y encoder a ONNX")
+    p_export.add_argument("--salida", default=rag.ONNX_DIR)
+    p_export.add_argument("--sin-cuantizar", action="store_true")
+
+    p_parity = sub.add_parser("paridad", help="Compara un backend contra PyTorch fp32")
+    p_parity.add_argument("--backend", choices=("int8", "onnx"), required=True)
+    p_parity.add_argument("--onnx-dir", default=rag.ONNX_DIR)
+
+    args = parser.parse_args(argv)
+
+    if args.comando == "export":
+        export(rag.generation_model_name, rag.ENCODER_NAME, args.salida, quantize=not args.sin_cuantizar)
+        return 0
+
+    report = parity_check(rag.generation_model_name, rag.ENCODER_NAME, args.backend, args.onnx_dir)
+    print(json.dumps(report, indent=2))
+    return 0 if report["ok"] else 1
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -0,0 +1,258 @@
+"""
+Metricas del bot en memoria (contadores, gauges e histogramas con labels) y un
+endpoint HTTP local en formato de texto de Prometheus.
+
+    import metrics
+    ETAPAS = metrics.histogram("rag_etapa_segundos", "Duracion de cada etapa del RAG", ["etapa"])
+    with metrics.timer(ETAPAS, etapa="encode"):
+        ...
+
+    metrics.start_http_server(9108)  # GET http://127.0.0.1:9108/metrics
+
+Opcionalmente cada medicion de un timer se escribe ademas como una linea JSON en el
+logger "metrics" (enable_json_logs). Las metricas son por proceso: con el executor
+'process' del RagPool, las etapas del RAG se miden dentro de cada worker.
+"""
+import json
+import threading
+import time
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Set up logging
+import logging
+logger = logging.getLogger(__name__)
+json_logger = logging.getLogger("metrics")
+
+# Buckets de latencia (segundos): del orden del ms (validacion, BM25) a decenas de s (generacion)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = {}
+_registry_lock = threading.Lock()
+_json_logs = False
+
+
+def _format_labels(names, values, extra = ()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: labels esperados {self.labelnames}, recibidos {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self):
+        with self._lock:
+            return [("_total", key, (), value) for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    """Valor instantaneo. Con func, el valor se calcula en cada lectura del endpoint."""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames = (), func = None):
+        super().__init__(name, documentation, labelnames)
+        self.func = func
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _samples(self):
+        if self.func is not None:
+            try:
+                values = self.func()
+            except Exception as e:
+                logger.debug("No se pudo leer %s: %s", self.name, e)
+                return []
+            # func devuelve un numero, o {valores de labels (tupla): numero}
+            if not isinstance(values, dict):
+                values = {(): values}
+            return [("", key if isinstance(key, tuple) else (key,), (), value)
+                    for key, value in values.items() if value is not None]
+
+        with self._lock:
+            return [("", key, (), value) for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames = (), buckets = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def _samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, n) in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    samples.append(("_bucket", key, (("le", _format_value(bound)),), cumulative))
+                samples.append(("_sum", key, (), total))
+                samples.append(("_count", key, (), n))
+        return samples
+
+
+############################### REGISTRO ###############################
+
+def _register(cls, name, *args, **kwargs):
+    # Registrar dos veces el mismo nombre devuelve la metrica existente (recarga de modulos)
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, *args, **kwargs)
+        elif not isinstance(metric, cls):
+            raise ValueError(f"La metrica {name} ya existe con otro tipo")
+        return metric
+
+
+def counter(name, documentation, labelnames = ()):
+    return _register(Counter, name, documentation, labelnames)
+
+
+def gauge(name, documentation, labelnames = (), func = None):
+    return _register(Gauge, name, documentation, labelnames, func=func)
+
+
+def histogram(name, documentation, labelnames = (), buckets = LATENCY_BUCKETS):
+    return _register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+
+def render():
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+############################### TIMERS ###############################
+
+class timer:
+    """
+    Mide la duracion de un bloque (context manager) o de una funcion (decorador,
+    tambien para corrutinas) y la registra en el histograma con los labels dados.
+
+    """
+
+    def __init__(self, histogram, **labels):
+        self.histogram = histogram
+        self.labels = labels
+        self.seconds = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = time.perf_counter() - self._start
+        self.histogram.observe(self.seconds, **self.labels)
+        if _json_logs:
+            json_logger.info(json.dumps({"metrica": self.histogram.name, **self.labels,
+                                         "segundos": round(self.seconds, 6), "error": exc_type is not None},
+                                        ensure_ascii=False))
+        return False
+
+    def __call__(self, func):
+        import asyncio
+
+        if asyncio.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with timer(self.histogram, **self.labels):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(self.histogram, **self.labels):
+                return func(*args, **kwargs)
+        return wrapper
+
+
+def enable_json_logs(enabled = True):
+    # Cada medicion de un timer se escribe tambien como JSON en el logger "metrics"
+    global _json_logs
+    _json_logs = enabled
+
+
+############################### ENDPOINT ###############################
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        data = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, addr = "127.0.0.1"):
+    """Sirve /metrics en un thread daemon. Devuelve el servidor (server.shutdown() para cerrarlo)."""
+    server = ThreadingHTTPServer((addr, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info("Metricas disponibles en http://%s:%d/metrics", addr, server.server_address[1])
+    return server
@@ -0,0 +1,285 @@
+import asyncio
+import json
+import pickle
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+# Set up logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+class StateStore:
+    """
+    Estado del bot en SQLite (una tabla clave -> valor por tipo) con escritura diferida.
+
+    set() y delete() no escriben: dejan el ultimo valor de cada clave en memoria y un
+    thread lo graba cada write_interval segundos, todo en una sola transaccion. Varias
+    modificaciones de la misma clave dentro de ese intervalo se graban una sola vez.
+    get() ve primero lo pendiente, asi las lecturas siempre estan al dia.
+
+    El thread arranca con la primera modificacion: crear el StateStore (p.ej. al importar
+    bot_core en un worker del RagPool) no deja threads en el proceso.
+
+    """
+
+    # Con tantas claves pendientes se graba sin esperar al intervalo
+    MAX_PENDING = 1000
+
+    def __init__(self, path, write_interval = 1.0):
+        self.path = str(path)
+        self.write_interval = write_interval
+        self.writes = 0
+        self.flushes = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS estado ("
+            " tipo TEXT NOT NULL,"
+            " clave TEXT NOT NULL,"
+            " valor BLOB NOT NULL,"
+            " actualizado REAL NOT NULL,"
+            " PRIMARY KEY (tipo, clave))"
+        )
+
+        self._thread = None
+
+    @staticmethod
+    def _key(key):
+        return key if isinstance(key, str) else json.dumps(key)
+
+    def get(self, tipo, key, max_age = None):
+        """Valor guardado o None. Con max_age (segundos) se ignoran los valores mas viejos."""
+        clave = self._key(key)
+        with self._lock:
+            if (tipo, clave) in self._pending:
+                value = self._pending[(tipo, clave)]
+                return None if value is None else pickle.loads(value[0])
+
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT valor, actualizado FROM estado WHERE tipo = ? AND clave = ?", (tipo, clave)
+            ).fetchone()
+
+        if row is None or (max_age is not None and row[1] < time.time() - max_age):
+            return None
+        return pickle.loads(row[0])
+
+    def items(self, tipo, max_age = None):
+        """Todos los (clave, valor) de un tipo, con lo pendiente aplicado encima."""
+        since = time.time() - max_age if max_age is not None else 0
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT clave, valor FROM estado WHERE tipo = ? AND actualizado >= ?", (tipo, since)
+            ).fetchall()
+        values = {clave: pickle.loads(valor) for clave, valor in rows}
+
+        with self._lock:
+            for (pending_tipo, clave), value in self._pending.items():
+                if pending_tipo != tipo:
+                    continue
+                if value is None:
+                    values.pop(clave, None)
+                else:
+                    values[clave] = pickle.loads(value[0])
+        return values
+
+    def set(self, tipo, key, value):
+        # Serializamos ya: lo que se graba es el estado de este momento
+        self._stage(tipo, key, (pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), time.time()))
+
+    def delete(self, tipo, key):
+        self._stage(tipo, key, None)
+
+    def _stage(self, tipo, key, value):
+        with self._lock:
+            self._pending[(tipo, self._key(key))] = value
+            full = len(self._pending) >= self.MAX_PENDING
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name="state-writer", daemon=True)
+                self._thread.start()
+        if full:
+            self._wakeup.set()
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def flush(self):
+        """Graba ya lo pendiente (una transaccion). Devuelve la cantidad de claves escritas."""
+        # Bajo _db_lock: dos flush seguidos no pueden grabar sus lotes en otro orden
+        with self._db_lock:
+            # El lote sigue en _pending (visible para get/items) hasta que termina el COMMIT
+            with self._lock:
+                pending = dict(self._pending)
+            if not pending:
+                return 0
+            if self._conn is None:
+                logger.warning("Estado cerrado: se descartan %d claves pendientes", len(pending))
+                self._forget(pending)
+                return 0
+
+            upserts = [(tipo, clave, value[0], value[1]) for (tipo, clave), value in pending.items() if value is not None]
+            deletes = [(tipo, clave) for (tipo, clave), value in pending.items() if value is None]
+
+            try:
+                self._conn.execute("BEGIN")
+                self._conn.executemany(
+                    "INSERT INTO estado (tipo, clave, valor, actualizado) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (tipo, clave) DO UPDATE SET valor = excluded.valor, actualizado = excluded.actualizado",
+                    upserts)
+                self._conn.executemany("DELETE FROM estado WHERE tipo = ? AND clave = ?", deletes)
+                self._conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                self._conn.execute("ROLLBACK")
+                # El lote queda pendiente (con los valores mas nuevos que hayan llegado) para el proximo flush
+                logger.error("No se pudo grabar el estado (%d claves): %s", len(pending), e)
+                return 0
+
+            self._forget(pending)
+
+        self.writes += len(pending)
+        self.flushes += 1
+        return len(pending)
+
+    def _forget(self, written):
+        # Saca de _pending lo grabado, salvo las claves que cambiaron mientras tanto
+        with self._lock:
+            for key, value in written.items():
+                if key in self._pending and self._pending[key] is value:
+                    del self._pending[key]
+
+    def purge(self, tipo, max_age):
+        # Borra los valores de un tipo que no se actualizan hace mas de max_age segundos
+        with self._db_lock:
+            cursor = self._conn.execute("DELETE FROM estado WHERE tipo = ? AND actualizado < ?",
+                                        (tipo, time.time() - max_age))
+        return cursor.rowcount
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.write_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("Fallo el thread de escritura del estado: %s", e)
+
+    def close(self):
+        if self._closed:
+            return
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        self._wakeup.set()
+        if thread is not None:
+            thread.join()
+        self.flush()
+        with self._db_lock:
+            self._conn.close()
+            self._conn = None
+        logger.info("Estado grabado en %s (%d escrituras en %d transacciones)", self.path, self.writes, self.flushes)
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Persistencia de la Application de PTB sobre un StateStore: estados de los
+    ConversationHandler y chat_data / user_data / bot_data / callback_data.
+
+    A diferencia de PicklePersistence, cada update_* solo deja el valor pendiente en el
+    StateStore (escritura diferida y agrupada). Los estados de conversacion se cargan al
+    inicio (solo los actualizados en las ultimas max_age segundos); chat_data y user_data
+    se cargan de a un chat/usuario, la primera vez que llega un update suyo.
+
+    PTB llama a update_* recien cada update_interval segundos: conviene usar el
+    write_interval del StateStore para que lo pendiente no espere dos intervalos largos.
+
+    """
+
+    def __init__(self, store, max_age = None, store_data = None, update_interval = 60):
+        super().__init__(store_data=store_data or PersistenceInput(), update_interval=update_interval)
+        self.store = store
+        self.max_age = max_age
+        self._loaded = {"chat_data": set(), "user_data": set()}
+
+    # Conversaciones
+    async def get_conversations(self, name):
+        # Las conversaciones abandonadas hace mas de max_age no se retoman
+        if self.max_age is not None:
+            await asyncio.to_thread(self.store.purge, "conversacion:" + name, self.max_age)
+        rows = await asyncio.to_thread(self.store.items, "conversacion:" + name, self.max_age)
+        conversations = {tuple(json.loads(key)): state for key, state in rows.items()}
+        logger.info("Conversaciones '%s' restauradas: %d", name, len(conversations))
+        return conversations
+
+    async def update_conversation(self, name, key, new_state):
+        if new_state is None:
+            self.store.delete("conversacion:" + name, list(key))
+        else:
+            self.store.set("conversacion:" + name, list(key), new_state)
+
+    # chat_data / user_data: vacios al inicio, se completan en refresh_*
+    async def get_chat_data(self):
+        return {}
+
+    async def get_user_data(self):
+        return {}
+
+    async def _refresh(self, tipo, key, data):
+        if key in self._loaded[tipo]:
+            return
+        self._loaded[tipo].add(key)
+        stored = await asyncio.to_thread(self.store.get, tipo, str(key), self.max_age)
+        if stored:
+            data.update(stored)
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        await self._refresh("chat_data", chat_id, chat_data)
+
+    async def refresh_user_data(self, user_id, user_data):
+        await self._refresh("user_data", user_id, user_data)
+
+    async def update_chat_data(self, chat_id, data):
+        self.store.set("chat_data", str(chat_id), data)
+
+    async def update_user_data(self, user_id, data):
+        self.store.set("user_data", str(user_id), data)
+
+    async def drop_chat_data(self, chat_id):
+        self.store.delete("chat_data", str(chat_id))
+
+    async def drop_user_data(self, user_id):
+        self.store.delete("user_data", str(user_id))
+
+    # bot_data / callback_data: un unico valor
+    async def get_bot_data(self):
+        return await asyncio.to_thread(self.store.get, "bot_data", "bot") or {}
+
+    async def update_bot_data(self, data):
+        self.store.set("bot_data", "bot", data)
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def get_callback_data(self):
+        return await asyncio.to_thread(self.store.get, "callback_data", "bot")
+
+    async def update_callback_data(self, data):
+        self.store.set("callback_data", "bot", data)
+
+    async def flush(self):
+        # Al detener la Application: grabamos lo pendiente antes de salir
+        written = await asyncio.to_thread(self.store.flush)
+        logger.info("Persistencia: %d claves grabadas al cerrar", written)
@@ -1,6 +1,17 @@
+import bisect
+import time
 import unicodedata
 from Levenshtein import distance as levenshtein_distance
 
+import metrics
+
+# Busquedas aproximadas: resultado, duracion y distancias de Levenshtein calculadas
+BUSQUEDAS = metrics.counter("pmc_busquedas", "Busquedas en IndiceDifuso por resultado", ["resultado"])
+BUSQUEDA_SEGUNDOS = metrics.histogram("pmc_busqueda_segundos", "Duracion de las busquedas aproximadas")
+DISTANCIAS = metrics.counter("pmc_distancias", "Distancias de Levenshtein calculadas en el BK-tree")
+SUGERENCIAS = metrics.counter("pmc_sugerencias", "Consultas de autocompletado (IndicePrefijos) por resultado",
+                              ["resultado"])
+
 
 def normalizar_texto(texto):
     
@@ -12,16 +23,227 @@ def normalizar_texto(texto):
     return texto_normalizado.upper()  # Convertir a mayúsculas
 
 
+class IndiceDifuso:
+    """
+    Indice de busqueda aproximada sobre un vocabulario de ubicaciones.
+    
+    Deduplica y normaliza el vocabulario una sola vez y lo organiza en un BK-tree,
+    asi cada consulta calcula la distancia de Levenshtein solo contra los nodos
+    que la desigualdad triangular no permite descartar.
+    
+    """
+    
+    def __init__(self, locations, normalizadas=None):
+        
+        # Primer valor original de cada termino normalizado, en orden de aparicion
+        self.originales = []
+        self._exactos = {}  # termino normalizado -> orden
+        self._raiz = None
+        
+        if normalizadas is None:
+            pares = ((loc, None) for loc in locations)
+        else:
+            pares = zip(locations, normalizadas)
+        
+        vistos = set()
+        for loc, loc_normalizada in pares:
+            if not isinstance(loc, str):
+                continue
+            if loc_normalizada is None:
+                loc_normalizada = normalizar_texto(loc)
+            if loc_normalizada in vistos:
+                continue
+            
+            vistos.add(loc_normalizada)
+            self._exactos[loc_normalizada] = len(self.originales)
+            self._insertar(loc_normalizada, len(self.originales))
+            self.originales.append(loc)
+    
+    def __len__(self):
+        return len(self.originales)
+    
+    def _insertar(self, termino, orden):
+        # Cada nodo es [termino, orden, {distancia: hijo}]
+        nodo_nuevo = [termino, orden, {}]
+        
+        if self._raiz is None:
+            self._raiz = nodo_nuevo
+            return
+        
+        nodo = self._raiz
+        while True:
+            distancia = levenshtein_distance(termino, nodo[0])
+            hijo = nodo[2].get(distancia)
+            if hijo is None:
+                nodo[2][distancia] = nodo_nuevo
+                return
+            nodo = hijo
+    
+    def buscar(self, texto, umbral=3):
+        """
+        Devuelve la ubicacion original mas cercana a texto con distancia <= umbral.
+        Ante empates gana la que aparece primero en el vocabulario, igual que el
+        recorrido lineal.
+        
+        """
+        if self._raiz is None:
+            return None
+        
+        texto_normalizado = normalizar_texto(texto)
+        
+        # Coincidencia exacta: distancia 0, no hace falta recorrer el arbol
+        orden = self._exactos.get(texto_normalizado)
+        if orden is not None:
+            BUSQUEDAS.inc(resultado="exacta")
+            return self.originales[orden]
+        
+        inicio = time.perf_counter()
+        mejor = None  # (distancia, orden)
+        radio = umbral
+        visitados = 0
+        
+        pendientes = [self._raiz]
+        while pendientes:
+            termino, orden, hijos = pendientes.pop()
+            distancia = levenshtein_distance(texto_normalizado, termino)
+            visitados += 1
+            
+            if distancia <= radio and (mejor is None or (distancia, orden) < mejor):
+                mejor = (distancia, orden)
+                radio = distancia
+            
+            # Apilamos primero los hijos mas lejanos: los mas cercanos se visitan antes
+            # y achican el radio de busqueda cuanto antes.
+            candidatos = [
+                (abs(arista - distancia), hijo) for arista, hijo in hijos.items()
+                if distancia - radio <= arista <= distancia + radio
+            ]
+            candidatos.sort(key=lambda par: par[0], reverse=True)
+            pendientes.extend(hijo for _, hijo in candidatos)
+        
+        BUSQUEDA_SEGUNDOS.observe(time.perf_counter() - inicio)
+        DISTANCIAS.inc(visitados)
+        BUSQUEDAS.inc(resultado="aproximada" if mejor is not None else "sin_match")
+        
+        if mejor is None:
+            return None
+        return self.originales[mejor[1]]
+    
+    def buscar_lote(self, textos, umbral=3):
+        """
+        Busca varias entradas a la vez. Las entradas repetidas se resuelven una sola vez.
+        
+        """
+        resultados = {}
+        for texto in textos:
+            if texto not in resultados:
+                resultados[texto] = self.buscar(texto, umbral)
+        return [resultados[texto] for texto in textos]
+
+
+class IndicePrefijos:
+    """
+    Trie de prefijos sobre un vocabulario de ubicaciones, para autocompletar.
+    
+    Cada termino normalizado se inserta desde el comienzo de cada una de sus palabras
+    ("GENERAL PAZ" tambien aparece escribiendo "PAZ") y cada nodo guarda, ya ordenadas,
+    sus mejores max_sugerencias completaciones: primero las que empiezan con el texto,
+    despues las mas frecuentes en el vocabulario y por ultimo por orden de aparicion.
+    Una consulta solo recorre tantos nodos como caracteres tiene: no calcula distancias.
+    
+    """
+    
+    def __init__(self, locations, normalizadas=None, max_sugerencias=8):
+        
+        self.max_sugerencias = max_sugerencias
+        self.originales = []
+        self._exactos = {}  # termino normalizado -> orden
+        self._raiz = [{}, []]  # cada nodo es [{caracter: hijo}, [(rango, orden), ...]]
+        
+        if normalizadas is None:
+            pares = ((loc, None) for loc in locations)
+        else:
+            pares = zip(locations, normalizadas)
+        
+        # Vocabulario deduplicado; el peso de cada termino es la cantidad de veces que aparece
+        pesos = []
+        for loc, loc_normalizada in pares:
+            if not isinstance(loc, str):
+                continue
+            termino = " ".join((loc_normalizada or normalizar_texto(loc)).split())
+            orden = self._exactos.get(termino)
+            if orden is None:
+                orden = self._exactos[termino] = len(self.originales)
+                self.originales.append(loc)
+                pesos.append(0)
+            pesos[orden] += 1
+        
+        for termino, orden in self._exactos.items():
+            inicios = [0] + [i + 1 for i, c in enumerate(termino) if c == " "]
+            for inicio in inicios:
+                self._insertar(termino[inicio:], (inicio > 0, -pesos[orden], orden))
+    
+    def __len__(self):
+        return len(self.originales)
+    
+    def _insertar(self, sufijo, rango):
+        nodo = self._raiz
+        for caracter in sufijo:
+            nodo = nodo[0].setdefault(caracter, [{}, []])
+            mejores = nodo[1]
+            
+            # El mismo termino puede llegar desde otra palabra: nos quedamos con su mejor rango
+            if any(orden == rango[2] for _, _, orden in mejores):
+                continue
+            if len(mejores) < self.max_sugerencias or rango < mejores[-1]:
+                bisect.insort(mejores, rango)
+                del mejores[self.max_sugerencias:]
+    
+    def sugerir(self, texto, n=None):
+        """
+        Devuelve hasta n ubicaciones originales que completan texto. Si texto coincide
+        exactamente (normalizado) con una ubicacion, devuelve solo esa.
+        
+        """
+        termino = " ".join(normalizar_texto(texto).split())
+        if not termino:
+            return []
+        
+        orden = self._exactos.get(termino)
+        if orden is not None:
+            SUGERENCIAS.inc(resultado="exacta")
+            return [self.originales[orden]]
+        
+        nodo = self._raiz
+        for caracter in termino:
+            nodo = nodo[0].get(caracter)
+            if nodo is None:
+                SUGERENCIAS.inc(resultado="sin_match")
+                return []
+        
+        SUGERENCIAS.inc(resultado="prefijo")
+        return [self.originales[orden] for _, _, orden in nodo[1][:n or self.max_sugerencias]]
+
+
 def encontrar_provincia_mas_cercana(texto, locations,umbral=3):
     """
     Encuentra la provincia más cercana a partir del texto ingresado utilizando la distancia de Levenshtein.
+    locations puede ser un IndiceDifuso ya construido o cualquier iterable de ubicaciones.
     
     """
+    if isinstance(locations, IndiceDifuso):
+        return locations.buscar(texto, umbral)
+    
     texto_normalizado = normalizar_texto(texto)
     mejor_coincidencia = None
     menor_distancia = float('inf')
+    vistos = set()
 
     for loc in locations:
+        if loc in vistos:
+            continue
+        vistos.add(loc)
+        
         loc_normalizada = normalizar_texto(loc)
         distancia = levenshtein_distance(texto_normalizado, loc_normalizada)
         
@@ -31,7 +253,3 @@ def encontrar_provincia_mas_cercana(texto, locations,umbral=3):
         
 
     return mejor_coincidencia
-
-
-
-
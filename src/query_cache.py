@@ -0,0 +1,146 @@
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+# Set up logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """
+    Cache en memoria de tamaño acotado, thread-safe, con contadores de aciertos.
+    Se usa para los embeddings de las queries preprocesadas.
+
+    """
+
+    def __init__(self, maxsize = 1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0, "entries": len(self._data)}
+
+
+class AnswerCache:
+    """
+    Cache persistente (SQLite en disco local) de respuestas finales del RAG,
+    indexada por (corpus, indice del documento recuperado, query normalizada).
+
+    Las entradas vencen a los ttl segundos y, si se supera max_entries, se
+    eliminan las usadas hace mas tiempo. Varios procesos pueden compartir el
+    mismo archivo (modo WAL).
+
+    """
+
+    # Cada cuantas escrituras se chequea el tamaño maximo
+    EVICT_EVERY = 100
+
+    def __init__(self, path, ttl = 7 * 24 * 3600, max_entries = 10000, corpus_id = ""):
+        self.path = str(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.corpus_id = corpus_id
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " corpus TEXT NOT NULL,"
+            " doc_idx INTEGER NOT NULL,"
+            " query TEXT NOT NULL,"
+            " answer TEXT NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " PRIMARY KEY (corpus, doc_idx, query))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)")
+
+    def get(self, doc_idx, query):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT answer FROM answers WHERE corpus = ? AND doc_idx = ? AND query = ? AND created >= ?",
+                (self.corpus_id, int(doc_idx), query, now - self.ttl)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE answers SET last_used = ? WHERE corpus = ? AND doc_idx = ? AND query = ?",
+                (now, self.corpus_id, int(doc_idx), query)
+            )
+            return row[0]
+
+    def put(self, doc_idx, query, answer):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers (corpus, doc_idx, query, answer, created, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (self.corpus_id, int(doc_idx), query, answer, now, now)
+            )
+
+            self._puts += 1
+            if self._puts % self.EVICT_EVERY == 0:
+                self._evict(now)
+
+    def _evict(self, now):
+        # Vencidas (o de otro corpus) primero, luego las menos usadas por encima del maximo
+        self._conn.execute("DELETE FROM answers WHERE created < ? OR corpus != ?",
+                           (now - self.ttl, self.corpus_id))
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM answers WHERE rowid IN"
+                " (SELECT rowid FROM answers ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,)
+            )
+            logger.info("Cache de respuestas: %d entradas eliminadas", count - self.max_entries)
+
+    def stats(self):
+        total = self.hits + self.misses
+        with self._lock:
+            (entries,) = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0, "entries": entries}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,98 +1,512 @@
-from transformers import AutoTokenizer, pipeline
-import spacy
-import nltk
-from nltk.corpus import stopwords
-
-from sklearn.metrics.pairwise import cosine_similarity
-import torch
-from transformers import pipeline
+from retrieval import DenseIndex
+from bm25 import BM25Index
+from gazetteer import Gazetteer
+import bm25
+from query_cache import LRUCache, AnswerCache
+from batcher import MicroBatcher
+import generation
+import inference_backend
+from text_preprocessing import Preprocessor
+import settings
+import embedding_store
+import metrics
+
+import numpy as np
 
 import logging
 import os
 import pickle
+import threading
+import time
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Seteamos torch en gpu si esta disponible
-device = "GPU" if torch.cuda.is_available() else "cpu"
-
-logging.info(f"Torch running on: {device}")
+# Los modelos (torch, transformers, spaCy) se importan y cargan bajo demanda en load(),
+# asi importar este modulo es instantaneo y el flujo comercial del bot no los espera.
+device = None
 
 # Path to corpus
+PATH_TO_EMBEDDINGS = os.path.abspath('..') + "/datasets/textorag"
 PATH_TO_CORPUS= os.path.abspath('..') + "/datasets/textorag/vectorizer_and_vectors.pkl"
 PATH_TO_CORPUS_TXT = os.path.abspath('..') + "/datasets/textorag/corpus.txt"
 
-# Carga embedding corpus + vectorizer
-logging.info("Cargando embedding y vectorizer")
-with open(PATH_TO_CORPUS, "rb") as f:
-    vectorizer, doc_vectors = pickle.load(f)
-    
-# Carga de corpus
-logging.info("Cargando corpus.txt")
-with open(PATH_TO_CORPUS_TXT, "r", encoding="utf-8") as f:
-    documents = [line.strip() for line in f]
-
-
-############################### LEVANTAMOS MODELO ###############################
+PATH_TO_HIERARCHY = os.path.abspath('..') + "/datasets/textorag/grafo_hierarquia.json"
+PATH_TO_PRODUCTS = os.path.abspath('..') + "/datasets/textorag/productos.csv"
+
+PATH_TO_ANSWER_CACHE = os.path.abspath('..') + "/datasets/textorag/answer_cache.sqlite"
+
+# Para corpus muy grandes se puede activar el modo aproximado con IVF_LISTS > 0.
+IVF_LISTS = 0
+IVF_PROBE = 8
+
+# Busqueda hibrida: BM25 (terminos exactos: productos, plagas) + embeddings.
+# Si el match lexico es contundente (score BM25 normalizado alto y con margen sobre el
+# segundo) no se corre el encoder; si no, se fusionan ambos scores sobre los candidatos.
+HYBRID_CANDIDATES = 20
+HYBRID_DENSE_WEIGHT = 0.7
+# Scores BM25 normalizados en [0, 1) (ver BM25Index.search): con k1 = 1.5, 0.32 equivale
+# a ~80% del peso de la query presente una vez en un documento de largo promedio.
+BM25_DECISIVE = 0.32
+BM25_MARGIN = 0.06
+
+# Respuestas directas desde grafo_hierarquia.json (sin encoder ni LLM) para las preguntas
+# del tipo "que producto controla la plaga X en el cultivo Y"
+STRUCTURED_ANSWERS = settings.get('STRUCTURED_ANSWERS', True)
+
+# Caches: embeddings de queries (memoria) y respuestas finales (SQLite)
+EMBEDDING_CACHE_SIZE = 2048
+ANSWER_CACHE_TTL = 7 * 24 * 3600
+ANSWER_CACHE_MAX = 20000
+
+# Micro-batching de la generacion: pedidos concurrentes se agrupan en un solo lote
+GEN_MAX_BATCH = 8
+GEN_MAX_WAIT_MS = 10
+
+# Presupuesto de latencia por consulta (segundos): al vencer se corta la generacion
+GEN_DEADLINE_S = 8.0
+
+# Parametros de generacion. La generacion ademas se corta en la primera oracion completa
+# o comilla de cierre (ver generation.py), que es lo que se le muestra al usuario.
+GEN_MAX_PROMPT_TOKENS = 512
+GEN_KWARGS = dict(max_new_tokens = 400,
+                  do_sample=True,
+                  temperature=0.8,
+                  top_k=20,  
+                  top_p=0.9,
+                  repetition_penalty=1.0,
+                  no_repeat_ngram_size=3)
+
+# Backend de inferencia: "torch" (fp32), "int8" (cuantizacion dinamica) u "onnx" (ONNX Runtime).
+# Ver inference_backend.py para exportar los modelos y chequear paridad.
+INFERENCE_BACKEND = settings.get('INFERENCE_BACKEND', 'torch')
+ONNX_DIR = settings.get('ONNX_DIR', os.path.abspath('..') + "/models/onnx")
+
+# Encoder por defecto (el del manifest de embeddings tiene prioridad)
+ENCODER_NAME = "distiluse-base-multilingual-cased-v1"
 
 #generation_model_name = "PlanTL-GOB-ES/gpt2-base-bne"
 #generation_model_name = "mrm8488/distill-bert-base-spanish-wwm-cased-finetuned-spa-squad2-es" #datificate/gpt2-small-spanish"
 generation_model_name = "DeepESP/gpt2-spanish"
-logging.info(f"LLM seleccionado {generation_model_name}")
 
-gen_tokenizer = AutoTokenizer.from_pretrained(generation_model_name)
+# Componentes, completados por load()
+vectorizer = None
+documents = None
+doc_index = None
+sparse_index = None
+gen_tokenizer = None
+gen_model = None
+generator = None
+preprocessor = None
+answer_cache = None
+embedding_cache = LRUCache(EMBEDDING_CACHE_SIZE)
+
+# Tiempo y memoria de carga de cada componente
+startup_report = {}
+
+_load_lock = threading.Lock()
+_loaded = threading.Event()
+
+# Metricas (ver metrics.py)
+RAG_SECONDS = metrics.histogram("rag_etapa_segundos", "Duracion de cada etapa del RAG", ["etapa"])
+RAG_ANSWERS = metrics.counter("rag_respuestas", "Respuestas del RAG por origen", ["origen"])
+RAG_RETRIEVAL = metrics.counter("rag_busquedas", "Busquedas de documentos por camino", ["camino"])
+
+gazetteer = None
+_gazetteer_lock = threading.Lock()
+
+
+############################### CARGA ###############################
+
+def _rss_mb():
+    # Memoria residente del proceso en MB
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _measure(component, loader):
+    rss = _rss_mb()
+    start = time.perf_counter()
+    loader()
+    startup_report[component] = {
+        "segundos": time.perf_counter() - start,
+        "memoria_mb": _rss_mb() - rss,
+    }
+
+
+def _load_device():
+    global device
+    import torch
+    
+    # Seteamos torch en gpu si esta disponible
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    logging.info(f"Torch running on: {device}")
+
+
+def _load_corpus():
+    global vectorizer, documents, doc_index
+    
+    if embedding_store.exists(PATH_TO_EMBEDDINGS):
+        # Formato versionado: vectores via mmap + corpus con offsets
+        logging.info("Cargando embeddings (mmap) y vectorizer")
+        documents = embedding_store.load(PATH_TO_EMBEDDINGS)
+        vectorizer = inference_backend.load_encoder(documents.encoder_name, INFERENCE_BACKEND, ONNX_DIR, device)
+        doc_index = DenseIndex(documents.vectors, n_lists=IVF_LISTS, n_probe=IVF_PROBE, normalized=True)
+    
+    else:
+        # Formato anterior: pickle con (vectorizer, doc_vectors)
+        logging.warning("No se encontro %s, usando el pickle anterior. Regenerar con create_corpus_rag.py",
+                        embedding_store.MANIFEST_NAME)
+        with open(PATH_TO_CORPUS, "rb") as f:
+            vectorizer, doc_vectors = pickle.load(f)
+        
+        logging.info("Cargando corpus.txt")
+        with open(PATH_TO_CORPUS_TXT, "r", encoding="utf-8") as f:
+            documents = [line.strip() for line in f]
+        
+        doc_index = DenseIndex(doc_vectors, n_lists=IVF_LISTS, n_probe=IVF_PROBE)
+
+
+def _corpus_version():
+    # Identifica la version del corpus cargado (los archivos de cada build son unicos).
+    # Es la misma para el indice BM25, la cache de respuestas y el reporte de carga
+    if isinstance(documents, embedding_store.EmbeddingStore):
+        return documents.manifest["corpus"]
+    return "corpus.txt@" + str(os.path.getmtime(PATH_TO_CORPUS_TXT))
+
+
+def _load_sparse_index():
+    global sparse_index
+    
+    # Normalmente lo deja armado create_corpus_rag.py; si no coincide con el corpus se
+    # reconstruye con el mismo preprocesamiento que las queries
+    path = os.path.join(PATH_TO_EMBEDDINGS, bm25.INDEX_NAME)
+    corpus_version = _corpus_version()
+    sparse_index = BM25Index.load(path, corpus_version)
+    
+    if sparse_index is None:
+        logging.info("Construyendo indice BM25 del corpus")
+        sparse_index = BM25Index.from_texts(preprocessor.process_batch(list(documents)))
+        try:
+            sparse_index.save(path, corpus_version)
+        except OSError as e:
+            logging.warning(f"No se pudo guardar el indice BM25: {e}")
 
-gen_model = pipeline("text-generation",
-                     model=generation_model_name,
-                     tokenizer=gen_tokenizer,
-                     device=0)  # set device to 0 if using GPU
 
+def _load_answer_cache():
+    global answer_cache
     
+    # Las respuestas se atan a la version del corpus: si se regenera, no se reutilizan
+    answer_cache = AnswerCache(PATH_TO_ANSWER_CACHE, ttl=ANSWER_CACHE_TTL,
+                               max_entries=ANSWER_CACHE_MAX, corpus_id=_corpus_version())
+
+
+############################### LEVANTAMOS MODELO ###############################
+
+def _generate_batch(requests):
+    # requests: lista de (prompt, deadline). Un unico generate por lote; cada fila
+    # se corta por su cuenta al completar la respuesta o vencer su deadline.
+    prompts = [prompt for prompt, _ in requests]
+    deadlines = [deadline for _, deadline in requests]
+    return generation.generate(gen_model, gen_tokenizer, prompts, deadlines,
+                               max_prompt_tokens=GEN_MAX_PROMPT_TOKENS, **GEN_KWARGS)
+
+
+def _load_generator(batcher = True):
+    global gen_tokenizer, gen_model, generator
+    
+    logging.info(f"LLM seleccionado {generation_model_name} (backend {INFERENCE_BACKEND})")
+    
+    gen_model, gen_tokenizer = inference_backend.load_generator(generation_model_name, INFERENCE_BACKEND,
+                                                                ONNX_DIR, device)
+    
+    # GPT-2 no tiene token de padding: lo necesitamos para generar por lotes
+    gen_tokenizer.pad_token = gen_tokenizer.eos_token
+    gen_tokenizer.padding_side = "left"
+    
+    # Sin batcher (y sin su thread) en el forkserver: cada worker arma el suyo en init_worker
+    if batcher:
+        generator = MicroBatcher(_generate_batch, max_batch=GEN_MAX_BATCH,
+                                 max_wait_ms=GEN_MAX_WAIT_MS, name="gen-batcher")
+
+
 ############################### PROCESAMIENTO QUERY ###############################  
 
 # Quitamos stop words y lematizamos query.
 
-# Cargar recursos necesarios
-nltk.download('stopwords')
-stop_words = set(stopwords.words('spanish'))
-nlp = spacy.load("es_core_news_sm")
+def _load_preprocessing():
+    global preprocessor
+    
+    # spaCy sin parser ni NER + stopwords; mismo motor que usa create_corpus_rag.py
+    preprocessor = Preprocessor("es_core_news_sm")
+
+
+def load(batcher = True):
+    """
+    Carga todos los componentes del RAG una unica vez (thread-safe).
+    Las llamadas concurrentes esperan a que termine la primera.
+    Con batcher=False no arranca el thread del micro-batcher de la generacion.
+    
+    """
+    if _loaded.is_set():
+        return
+    
+    with _load_lock:
+        if _loaded.is_set():
+            return
+        
+        _measure("torch", _load_device)
+        _measure("corpus + encoder", _load_corpus)
+        _measure("generador", lambda: _load_generator(batcher))
+        _measure("spacy + stopwords", _load_preprocessing)
+        _measure("indice BM25", _load_sparse_index)
+        _measure("cache de respuestas", _load_answer_cache)
+        _loaded.set()
+    
+    log_startup_report()
+
+
+def is_ready():
+    return _loaded.is_set()
+
+
+def cache_stats():
+    return {
+        "embeddings": embedding_cache.stats(),
+        "respuestas": answer_cache.stats() if answer_cache is not None else None,
+        "preprocesamiento": preprocessor.cache.stats() if preprocessor is not None else None,
+    }
+
+
+def _cache_metric(field):
+    return lambda: {(name,): stats[field] for name, stats in cache_stats().items() if stats is not None}
+
+
+metrics.gauge("rag_cache_hit_ratio", "Proporcion de aciertos de cada cache del RAG", ["cache"],
+              func=_cache_metric("hit_rate"))
+metrics.gauge("rag_cache_entradas", "Entradas en cada cache del RAG", ["cache"],
+              func=_cache_metric("entries"))
+metrics.gauge("rag_generacion_pendientes", "Pedidos esperando lote en el micro-batcher",
+              func=lambda: generator.pending if generator is not None else 0)
+
+
+def log_startup_report():
+    total = sum(item["segundos"] for item in startup_report.values())
+    logging.info(f"Carga del RAG completa en {total:.1f}s (RSS {_rss_mb():.0f} MB, corpus {_corpus_version()})")
+    for component, item in startup_report.items():
+        logging.info(f"  {component:<20} {item['segundos']:7.2f}s  {item['memoria_mb']:+8.1f} MB")
+
+
+def warmup(query = "Como combato la mosca blanca en la soja"):
+    """
+    Pasa una consulta de prueba por cada etapa (preproceso, encoder, busqueda y
+    generacion) para que la primera consulta real no pague la inicializacion perezosa
+    de torch y los modelos. Devuelve el tiempo de cada etapa.
+    
+    """
+    load()
+    timings = {}
+    
+    start = time.perf_counter()
+    query_pp = preprocess_query(query)
+    timings["preprocess_query"] = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    sparse_index.search(query_pp, k=HYBRID_CANDIDATES)
+    timings["bm25"] = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    query_vector = vectorizer.encode([query_pp])
+    timings["encode"] = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    doc_index.search(query_vector, k=1)
+    timings["similitud"] = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    generation.generate(gen_model, gen_tokenizer, [query], [time.monotonic() + 60],
+                        max_prompt_tokens=GEN_MAX_PROMPT_TOKENS, **{**GEN_KWARGS, "max_new_tokens": 4})
+    timings["generacion"] = time.perf_counter() - start
+    
+    logging.info("Warmup RAG: " + ", ".join(f"{stage} {t:.2f}s" for stage, t in timings.items()))
+    return timings
+
+
+def load_in_background(run_warmup = True):
+    """Carga (y opcionalmente calienta) el RAG en un thread aparte."""
+    
+    def _run():
+        try:
+            load()
+            if run_warmup:
+                warmup()
+        except Exception as e:
+            logging.error(f"Fallo la carga del RAG: {e}")
+    
+    thread = threading.Thread(target=_run, name="rag-init", daemon=True)
+    thread.start()
+    return thread
+
+
+############################### WORKERS (fork) ###############################
+
+def preload_for_workers():
+    """
+    Carga el RAG en el forkserver del executor 'fork' (ver rag_forkserver.py), antes de
+    forkear los workers. Sin warmup ni threads: cada worker se calienta y arma su
+    micro-batcher en init_worker.
+    
+    """
+    import torch
+    
+    if INFERENCE_BACKEND == "onnx":
+        # ONNX Runtime crea sus threads al abrir la sesion y no sobreviven al fork
+        raise RuntimeError("El executor 'fork' requiere INFERENCE_BACKEND 'torch' o 'int8'")
+    
+    # Antes de cargar los modelos: con CUDA no tiene sentido esperar la carga
+    _load_device()
+    if device != "cpu":
+        raise RuntimeError("El executor 'fork' requiere inferencia en CPU (CUDA no sobrevive al fork)")
+    
+    # Con un solo thread el forkserver no levanta el pool de OpenMP, que queda roto en los hijos
+    torch.set_num_threads(1)
+    os.environ.setdefault("TOKENIZERS_PARALLELISM", "false")
+    
+    load(batcher=False)
+    load_gazetteer()
+
+
+def init_worker(torch_threads, run_warmup = True):
+    """
+    Prepara un worker del RagPool: threads de torch, batcher y cache propios. Con el
+    executor 'fork' los modelos vienen del forkserver; con 'process' el worker los carga.
+    
+    """
+    global generator
+    import torch
+    
+    torch.set_num_threads(torch_threads)
+    
+    if is_ready():
+        # El forkserver no arma el micro-batcher y la conexion SQLite no se comparte entre procesos
+        generator = MicroBatcher(_generate_batch, max_batch=GEN_MAX_BATCH,
+                                 max_wait_ms=GEN_MAX_WAIT_MS, name="gen-batcher")
+        _load_answer_cache()
+    else:
+        load()
+    
+    logging.info(f"Worker RAG {os.getpid()} listo ({torch_threads} threads de torch)")
+    if run_warmup:
+        warmup()
+
 
 def preprocess_query(query):
     
     logging.info("Procesando query..")
-    # Tokenizar y analizar la consulta
-    doc = nlp(query)
-    
-    # Lematización y eliminación de stopwords
-    lemmatized_tokens = [
-        token.lemma_
-        for token in doc
-        if token.text.lower() not in stop_words and not token.is_punct
-    ]
-    return " ".join(lemmatized_tokens)
+    # Tokenizar, lematizar y quitar stopwords (memoizado por token, ver text_preprocessing.py)
+    with metrics.timer(RAG_SECONDS, etapa="preproceso"):
+        return preprocessor.process(query)
 
 
 
 ############################### RAG ############################### 
 
 # Define RAG functions
+def retrieve_documents(queries, vectorizer, doc_index, k = 1, umbral = 0.10):
+    # queries: lista de preguntas (ya preprocesadas)
+    # vectorizer: vectorizador usado para el embbeding
+    # doc_index: DenseIndex del corpus
+    # Devuelve, por query, la lista de (indice, similitud) del top-k que supera el umbral
+    
+    query_vectors = vectorizer.encode(list(queries))
+    scores, indices = doc_index.search(query_vectors, k)
+    
+    return [
+        [(int(i), float(s)) for s, i in zip(row_scores, row_idx) if i >= 0 and s >= umbral]
+        for row_scores, row_idx in zip(scores, indices)
+    ]
+
+
+def encode_query(query_pp):
+    # Embedding de la query preprocesada, con cache LRU
+    query_vector = embedding_cache.get(query_pp)
+    if query_vector is None:
+        with metrics.timer(RAG_SECONDS, etapa="encode"):
+            query_vector = vectorizer.encode([query_pp])[0]
+        embedding_cache.put(query_pp, query_vector)
+    return query_vector
+
+
+def _is_decisive(sparse_scores):
+    # Match lexico contundente: score alto y claramente por encima del segundo
+    if len(sparse_scores) == 0 or sparse_scores[0] < BM25_DECISIVE:
+        return False
+    return len(sparse_scores) == 1 or sparse_scores[0] - sparse_scores[1] >= BM25_MARGIN
+
+
+def find_document(query_pp, umbral = 0.10):
+    # Devuelve (indice, similitud) del documento mas similar, o None si no supera el umbral
+    
+    logging.info(f"Buscando similitudes..")
+    with metrics.timer(RAG_SECONDS, etapa="bm25"):
+        sparse_scores, sparse_ids = sparse_index.search(query_pp, k=HYBRID_CANDIDATES)
+    
+    # Camino barato: BM25 alcanza y no se corre el encoder
+    if _is_decisive(sparse_scores):
+        RAG_RETRIEVAL.inc(camino="bm25")
+        logging.info(f"Documento encontrado por BM25 con score {sparse_scores[0]:.2f}")
+        return int(sparse_ids[0]), float(sparse_scores[0])
+    
+    query_vector = encode_query(query_pp)
+    
+    with metrics.timer(RAG_SECONDS, etapa="similitud"):
+        dense_scores, dense_ids = doc_index.search(query_vector, k=HYBRID_CANDIDATES)
+        
+        if len(sparse_ids) == 0:
+            # Sin terminos del corpus en la query: solo embeddings
+            RAG_RETRIEVAL.inc(camino="denso")
+            candidates, scores = dense_ids[0], dense_scores[0]
+        else:
+            # Fusion lineal sobre la union de candidatos (coseno y BM25 normalizado, ambos en [0, 1])
+            RAG_RETRIEVAL.inc(camino="hibrido")
+            candidates = np.union1d(dense_ids[0][dense_ids[0] >= 0], sparse_ids)
+            sparse = np.zeros(len(candidates), dtype=np.float32)
+            sparse[np.searchsorted(candidates, sparse_ids)] = sparse_scores
+            scores = (HYBRID_DENSE_WEIGHT * doc_index.score(query_vector, candidates)
+                      + (1 - HYBRID_DENSE_WEIGHT) * sparse)
+    
+    best = int(np.argmax(scores))
+    similarity_max = scores[best]
+    
+    if similarity_max < umbral:
+        logging.info(f"La distancia hallada es de {similarity_max:.2f}")
+        logging.info(f"No se encontró un documento con similitud mayor a {umbral}.")
+        return None
+    
+    logging.info(f"Documento encontrado con similitud {similarity_max:.2f}")
+    return int(candidates[best]), float(similarity_max)
+
+
 def retrieve_document(query, vectorizer, doc_vectors, umbral = 0.10):
     # query: pregunta del cliente
     # vectorizer: vectorizador usado para el embbeding
-    # doc_vectors: embbeding de corpus
+    # doc_vectors: DenseIndex del corpus (o la matriz de embeddings)
     
     logging.info(f"Buscando similitudes..")
+    index = doc_vectors if isinstance(doc_vectors, DenseIndex) else DenseIndex(doc_vectors)
+    
     # Vectorizo la query:
     #query_vector = vectorizer.transform([query]) # tfidf method
     query_vector = vectorizer.encode([query]) # BERT method
     
-    # Busco similitudes
-    similarities = cosine_similarity(query_vector, doc_vectors).flatten()
-    
-    # Similitud maxima e indice
-    similarity_max = similarities.max()
-    most_similar_idx = similarities.argmax()
+    # Busco similitudes: similitud maxima e indice
+    scores, indices = index.search(query_vector, k=1)
+    similarity_max = scores[0, 0]
+    most_similar_idx = indices[0, 0]
     
     
     # Verificacion de umbral
@@ -108,21 +522,46 @@ def retrieve_document(query, vectorizer, doc_vectors, umbral = 0.10):
 
 
 
-# RAG:
-def rag(query):
-    query_pp = preprocess_query(query)
+def load_gazetteer():
+    # Liviano (JSON + productos.csv para los momentos): se carga aparte de load() para no esperar a los modelos
+    global gazetteer
     
-    document = retrieve_document(query_pp, vectorizer, doc_vectors)
+    with _gazetteer_lock:
+        if gazetteer is None:
+            try:
+                products = PATH_TO_PRODUCTS if os.path.exists(PATH_TO_PRODUCTS) else None
+                gazetteer = Gazetteer.from_json(PATH_TO_HIERARCHY, products)
+                logging.info(f"Gazetteer cargado: {len(gazetteer)} cultivos, productos y plagas")
+            except OSError as e:
+                logging.warning(f"No se pudo cargar {PATH_TO_HIERARCHY}: {e}")
+                gazetteer = False
     
-    # Verificamos que el documento supere el umbral establecido
-    if document == "Not found": 
-        return "No hemos hallado una respuesta adecuada, comuniquese con un experto."
-                
-    logging.info(f"Generando respuesta")
+    return gazetteer or None
+
+
+def structured_answer(query):
+    # Respuesta desde la jerarquia cultivo -> producto -> plaga, o None si la pregunta
+    # no queda resuelta y tiene que pasar por el RAG
+    if not STRUCTURED_ANSWERS:
+        return None
     
+    index = gazetteer if gazetteer is not None else load_gazetteer()
+    if not index:
+        return None
     
-   
-    PROMPT_TO_MODEL = f"""
+    with metrics.timer(RAG_SECONDS, etapa="estructurada"):
+        answer = index.answer(query)
+    if answer is not None:
+        RAG_ANSWERS.inc(origen="estructurada")
+        logging.info("Respuesta armada desde la jerarquia de productos")
+    return answer
+
+
+NO_ANSWER = "No hemos hallado una respuesta adecuada, comuniquese con un experto."
+
+
+def build_prompt(document, query):
+    return f"""
     Eres un experto en atencion al cliente, especializado en productos quimicos.
     Responde la pregunta basandote en el siguiente contexto:
 
@@ -132,22 +571,142 @@ def rag(query):
 
     La pregunta es: {query}
     """
-    answer = gen_model(PROMPT_TO_MODEL,
-                       max_length= 512,
-                       max_new_tokens = 400,
-                       truncation=True,
-                       num_return_sequences=1,
-                       temperature=0.8,
-                       top_k=20,  
-                       top_p=0.9,
-                       repetition_penalty=1.0,
-                       no_repeat_ngram_size=3)
-    
-    answer = answer[0]["generated_text"].split('"')[1]
+
+
+def _retrieve_for(query):
+    # Preproceso + busqueda del documento + cache de respuestas.
+    # Devuelve None si ningun documento supera el umbral, o (doc_idx, cache_key, respuesta en cache o None)
+    query_pp = preprocess_query(query)
+    
+    match = find_document(query_pp)
+    
+    # Verificamos que el documento supere el umbral establecido
+    if match is None: 
+        return None
+    
+    # Misma pregunta (normalizada) sobre el mismo documento: respondemos desde la cache
+    doc_idx, _ = match
+    cache_key = query_pp.lower()
+    cached = answer_cache.get(doc_idx, cache_key)
+    if cached is not None:
+        logging.info(f"Respuesta obtenida de la cache")
+    
+    return doc_idx, cache_key, cached
+
+
+# RAG:
+def rag(query, budget = None):
+    # budget: presupuesto de latencia en segundos (por defecto GEN_DEADLINE_S)
+    deadline = time.monotonic() + (budget or GEN_DEADLINE_S)
+    
+    answer = structured_answer(query)
+    if answer is not None:
+        return answer
+    
+    load()
+    found = _retrieve_for(query)
+    
+    if found is None:
+        RAG_ANSWERS.inc(origen="sin_documento")
+        return NO_ANSWER
+    
+    doc_idx, cache_key, cached = found
+    if cached is not None:
+        RAG_ANSWERS.inc(origen="cache")
+        return cached
+    
+    document = documents[doc_idx]
+                
+    logging.info(f"Generando respuesta")
+    
+    PROMPT_TO_MODEL = build_prompt(document, query)
+    
+    # Se agrupa con las preguntas concurrentes de otros chats (ver MicroBatcher)
+    with metrics.timer(RAG_SECONDS, etapa="generacion"):
+        generated = generator((PROMPT_TO_MODEL, deadline))
+    
+    answer = generation.finalize_answer(generated, document)
+    RAG_ANSWERS.inc(origen="generada")
+    
+    answer_cache.put(doc_idx, cache_key, answer)
     
     return answer
 
 
+def _generate_streaming(prompt, deadline, streamer, stop):
+    try:
+        generation.generate(gen_model, gen_tokenizer, [prompt], [deadline],
+                            max_prompt_tokens=GEN_MAX_PROMPT_TOKENS,
+                            extra_criteria=[generation.EventCriteria(stop)],
+                            streamer=streamer, **GEN_KWARGS)
+    except Exception as e:
+        logging.error(f"Fallo la generacion: {e}")
+        streamer.end()
+
+
+def rag_stream(query, budget = None):
+    """
+    Version incremental de rag(): es un generador que devuelve el texto de la
+    respuesta acumulado hasta el momento, a medida que el modelo produce tokens.
+    Termina con la respuesta final (mismo corte y deadline que rag()).
+    
+    """
+    from transformers import TextIteratorStreamer
+    
+    deadline = time.monotonic() + (budget or GEN_DEADLINE_S)
+    
+    answer = structured_answer(query)
+    if answer is not None:
+        yield answer
+        return
+    
+    load()
+    found = _retrieve_for(query)
+    
+    if found is None:
+        RAG_ANSWERS.inc(origen="sin_documento")
+        yield NO_ANSWER
+        return
+    
+    doc_idx, cache_key, cached = found
+    if cached is not None:
+        RAG_ANSWERS.inc(origen="cache")
+        yield cached
+        return
+    
+    document = documents[doc_idx]
+    
+    logging.info(f"Generando respuesta (streaming)")
+    
+    streamer = TextIteratorStreamer(gen_tokenizer, skip_prompt=True, skip_special_tokens=True)
+    stop = threading.Event()
+    thread = threading.Thread(target=_generate_streaming,
+                              args=(build_prompt(document, query), deadline, streamer, stop),
+                              name="gen-stream", daemon=True)
+    thread.start()
+    
+    generated = ""
+    start = time.perf_counter()
+    try:
+        for piece in streamer:
+            generated += piece
+            partial, complete = generation.extract_answer(generated)
+            if complete:
+                break
+            if partial:
+                yield partial
+    finally:
+        # Cortamos la generacion si ya tenemos la respuesta (o si el consumidor abandono)
+        stop.set()
+        RAG_SECONDS.observe(time.perf_counter() - start, etapa="generacion")
+    
+    answer = generation.finalize_answer(generated, document)
+    RAG_ANSWERS.inc(origen="generada")
+    yield answer
+    
+    answer_cache.put(doc_idx, cache_key, answer)
+
+
 # TESTEO
 
 #query = "Necesito saber como erradicar el nabo en la soja"
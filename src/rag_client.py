@@ -0,0 +1,93 @@
+import asyncio
+
+import httpx
+
+from rag_worker import PoolSaturado
+
+# Set up logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+class RagClient:
+    """
+    Cliente asincronico del servicio RAG (rag_service.py). Tiene la misma interfaz que
+    RagPool para bot_core: submit(query) devuelve un awaitable con la respuesta y lanza
+    PoolSaturado si ya hay max_pending consultas en curso desde este bot.
+
+    url: "http://127.0.0.1:8601" o "unix:///ruta/al/socket".
+    Solo se reintentan, con backoff exponencial, los errores al conectar (servicio
+    reiniciandose): ahi el pedido seguro no llego. Si la conexion se corta o vence el
+    timeout despues de enviarlo no, para no generar dos veces la misma respuesta.
+    Un 503 del servicio (su cola llena) tambien se informa como PoolSaturado.
+
+    """
+
+    executor = "service"
+
+    def __init__(self, url, max_pending = 8, timeout = 30.0, connect_timeout = 2.0,
+                 retries = 3, backoff = 0.25):
+        self.url = url
+        self.max_pending = max_pending
+        self.retries = retries
+        self.backoff = backoff
+        self._pending = 0
+
+        if url.startswith("unix://"):
+            transport = httpx.AsyncHTTPTransport(uds=url[len("unix://"):])
+            base_url = "http://rag"
+        else:
+            transport = httpx.AsyncHTTPTransport()
+            base_url = url
+
+        self._client = httpx.AsyncClient(base_url=base_url, transport=transport,
+                                         timeout=httpx.Timeout(timeout, connect=connect_timeout),
+                                         limits=httpx.Limits(max_connections=max_pending))
+
+        logger.info("Cliente del servicio RAG en %s, maximo %d consultas pendientes", url, max_pending)
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def submit(self, query, budget = None):
+        """Devuelve un asyncio.Task con la respuesta. Debe llamarse desde el event loop."""
+        if self._pending >= self.max_pending:
+            raise PoolSaturado()
+
+        self._pending += 1
+        task = asyncio.get_running_loop().create_task(self._answer(query, budget))
+        task.add_done_callback(self._release)
+        return task
+
+    async def _request(self, method, path, **kwargs):
+        for attempt in range(self.retries + 1):
+            try:
+                return await self._client.request(method, path, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * 2 ** attempt
+                logger.warning("Servicio RAG no disponible (%s), reintento en %.2fs", e, delay)
+                await asyncio.sleep(delay)
+
+    async def _answer(self, query, budget):
+        response = await self._request("POST", "/rag", json={"query": query, "budget": budget})
+
+        if response.status_code == 503:
+            raise PoolSaturado()
+        if response.status_code != 200:
+            raise RuntimeError(f"El servicio RAG respondio {response.status_code}: {response.text[:200]}")
+        return response.json()["answer"]
+
+    async def health(self):
+        response = await self._request("GET", "/health")
+        response.raise_for_status()
+        return response.json()
+
+    def _release(self, task):
+        self._pending -= 1
+
+    async def aclose(self):
+        logger.info("Cerrando cliente del servicio RAG (%d consultas pendientes)", self._pending)
+        await self._client.aclose()
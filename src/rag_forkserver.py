@@ -0,0 +1,19 @@
+"""
+Precarga del RAG para el executor 'fork' (RagPool(..., preload_module="rag_forkserver")).
+
+El forkserver de multiprocessing importa este modulo una vez al arrancar: los modelos
+quedan cargados en ese proceso, que no tiene otros threads, y cada worker que se forkea
+desde ahi (al inicio o al reconstruir el pool) los comparte copy-on-write. Si la carga
+falla el forkserver termina y RagPool.start() falla al crear los workers.
+
+"""
+import gc
+
+import rag as rg
+
+rg.preload_for_workers()
+
+# Lo cargado queda fuera del GC: sus recorridos no escriben los headers de esos objetos
+# en los workers y las paginas siguen compartidas
+gc.collect()
+gc.freeze()
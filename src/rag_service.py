@@ -0,0 +1,226 @@
+"""
+Servicio local de inferencia del RAG: expone rag.rag por HTTP (localhost o socket
+Unix) para que el bot no cargue los modelos en su proceso. El bot se reinicia en
+segundos y el servicio se escala o reinicia por su cuenta.
+
+    POST /rag     {"query": "...", "budget": 8.0}  ->  {"answer": "..."}
+                  503 si la cola esta llena (RagPool.max_pending)
+    GET  /health  {"ready": true, "pendientes": 0, "workers": 4, "executor": "thread"}
+
+Uso (desde src):
+    python rag_service.py --unix /tmp/ca_rag.sock
+    python rag_service.py --port 8601 --executor fork --workers 8 --cola 32
+
+y en config/cfg.py del bot: RAG_SERVICE_URL = "unix:///tmp/ca_rag.sock" (o "http://127.0.0.1:8601").
+El cliente del bot esta en rag_client.py.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+from http import HTTPStatus
+from pathlib import Path
+
+import rag as rg
+from rag_worker import RagPool, PoolSaturado, threads_per_worker
+import settings
+import metrics
+
+# Set up logging
+import logging
+logger = logging.getLogger(__name__)
+
+# Tamaño maximo del cuerpo de un pedido (una pregunta de chat)
+MAX_BODY = 64 * 1024
+
+# Espera maxima al cerrar por las consultas en curso (segundos)
+SHUTDOWN_TIMEOUT = 30
+
+SERVICE_SECONDS = metrics.histogram("rag_servicio_segundos", "Duracion de los pedidos al servicio RAG", ["ruta"])
+SERVICE_REQUESTS = metrics.counter("rag_servicio_pedidos", "Pedidos al servicio RAG por ruta y status",
+                                   ["ruta", "status"])
+
+
+class RagService:
+    """
+    Servidor HTTP/1.1 minimo (keep-alive, cuerpos JSON) sobre asyncio. Cada pedido a
+    /rag se ejecuta en el RagPool, que fija la concurrencia y el maximo de pendientes;
+    las generaciones concurrentes se agrupan en el micro-batcher de rag.py.
+
+    Las conexiones keep-alive del bot quedan abiertas entre pedidos: al cerrar,
+    close_connections() corta las que esperan un pedido y las que estan respondiendo
+    se cierran despues de enviar la respuesta.
+
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._idle = set()  # writers de conexiones esperando el proximo pedido
+        self._closing = False
+
+    def close_connections(self):
+        self._closing = True
+        for writer in list(self._idle):
+            writer.close()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while not self._closing:
+                self._idle.add(writer)
+                try:
+                    request = await self._read_request(reader)
+                finally:
+                    self._idle.discard(writer)
+                if request is None:
+                    break
+                method, path, headers, body = request
+
+                route = path.split("?")[0]
+                with metrics.timer(SERVICE_SECONDS, ruta=route):
+                    status, payload = await self.dispatch(method, route, body)
+                SERVICE_REQUESTS.inc(ruta=route, status=int(status))
+
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                writer.write(f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                             f"Content-Type: application/json; charset=utf-8\r\n"
+                             f"Content-Length: {len(data)}\r\n\r\n".encode("latin-1") + data)
+                await writer.drain()
+
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError) as e:
+            logger.debug("Conexion cerrada: %s", e)
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_request(reader):
+        request_line = await reader.readline()
+        if not request_line.strip():
+            return None
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length", 0))
+        if length > MAX_BODY:
+            raise ValueError(f"Cuerpo demasiado grande ({length} bytes)")
+        body = await reader.readexactly(length) if length else b""
+        return method, path, headers, body
+
+    async def dispatch(self, method, route, body):
+        if route == "/health" and method == "GET":
+            return HTTPStatus.OK, {"ready": self.pool.ready,
+                                   "pendientes": self.pool.pending,
+                                   "workers": self.pool.workers,
+                                   "executor": self.pool.executor}
+
+        if route != "/rag":
+            return HTTPStatus.NOT_FOUND, {"error": "ruta desconocida"}
+        if method != "POST":
+            return HTTPStatus.METHOD_NOT_ALLOWED, {"error": "usar POST"}
+
+        try:
+            request = json.loads(body)
+            query = request["query"]
+            budget = request.get("budget")
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return HTTPStatus.BAD_REQUEST, {"error": "se espera un JSON con 'query'"}
+
+        try:
+            answer = await self.pool.submit(query, budget)
+        except PoolSaturado:
+            return HTTPStatus.SERVICE_UNAVAILABLE, {"error": "saturado"}
+        except Exception as e:
+            logger.error("Fallo el RAG: %s", e)
+            return HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)}
+
+        return HTTPStatus.OK, {"answer": answer}
+
+
+async def serve(pool, host = "127.0.0.1", port = 8601, unix = None):
+    service = RagService(pool)
+
+    if unix:
+        # Un socket viejo de una ejecucion anterior impide hacer bind
+        if os.path.exists(unix):
+            os.unlink(unix)
+        server = await asyncio.start_unix_server(service.handle_connection, path=unix)
+        logger.info("Servicio RAG escuchando en unix://%s", unix)
+    else:
+        server = await asyncio.start_server(service.handle_connection, host, port)
+        logger.info("Servicio RAG escuchando en http://%s:%d", host, port)
+
+    # SIGINT/SIGTERM: dejamos de aceptar conexiones y esperamos las consultas en curso
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    try:
+        await stop.wait()
+    finally:
+        # Desde Python 3.12 wait_closed() espera tambien a las conexiones abiertas
+        server.close()
+        service.close_connections()
+        try:
+            await asyncio.wait_for(server.wait_closed(), SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Conexiones sin cerrar despues de %ds, se cierra igual", SHUTDOWN_TIMEOUT)
+
+    pool.shutdown(wait=True)
+    if unix and os.path.exists(unix):
+        os.unlink(unix)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description="Servicio local de inferencia del RAG")
+    parser.add_argument("--host", default=settings.get('RAG_SERVICE_HOST', "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=settings.get('RAG_SERVICE_PORT', 8601))
+    parser.add_argument("--unix", default=settings.get('RAG_SERVICE_SOCKET'),
+                        help="ruta de un socket Unix (en lugar de host/puerto)")
+    parser.add_argument("--executor", choices=("thread", "process", "fork"),
+                        default=settings.get('RAG_EXECUTOR', "thread"))
+    parser.add_argument("--workers", type=int, default=settings.get('RAG_WORKERS', 4))
+    parser.add_argument("--cola", type=int, default=settings.get('RAG_QUEUE_SIZE', 8),
+                        help="maximo de consultas en curso + en cola; por encima se responde 503")
+    parser.add_argument("--torch-threads", type=int, default=settings.get('RAG_TORCH_THREADS'))
+    parser.add_argument("--sin-warmup", action="store_true")
+    parser.add_argument("--metrics-port", type=int, default=settings.get('RAG_SERVICE_METRICS_PORT'))
+    args = parser.parse_args(argv)
+
+    run_warmup = not args.sin_warmup
+    pool = RagPool(rg.rag, workers=args.workers, max_pending=args.cola, executor=args.executor,
+                   initializer=rg.init_worker,
+                   initargs=(args.torch_threads or threads_per_worker(args.workers), run_warmup),
+                   preload_module="rag_forkserver")
+
+    # Los modelos se cargan antes de aceptar pedidos: en este proceso (thread), una vez en el
+    # forkserver antes de forkear (fork) o en cada worker (process)
+    def preload():
+        rg.load()
+        if run_warmup:
+            rg.warmup()
+    
+    pool.start(preload=preload if args.executor == "thread" else None)
+
+    if args.metrics_port:
+        metrics.start_http_server(args.metrics_port)
+
+    asyncio.run(serve(pool, args.host, args.port, args.unix))
+    return 0
+
+
+if __name__ == "__main__":
+    # rag.py resuelve las rutas del corpus relativas a src
+    os.chdir(Path(__file__).resolve().parent)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -0,0 +1,255 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import metrics
+
+# Set up logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+# Marca de fin de un stream
+_END = object()
+
+POOL_RESTARTS = metrics.counter("rag_pool_reinicios", "Reinicios del pool RAG por un worker caido", ["executor"])
+
+
+class PoolSaturado(Exception):
+    """La cola de consultas RAG esta llena, hay que reintentar mas tarde."""
+
+
+def available_cores():
+    # Nucleos que puede usar este proceso (respeta taskset / cgroups con afinidad)
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def threads_per_worker(workers, cores = None):
+    """Reparte los nucleos entre los workers: cada uno usa cores // workers threads de torch."""
+    return max(1, (cores or available_cores()) // max(1, workers))
+
+
+def _init_worker(ready, initializer, initargs):
+    # Corre en cada proceso worker recien creado, antes de tomar consultas
+    if initializer is not None:
+        initializer(*initargs)
+    try:
+        ready.wait(timeout=600)
+    except threading.BrokenBarrierError:
+        pass
+
+
+def _worker_pid():
+    return os.getpid()
+
+
+class RagPool:
+    """
+    Ejecuta una funcion bloqueante (rag.rag) fuera del event loop, en un pool de
+    threads o de procesos, con un maximo de consultas pendientes (en curso + en cola).
+
+    Cuando se alcanza ese maximo submit() lanza PoolSaturado en lugar de encolar,
+    asi la latencia de las consultas aceptadas queda acotada.
+
+    Con "fork" y "process" los workers no se forkean desde este proceso (que ya tiene el
+    event loop y otros threads: un hijo heredaria sus locks tomados) sino desde un
+    forkserver de multiprocessing, un proceso limpio y de un solo thread. Con "fork" el
+    forkserver importa preload_module, que carga los modelos una sola vez, y los workers
+    los comparten copy-on-write; con "process" cada worker carga los suyos.
+    initializer(*initargs) corre en cada worker antes de su primera consulta (threads de
+    torch, recursos que no sobreviven al fork) y start() espera a que todos terminen.
+    ready es True desde que start() vuelve.
+
+    Si un worker muere (OOM, segfault) el ProcessPoolExecutor queda roto: las consultas
+    en curso fallan con BrokenProcessPool y el pool se reconstruye en un thread aparte,
+    forkeando workers nuevos desde el mismo forkserver (los modelos siguen cargados ahi)
+    con una barrera nueva. Mientras tanto submit() lanza PoolSaturado.
+
+    """
+
+    def __init__(self, func, workers = 2, max_pending = 8, executor = "thread",
+                 initializer = None, initargs = (), preload_module = None):
+        self.func = func
+        self.workers = workers
+        self.executor = executor
+        self.max_pending = max_pending
+        self.initializer = initializer
+        self.initargs = initargs
+        self.preload_module = preload_module
+        self.restarts = 0
+        self._pending = 0
+        self._ready = None
+        self._started = False
+        self._restarting = False
+        self._restart_failed = False
+        self._timeout = 600
+        # Los pools de procesos se crean en start(): importar el modulo que arma el pool
+        # (p.ej. desde un worker) no deja executors ni semaforos a medio crear
+        self._executor = self._new_executor() if executor == "thread" else None
+
+        logger.info("Pool RAG: %d workers (%s), maximo %d consultas pendientes",
+                    workers, executor, max_pending)
+
+    def _new_executor(self):
+        if self.executor in ("fork", "process"):
+            # Todos los workers arrancan juntos y esperan en la barrera a estar listos
+            context = multiprocessing.get_context("forkserver")
+            self._ready = context.Barrier(self.workers + 1)
+            return ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                       initializer=_init_worker,
+                                       initargs=(self._ready, self.initializer, self.initargs))
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="rag")
+
+    def start(self, preload = None, timeout = 600):
+        """
+        Con executor "thread" corre preload() en este proceso. Con "fork" o "process"
+        levanta el forkserver (con "fork" importa ahi preload_module) y crea los workers.
+        Vuelve cuando todos los workers estan listos.
+
+        """
+        self._timeout = timeout
+
+        if preload is not None:
+            preload()
+
+        if self.executor == "thread":
+            self._started = True
+            return
+
+        # Sin la precarga por defecto de __main__. Aplica al arrancar el forkserver (y si
+        # muere, multiprocessing lo relanza con la misma lista)
+        preload_modules = [self.preload_module] if self.executor == "fork" and self.preload_module else []
+        multiprocessing.get_context("forkserver").set_forkserver_preload(preload_modules)
+
+        self._executor = self._new_executor()
+        self._start_workers(timeout)
+        self._started = True
+
+        logger.info("Pool RAG: %d workers (%s) listos, forkeados desde el forkserver", self.workers, self.executor)
+
+    def _start_workers(self, timeout):
+        # Con forkserver el executor crea un proceso por submit hasta llegar a workers:
+        # uno por worker para que todos lleguen a la barrera
+        pids = [self._executor.submit(_worker_pid) for _ in range(self.workers)]
+        try:
+            self._ready.wait(timeout=timeout)
+        except threading.BrokenBarrierError:
+            raise RuntimeError(f"Los workers RAG no estuvieron listos en {timeout}s")
+        for pid in pids:
+            pid.result()
+
+    @property
+    def ready(self):
+        return self._started
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def submit(self, *args):
+        """
+        Encola func(*args) y devuelve un asyncio.Future con el resultado.
+        Debe llamarse desde el event loop.
+
+        """
+        if self._pending >= self.max_pending:
+            raise PoolSaturado()
+
+        # Pool de procesos sin arrancar o reconstruyendose: sus workers todavia no atienden
+        loop = asyncio.get_running_loop()
+        if self.executor != "thread" and not self._started:
+            # Si la ultima reconstruccion fallo, se reintenta con esta consulta
+            if self._restart_failed:
+                self._restart_in_background(loop)
+            raise PoolSaturado()
+
+        try:
+            future = loop.run_in_executor(self._executor, self.func, *args)
+        except BrokenProcessPool:
+            self._restart_in_background(loop)
+            raise PoolSaturado()
+
+        self._pending += 1
+        future.add_done_callback(self._release)
+        return future
+
+    def stream(self, gen_func, *args):
+        """
+        Ejecuta el generador bloqueante gen_func(*args) en el pool y devuelve un
+        async iterator con los valores que va produciendo. Solo con executor "thread".
+        Debe llamarse desde el event loop.
+
+        """
+        if self.executor != "thread":
+            raise ValueError("El streaming requiere el executor 'thread'")
+        if self._pending >= self.max_pending:
+            raise PoolSaturado()
+
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+
+        def produce():
+            try:
+                for chunk in gen_func(*args):
+                    loop.call_soon_threadsafe(chunks.put_nowait, (chunk, None))
+            except Exception as e:
+                loop.call_soon_threadsafe(chunks.put_nowait, (_END, e))
+            else:
+                loop.call_soon_threadsafe(chunks.put_nowait, (_END, None))
+
+        self._pending += 1
+        future = loop.run_in_executor(self._executor, produce)
+        future.add_done_callback(self._release)
+        return self._consume(chunks)
+
+    async def _consume(self, chunks):
+        while True:
+            chunk, error = await chunks.get()
+            if error is not None:
+                raise error
+            if chunk is _END:
+                return
+            yield chunk
+
+    def _release(self, future):
+        self._pending -= 1
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            self._restart_in_background(asyncio.get_running_loop())
+
+    def _restart_in_background(self, loop):
+        # Corre en el event loop: una sola reconstruccion aunque fallen varias consultas juntas
+        if self._restarting:
+            return
+        self._restarting = True
+        self._started = False
+        loop.run_in_executor(None, self._restart)
+
+    def _restart(self):
+        logger.error("Un worker del pool RAG murio, reconstruyendo el pool (%s)", self.executor)
+        try:
+            # Los workers nuevos salen del forkserver, no de este proceso con threads
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._new_executor()
+            self._start_workers(self._timeout)
+            self._started = True
+        except Exception as e:
+            self._restart_failed = True
+            logger.error("No se pudo reconstruir el pool RAG: %s", e)
+        else:
+            self._restart_failed = False
+            self.restarts += 1
+            POOL_RESTARTS.inc(executor=self.executor)
+            logger.warning("Pool RAG reconstruido (%d reinicios)", self.restarts)
+        finally:
+            self._restarting = False
+
+    def shutdown(self, wait = True):
+        logger.info("Cerrando pool RAG (%d consultas pendientes)", self._pending)
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
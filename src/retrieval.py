@@ -0,0 +1,132 @@
+import numpy as np
+
+# Set up logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+def l2_normalize(vectors):
+    # Normaliza filas a norma 1 (float32); las filas nulas quedan en cero
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k(similarities, k):
+    """
+    Devuelve (scores, indices) de los k mayores valores de cada fila, ordenados
+    de mayor a menor. Usa argpartition, asi el costo es lineal en el tamaño del corpus.
+
+    """
+    n = similarities.shape[1]
+    k = min(k, n)
+
+    if k < n:
+        idx = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    else:
+        idx = np.tile(np.arange(n), (similarities.shape[0], 1))
+
+    scores = np.take_along_axis(similarities, idx, axis=1)
+    order = np.argsort(-scores, axis=1, kind="stable")
+
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(idx, order, axis=1)
+
+
+class DenseIndex:
+    """
+    Indice de similitud coseno sobre los embeddings del corpus.
+
+    Guarda los vectores normalizados (float32) una sola vez, de modo que cada
+    consulta es un unico producto matricial + argpartition. Acepta lotes de consultas.
+
+    Con n_lists > 0 construye ademas un indice aproximado IVF: agrupa los documentos
+    con k-means esferico y en cada consulta solo compara contra los n_probe grupos
+    con centroide mas cercano. Pensado para corpus mucho mas grandes que el actual.
+
+    """
+
+    def __init__(self, doc_vectors, n_lists = 0, n_probe = 8, normalized = False, seed = 0):
+        # Si los vectores ya vienen normalizados (p.ej. un memmap) no hacemos copia
+        if normalized:
+            self.vectors = np.asarray(doc_vectors, dtype=np.float32)
+        else:
+            self.vectors = l2_normalize(doc_vectors)
+
+        self.n_probe = n_probe
+        self.centroids = None
+
+        if n_lists and n_lists < len(self.vectors):
+            self._build_ivf(n_lists, seed)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def search(self, query_vectors, k = 1):
+        """
+        query_vectors: array (n_consultas, dim) o un unico vector.
+        Devuelve (scores, indices), ambos de forma (n_consultas, k).
+
+        """
+        queries = l2_normalize(query_vectors)
+
+        if self.centroids is None:
+            return top_k(queries @ self.vectors.T, k)
+
+        return self._search_ivf(queries, k)
+
+    def score(self, query_vector, doc_ids):
+        # Similitud coseno de una query contra documentos puntuales (p.ej. candidatos BM25)
+        query = l2_normalize(query_vector)[0]
+        return self.vectors[np.asarray(doc_ids, dtype=np.int64)] @ query
+
+    ################ IVF ################
+
+    def _build_ivf(self, n_lists, seed, n_iter = 20):
+        rng = np.random.default_rng(seed)
+        vectors = self.vectors
+
+        # k-means esferico: asignacion por producto interno, centroides re-normalizados
+        centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+        for _ in range(n_iter):
+            assign = np.argmax(vectors @ centroids.T, axis=1)
+
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, vectors)
+            counts = np.bincount(assign, minlength=n_lists)
+
+            # Los grupos vacios se reinician con un documento al azar
+            empty = counts == 0
+            if empty.any():
+                sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+
+            centroids = l2_normalize(sums)
+
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+
+        # Listas invertidas: ids de documentos ordenados por grupo + offsets de cada grupo
+        self.centroids = centroids
+        self._list_ids = np.argsort(assign, kind="stable")
+        self._list_offsets = np.concatenate(([0], np.cumsum(np.bincount(assign, minlength=n_lists))))
+
+        logger.info("Indice IVF: %d documentos en %d grupos", len(vectors), n_lists)
+
+    def _search_ivf(self, queries, k):
+        n_probe = min(self.n_probe, len(self.centroids))
+        _, probes = top_k(queries @ self.centroids.T, n_probe)
+
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+
+        for i, query in enumerate(queries):
+            candidates = np.concatenate([
+                self._list_ids[self._list_offsets[c]:self._list_offsets[c + 1]] for c in probes[i]
+            ])
+            if len(candidates) == 0:
+                continue
+
+            s, pos = top_k((self.vectors[candidates] @ query)[np.newaxis, :], k)
+            scores[i, :s.shape[1]] = s[0]
+            indices[i, :s.shape[1]] = candidates[pos[0]]
+
+        return scores, indices
@@ -0,0 +1,122 @@
+import threading
+import time
+
+# Set up logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+class Session:
+    """
+    Datos de la conversacion de un chat. Usa __slots__ para que cada sesion
+    ocupe lo minimo posible aun con muchos chats simultaneos.
+
+    """
+    __slots__ = ('query_type', 'provincia', 'departamento', 'localidad', 'opciones', 'opciones_id',
+                 'last_start_time', 'last_seen')
+
+    def __init__(self):
+        self.query_type = None #RTV or DTM
+        self.provincia = None
+        self.departamento = None
+        self.localidad = None
+        self.opciones = None # sugerencias de ubicacion mostradas como botones
+        self.opciones_id = None # nonce del teclado de esas sugerencias
+        self.last_start_time = None
+        self.last_seen = time.monotonic()
+
+    # Campos que se guardan (last_seen es del reloj monotonico del proceso, no sobrevive un reinicio)
+    PERSISTED = ('query_type', 'provincia', 'departamento', 'localidad', 'opciones', 'opciones_id',
+                 'last_start_time')
+
+    def snapshot(self):
+        return {name: getattr(self, name) for name in self.PERSISTED}
+
+    @classmethod
+    def restore(cls, data):
+        session = cls()
+        for name, value in data.items():
+            if name in cls.PERSISTED:
+                setattr(session, name, value)
+        return session
+
+    def reset(self):
+        # Vaciamos los datos de la busqueda, conservando el ultimo /start
+        self.query_type = None
+        self.provincia = None
+        self.departamento = None
+        self.localidad = None
+        self.opciones = None
+        self.opciones_id = None
+
+
+class SessionStore:
+    """
+    Sesiones por chat_id con expiracion (TTL) de conversaciones abandonadas.
+    La limpieza se hace al acceder, como maximo una vez cada sweep_interval segundos.
+
+    Con store (persistence.StateStore) las sesiones sobreviven a un reinicio: save()
+    deja la sesion pendiente de grabar y get() trae de disco, la primera vez que se
+    pide, la sesion de ese chat si no vencio.
+
+    """
+
+    TIPO = "sesion"
+
+    def __init__(self, ttl = 1800, sweep_interval = 60, store = None):
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self.store = store
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, chat_id):
+        now = time.monotonic()
+
+        with self._lock:
+            if now - self._last_sweep >= self.sweep_interval:
+                self._evict_expired(now)
+
+            session = self._sessions.get(chat_id)
+            if session is None:
+                session = self._load(chat_id) or Session()
+                self._sessions[chat_id] = session
+            session.last_seen = now
+
+        return session
+
+    def _load(self, chat_id):
+        # Lectura puntual por clave primaria en SQLite local
+        if self.store is None:
+            return None
+        data = self.store.get(self.TIPO, str(chat_id), max_age=self.ttl)
+        return Session.restore(data) if data else None
+
+    def save(self, chat_id):
+        if self.store is None:
+            return
+        session = self._sessions.get(chat_id)
+        if session is not None:
+            self.store.set(self.TIPO, str(chat_id), session.snapshot())
+
+    def discard(self, chat_id):
+        with self._lock:
+            self._sessions.pop(chat_id, None)
+        if self.store is not None:
+            self.store.delete(self.TIPO, str(chat_id))
+
+    def _evict_expired(self, now):
+        expired = [chat_id for chat_id, session in self._sessions.items()
+                   if now - session.last_seen > self.ttl]
+        for chat_id in expired:
+            del self._sessions[chat_id]
+            if self.store is not None:
+                self.store.delete(self.TIPO, str(chat_id))
+
+        self._last_sweep = now
+        if expired:
+            logger.info("Sesiones expiradas: %d (activas: %d)", len(expired), len(self._sessions))
@@ -0,0 +1,15 @@
+# Opciones opcionales de config/cfg.py para los modulos que no son bot_core
+# (rag, servicios auxiliares). Si cfg no existe se usan los valores por defecto.
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent / "config"))
+
+try:
+    import cfg
+except ImportError:
+    cfg = None
+
+
+def get(name, default = None):
+    return getattr(cfg, name, default)
@@ -0,0 +1,84 @@
+from query_cache import LRUCache
+
+# Set up logging
+import logging
+logger = logging.getLogger(__name__)
+
+# Componentes de es_core_news_sm que no usamos: solo necesitamos lemas y puntuacion,
+# que dependen de tok2vec + morphologizer + attribute_ruler + lemmatizer.
+UNUSED_COMPONENTS = ["parser", "ner", "senter"]
+
+
+def load_stopwords():
+    import nltk
+    from nltk.corpus import stopwords
+
+    # Solo se descargan si no estan instaladas
+    try:
+        return set(stopwords.words('spanish'))
+    except LookupError:
+        nltk.download('stopwords', quiet=True)
+        return set(stopwords.words('spanish'))
+
+
+class Preprocessor:
+    """
+    Lematizacion + eliminacion de stopwords y puntuacion, compartida por la query
+    (rag.preprocess_query) y el corpus (create_corpus_rag.py), asi ambos lados
+    quedan normalizados igual.
+
+    Carga spaCy sin parser ni NER y memoiza el resultado por token (texto -> lema, o
+    vacio si es stopword o puntuacion): si todos los tokens de una consulta ya se
+    vieron, solo corre el tokenizer. Si aparece alguno nuevo corre el pipeline completo
+    sobre la consulta, asi los lemas salen con contexto. El modo por lotes (nlp.pipe,
+    para el corpus) siempre corre el pipeline y deja sus tokens en la cache, con lo
+    que las consultas se lematizan igual que el corpus.
+
+    """
+
+    def __init__(self, model = "es_core_news_sm", cache_size = 50000, batch_size = 256):
+        import spacy
+
+        self.nlp = spacy.load(model, exclude=UNUSED_COMPONENTS)
+        self.stop_words = load_stopwords()
+        self.batch_size = batch_size
+        self.cache = LRUCache(cache_size)  # texto del token -> lema ("" si se descarta)
+
+        logger.info("spaCy %s cargado con: %s", model, ", ".join(self.nlp.pipe_names))
+
+    def _token_result(self, token):
+        # Lematización y eliminación de stopwords
+        if token.text.lower() in self.stop_words or token.is_punct:
+            return ""
+        return token.lemma_
+
+    def _lemmas(self, doc):
+        results = [self._token_result(token) for token in doc]
+        for token, result in zip(doc, results):
+            self.cache.put(token.text, result)
+        return results
+
+    @staticmethod
+    def _join(results):
+        return " ".join(result for result in results if result)
+
+    def process(self, text):
+        doc = self.nlp.make_doc(text)  # solo el tokenizer
+        results = [self.cache.get(token.text) for token in doc]
+        if None in results:
+            # Algun token nuevo: resto del pipeline sobre el doc ya tokenizado
+            results = self._lemmas(self.nlp(doc))
+        return self._join(results)
+
+    def process_batch(self, texts, n_process = 1):
+        """
+        Procesa una lista de textos con nlp.pipe (los repetidos una sola vez) y devuelve
+        los resultados en orden. No consulta la cache: el corpus se lematiza con contexto.
+
+        """
+        unique = list(dict.fromkeys(texts))
+        results = {}
+        for text, doc in zip(unique, self.nlp.pipe(unique, batch_size=self.batch_size, n_process=n_process)):
+            results[text] = self._join(self._lemmas(doc))
+
+        return [results[text] for text in texts]
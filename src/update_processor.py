@@ -0,0 +1,49 @@
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Set up logging
+import logging
+logger = logging.getLogger(__name__)
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Procesa updates de distintos chats en paralelo (hasta max_concurrent_updates) y los
+    de un mismo chat de a uno, en orden de llegada.
+
+    El ConversationHandler elige el handler segun el estado guardado del chat: si un
+    boton o un texto se procesara mientras el handler anterior todavia no devolvio el
+    estado nuevo, se compararia contra el estado viejo y se descartaria.
+
+    Cada chat con updates en curso tiene un asyncio.Lock (FIFO); se descarta cuando no
+    queda ningun update de ese chat esperando.
+
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self._locks = {}  # chat_id -> [lock, updates que lo usan]
+
+    async def do_process_update(self, update, coroutine):
+        chat = update.effective_chat if isinstance(update, Update) else None
+        if chat is None:
+            await coroutine
+            return
+
+        entry = self._locks.setdefault(chat.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[chat.id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
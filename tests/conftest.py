@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Los modulos del bot se importan como top-level desde src (igual que al correr bot_core.py)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
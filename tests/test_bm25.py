@@ -0,0 +1,83 @@
+import math
+
+import numpy as np
+import pytest
+
+from bm25 import BM25Index
+
+
+CORPUS = [
+    "mosca blanca soja insecticida control",
+    "isoca bolillera soja control larva",
+    "sanguinaria avena herbicida",
+    "mosca blanca mosca blanca tomate invernadero",
+    "fertilizacion trigo nitrogeno",
+    "glifosato presiembra herbicida malezas soja",
+]
+
+
+def _bm25(query, texts, k1 = 1.5, b = 0.75):
+    # Formula directa, documento por documento
+    docs = [text.split() for text in texts]
+    avgdl = sum(len(d) for d in docs) / len(docs)
+    scores = []
+    for doc in docs:
+        score = 0.0
+        for term in set(query.split()):
+            df = sum(term in d for d in docs)
+            if not df:
+                continue
+            idf = math.log1p((len(docs) - df + 0.5) / (df + 0.5))
+            tf = doc.count(term)
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(doc) / avgdl))
+        scores.append(score)
+    return scores
+
+
+@pytest.fixture(scope="module")
+def index():
+    return BM25Index.from_texts(CORPUS)
+
+
+@pytest.mark.parametrize("query", ["mosca blanca", "soja control", "herbicida avena", "trigo"])
+def test_scores_match_formula(index, query):
+    expected = _bm25(query, CORPUS)
+    scores, ids = index.search(query, k=len(CORPUS), normalize=False)
+    for score, doc in zip(scores, ids):
+        assert score == pytest.approx(expected[doc], rel=1e-5)
+    # Solo los documentos con algun termino, de mayor a menor
+    assert sorted(ids.tolist()) == [i for i, s in enumerate(expected) if s > 0]
+    assert list(scores) == sorted(scores, reverse=True)
+
+
+def test_ranking(index):
+    _, ids = index.search("mosca blanca", k=2)
+    assert ids.tolist() == [3, 0]
+    _, ids = index.search("isoca soja", k=1)
+    assert ids.tolist() == [1]
+
+
+def test_normalized_scores_in_unit_range():
+    # Terminos muy repetidos en un documento corto: el score se acerca a la cota pero no la pasa
+    index = BM25Index.from_texts(CORPUS + ["plaga " * 50, "plaga"])
+    for query in ["mosca blanca", "plaga", "soja herbicida control", "plaga mosca"]:
+        scores, _ = index.search(query, k=len(index))
+        assert len(scores) and np.all(scores >= 0) and np.all(scores < 1)
+
+
+def test_unknown_terms(index):
+    scores, ids = index.search("palabra inexistente", k=5)
+    assert len(scores) == 0 and len(ids) == 0
+
+
+def test_save_and_load(index, tmp_path):
+    path = tmp_path / "bm25.npz"
+    index.save(path, "corpus-1")
+    assert BM25Index.load(path, "corpus-2") is None
+
+    loaded = BM25Index.load(path, "corpus-1")
+    for query in ["mosca blanca", "soja control"]:
+        expected = index.search(query, k=3)
+        got = loaded.search(query, k=3)
+        assert got[1].tolist() == expected[1].tolist()
+        assert np.allclose(got[0], expected[0])
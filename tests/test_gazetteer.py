@@ -0,0 +1,37 @@
+import pytest
+
+from gazetteer import Gazetteer
+
+
+HIERARCHY = {
+    "Soja": {"Productos": {"Alika": {"Controla a": ["Mosca blanca", "Isoca bolillera"]}}},
+    "Avena": {"Productos": {"Herbax": {"Controla a": ["Sanguinaria"]}}},
+}
+
+
+@pytest.fixture(scope="module")
+def gazetteer():
+    return Gazetteer(HIERARCHY)
+
+
+@pytest.mark.parametrize("query", [
+    "Cómo combato la isoca bolillera",
+    "Tengo sanguinaria en mi cultivo de avena, qué uso?",
+    "Qué producto me recomendás para la mosca blanca en soja?",
+])
+def test_control_questions_are_answered(gazetteer, query):
+    assert gazetteer.answer(query).startswith("Para controlar")
+
+
+@pytest.mark.parametrize("query", [
+    "Es toxico para las abejas lo que uso contra la mosca blanca?",
+    "Que dosis de Alika uso para mosca blanca",
+    "Cuando aplico algo contra la isoca bolillera?",
+    "Necesito ayuda con la Mosca Blanca",
+])
+def test_other_questions_go_to_rag(gazetteer, query):
+    assert gazetteer.answer(query) is None
+
+
+def test_needs_a_single_pest(gazetteer):
+    assert gazetteer.answer("Qué uso contra la mosca blanca y la isoca bolillera?") is None
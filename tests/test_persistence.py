@@ -0,0 +1,113 @@
+import sqlite3
+import threading
+
+import pytest
+
+from persistence import StateStore
+
+
+@pytest.fixture
+def path(tmp_path):
+    return tmp_path / "estado.sqlite"
+
+
+def test_set_get_and_flush(path):
+    # Intervalo largo: solo graba el flush explicito
+    store = StateStore(path, write_interval=3600)
+    store.set("sesion", 1, {"provincia": "CORDOBA"})
+    store.set("sesion", 2, {"provincia": "SALTA"})
+    store.set("sesion", 1, {"provincia": "SANTA FE"})
+    store.delete("sesion", 2)
+
+    # Lo pendiente se ve antes de grabar, con el ultimo valor de cada clave
+    assert store.get("sesion", 1) == {"provincia": "SANTA FE"}
+    assert store.get("sesion", 2) is None
+    assert store.pending == 2
+
+    assert store.flush() == 2
+    assert store.pending == 0
+    assert store.flush() == 0
+    assert store.get("sesion", 1) == {"provincia": "SANTA FE"}
+    assert store.items("sesion") == {"1": {"provincia": "SANTA FE"}}
+    store.close()
+
+
+def test_reload_after_close(path):
+    store = StateStore(path, write_interval=3600)
+    store.set("conversacion:c", [10, 20], 3)
+    store.set("sesion", 10, {"query_type": 2})
+    store.close()  # graba lo pendiente
+
+    reloaded = StateStore(path)
+    assert reloaded.get("conversacion:c", [10, 20]) == 3
+    assert reloaded.items("sesion") == {"10": {"query_type": 2}}
+    assert reloaded.get("sesion", 10, max_age=0) is None
+    reloaded.close()
+
+
+def test_no_writer_thread_until_first_write(path):
+    store = StateStore(path, write_interval=0.01)
+    assert not any(t.name == "state-writer" for t in threading.enumerate())
+    store.set("sesion", 1, "x")
+    assert any(t.name == "state-writer" for t in threading.enumerate())
+    store.close()
+
+
+def test_pending_visible_until_commit(path):
+    store = StateStore(path, write_interval=3600)
+    store.set("sesion", 1, "viejo")
+    store.flush()
+    store.set("sesion", 1, "nuevo")
+
+    # Mientras el COMMIT esta en curso el valor sigue pendiente y visible
+    seen = []
+    real = store._conn
+
+    class Watching:
+        def execute(self, sql, *args):
+            if sql == "COMMIT":
+                seen.append(store.get("sesion", 1))
+            return real.execute(sql, *args)
+
+        def executemany(self, *args):
+            return real.executemany(*args)
+
+    store._conn = Watching()
+    store.flush()
+    store._conn = real
+
+    assert seen == ["nuevo"]
+    assert store.pending == 0
+    store.close()
+
+
+def test_failed_commit_keeps_newer_values(path):
+    store = StateStore(path, write_interval=3600)
+    store.set("sesion", 1, "a")
+    store.set("sesion", 2, "b")
+
+    real = store._conn
+
+    class Failing:
+        def execute(self, sql, *args):
+            if sql == "COMMIT":
+                # Llega un valor nuevo mientras se graba, y el COMMIT falla
+                store.set("sesion", 1, "c")
+                raise sqlite3.OperationalError("disco lleno")
+            return real.execute(sql, *args)
+
+        def executemany(self, *args):
+            return real.executemany(*args)
+
+    store._conn = Failing()
+    assert store.flush() == 0
+    store._conn = real
+
+    assert store.get("sesion", 1) == "c"
+    assert store.get("sesion", 2) == "b"
+    assert store.flush() == 2
+    store.close()
+
+    reloaded = StateStore(path)
+    assert reloaded.items("sesion") == {"1": "c", "2": "b"}
+    reloaded.close()
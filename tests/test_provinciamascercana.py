@@ -0,0 +1,88 @@
+import random
+
+import pytest
+
+import provinciamascercana as pmc
+
+
+def _vocabulario(n, seed = 0):
+    rng = random.Random(seed)
+    letras = "ABCDEFGHIJLMNOPRSTUVZ"
+    palabras = ["".join(rng.choice(letras) for _ in range(rng.randint(3, 10))) for _ in range(n)]
+    # Nombres de varias palabras, con tildes y repetidos (distinta grafia, mismo normalizado)
+    palabras += ["General Paz", "GENERAL PAZ", "Villa María", "VILLA MARIA", "Río Cuarto", "Marcos Paz"]
+    return palabras
+
+
+def _sufijos(termino):
+    return [termino] + [termino[i + 1:] for i, c in enumerate(termino) if c == " "]
+
+
+def _perturbar(texto, rng):
+    # Hasta tres ediciones al azar: sustitucion, insercion o borrado
+    texto = list(texto)
+    for _ in range(rng.randint(0, 3)):
+        i = rng.randrange(len(texto) + 1)
+        operacion = rng.choice("sib")
+        if operacion == "s" and i < len(texto):
+            texto[i] = rng.choice("AEIOUXYZ")
+        elif operacion == "i":
+            texto.insert(i, rng.choice("AEIOUXYZ"))
+        elif operacion == "b" and i < len(texto) and len(texto) > 1:
+            del texto[i]
+    return "".join(texto)
+
+
+@pytest.mark.parametrize("umbral", [1, 2, 3])
+def test_bktree_coincide_con_recorrido_lineal(umbral):
+    vocabulario = _vocabulario(400)
+    indice = pmc.IndiceDifuso(vocabulario)
+    rng = random.Random(umbral)
+
+    consultas = [_perturbar(rng.choice(vocabulario), rng) for _ in range(300)]
+    consultas += ["".join(rng.choice("ABCDEFG") for _ in range(6)) for _ in range(50)]
+    for consulta in consultas:
+        esperado = pmc.encontrar_provincia_mas_cercana(consulta, vocabulario, umbral)
+        assert indice.buscar(consulta, umbral) == esperado, consulta
+
+
+def test_bktree_exacta_y_lote():
+    indice = pmc.IndiceDifuso(["Villa María", "VILLA MARIA", "Río Cuarto"])
+    assert len(indice) == 2
+    assert indice.buscar("villa maria", 0) == "Villa María"
+    assert indice.buscar_lote(["rio cuarto", "rio cuartoo", "xyz"], 1) == ["Río Cuarto", "Río Cuarto", None]
+
+
+def test_prefijos_ordena_inicio_frecuencia_y_aparicion():
+    indice = pmc.IndicePrefijos(["Marcos Paz", "General Paz", "GENERAL PAZ", "Paraná", "Pampa", "Villa María"])
+    # Primero las que empiezan con el texto (por frecuencia, despues aparicion), luego las de otra palabra
+    assert indice.sugerir("pa") == ["Paraná", "Pampa", "General Paz", "Marcos Paz"]
+    assert indice.sugerir("Gen") == ["General Paz"]
+    assert indice.sugerir("maria") == ["Villa María"]
+    assert indice.sugerir("zzz") == []
+    assert indice.sugerir("") == []
+
+
+def test_prefijos_exacta_y_limite():
+    indice = pmc.IndicePrefijos(["Pampa", "Pampa de los Guanacos", "Pampayasta"], max_sugerencias=2)
+    assert indice.sugerir("pampa") == ["Pampa"]
+    assert indice.sugerir("pamp") == ["Pampa", "Pampa de los Guanacos"]
+    assert indice.sugerir("pamp", n=1) == ["Pampa"]
+
+
+def test_prefijos_coincide_con_filtro_lineal():
+    vocabulario = _vocabulario(300, seed=1)
+    indice = pmc.IndicePrefijos(vocabulario, max_sugerencias=len(vocabulario))
+    normalizados = {}
+    for loc in vocabulario:
+        normalizados.setdefault(" ".join(pmc.normalizar_texto(loc).split()), loc)
+
+    rng = random.Random(1)
+    for termino in rng.sample(sorted(normalizados), 50):
+        prefijo = termino[:2]
+        if prefijo in normalizados:
+            continue
+        # Un termino completa el prefijo desde el comienzo de cualquiera de sus palabras
+        esperado = {loc for t, loc in normalizados.items()
+                    if any(palabra.startswith(prefijo) for palabra in _sufijos(t))}
+        assert set(indice.sugerir(prefijo)) == esperado